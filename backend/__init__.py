@@ -5,7 +5,9 @@ from dotenv import load_dotenv
 import pandas as pd
 from flask_cors import CORS
 from .config import DevelopmentConfig
-from .redis_client import get_redis_client  # new
+from .redis_client import get_redis_client, get_redis_binary_client
+from .metrics import start_pusher
+from .user_store import migrate_lists
 
 def create_app(config_class=None):
     app = Flask(__name__)
@@ -20,7 +22,8 @@ def create_app(config_class=None):
         r"/*": {
             "origins": app.config['CORS_ALLOWED_ORIGINS'],
             "methods": ["GET", "POST", "OPTIONS"],
-            "allow_headers": ["Content-Type", "Authorization"],
+            "allow_headers": ["Content-Type", "Authorization", "If-None-Match"],
+            "expose_headers": ["ETag", "X-Chain-Version"],
             "Content-Type": "application/json"
         }
     }, supports_credentials=True)
@@ -29,6 +32,14 @@ def create_app(config_class=None):
     load_dotenv()
     redis_client = get_redis_client()
     app.redis_client = redis_client
+    app.redis_binary_client = get_redis_binary_client()
+    # share this process's request metrics with the other gunicorn workers' /metrics
+    start_pusher(redis_client)
+    # one-shot copy of the legacy user lists into the indexed store
+    try:
+        migrate_lists(redis_client)
+    except redis.RedisError as e:
+        app.logger.warning(f"User list migration skipped: {e}")
 
     from .main import main_bp
     app.register_blueprint(main_bp)
@@ -0,0 +1,174 @@
+"""
+asyncio worker mode: one event loop drives every configured instrument.
+
+The shared RefreshScheduler (backend.scheduler) decides which instrument is
+due and which access token has capacity for it; this loop starts those
+refreshes, at most WORKER_CONCURRENCY in flight. HTTP goes through
+AsyncDhanClient and Redis through redis.asyncio, so hundreds of instruments
+cost one thread instead of one thread each.
+
+Selected with WORKER_MODE=async; `python -m backend.bg_worker` stays the
+entry point.
+"""
+import asyncio
+import logging
+import os
+import time
+
+from .chain_delta import last_version
+from .expiry_calendar import aget_expiry_list, tracked_expiries
+from .main import (DEMAND_INTERVAL, STATS_INTERVAL, apply_demand, build_scheduler,
+                   chain_keys, demand_chains, instrument_list, mark_nine_thirty_stored,
+                   nine_thirty_due, nine_thirty_levels, queue_chain_writes, record_history,
+                   settle_chain_writes)
+from .redis_client import get_redis_client
+from .chain_store import chain_id
+from .metrics import CHAIN_REFRESHES, DHAN_FETCH_SECONDS, REDIS_COMMAND_SECONDS, mark_refreshed
+from .scheduler import publish_refresh_stats
+from .viewers import queue_viewer_counts, viewer_counts
+
+logger = logging.getLogger(__name__)
+
+WORKER_CONCURRENCY = int(os.getenv('WORKER_CONCURRENCY', 32))
+
+
+async def acache_option_chain(redis_client, scrip_id, segment, expiry_date, chain_data, front_month=True):
+    """cache_option_chain() for a redis.asyncio client."""
+    started = time.perf_counter()
+    nine_thirty_data = None
+    if front_month and nine_thirty_due(scrip_id, segment):
+        # once a day; the levels code is synchronous, keep it off the event loop
+        nine_thirty_data = await asyncio.to_thread(nine_thirty_levels, chain_data,
+                                                   scrip_id, segment, get_redis_client())
+    pipe = redis_client.pipeline()
+    # processing, IV/Greeks and history reads are CPU and disk work: run them
+    # off the event loop (queuing on the pipeline sends nothing), keep only
+    # the round trip on it
+    written = await asyncio.to_thread(queue_chain_writes, pipe, scrip_id, segment, expiry_date, chain_data,
+                                      front_month=front_month, nine_thirty_data=nine_thirty_data)
+    replies = []
+    if pipe.command_stack:
+        with REDIS_COMMAND_SECONDS.time('MULTI'):
+            replies = await pipe.execute()
+    history = settle_chain_writes(written, replies)
+    if history is not None:
+        await asyncio.to_thread(record_history, history)
+    key = chain_id(scrip_id, segment, expiry_date)
+    mark_refreshed(key, last_version(key))
+    if nine_thirty_data is not None:
+        mark_nine_thirty_stored(scrip_id, segment)
+    return time.perf_counter() - started
+
+
+async def arefresh_option_chain(dhan_client, redis_client, scrip_id, segment, rank=0):
+    """refresh_option_chain() on AsyncDhanClient + redis.asyncio."""
+    expiries = tracked_expiries(await aget_expiry_list(dhan_client, redis_client, scrip_id, segment))
+    if not expiries:
+        logger.error(f"No expiry list for {scrip_id} {segment}, retrying")
+        return False
+    if rank >= len(expiries):
+        return True
+    expiry_date = expiries[rank]
+    option_chain = await dhan_client.fetch_option_chain(underlying_scrip=scrip_id,
+                                                        underlying_seg=segment,
+                                                        expiry=expiry_date)
+    if option_chain.get('status') != 'success':
+        logger.error(f"Failed to fetch option chain for {scrip_id} in {segment}. Status: {option_chain.get('status')}. Retrying...")
+        return False
+
+    chain_call = dhan_client.last_call or {}
+    DHAN_FETCH_SECONDS.observe(chain_call.get('total_latency', 0), f"{scrip_id}_{segment}", rank)
+    write_time = await acache_option_chain(redis_client, scrip_id, segment, expiry_date,
+                                           option_chain.get('data', {}), front_month=(rank == 0))
+
+    logger.info("fetched option chain for: %s %s (fetch %.0f ms, attempts=%s, write %.1f ms)",
+                scrip_id, expiry_date, chain_call.get('total_latency', 0) * 1000,
+                chain_call.get('attempts'), write_time * 1000)
+    return True
+
+
+async def run_async_worker(redis_client, dhan_clients, instruments, concurrency=WORKER_CONCURRENCY):
+    """
+    redis_client: redis.asyncio client
+    dhan_clients: list of AsyncDhanClient instances, one per access token
+    instruments: pandas.DataFrame with columns ['scrip_id','segment', ...]
+    """
+    if len(dhan_clients) == 0:
+        logger.error("No Dhan clients available in run_async_worker")
+        return
+    items = instrument_list(instruments)
+    if not items:
+        logger.error("No instruments to refresh")
+        return
+
+    keys = chain_keys(items)
+    scheduler = build_scheduler(dhan_clients, keys)
+    slots = asyncio.Semaphore(concurrency)
+    wakeup = asyncio.Event()
+    running = set()
+
+    async def refresh(item, token):
+        ok = False
+        result = 'error'
+        try:
+            ok = await arefresh_option_chain(dhan_clients[token], redis_client, *item)
+            result = 'ok' if ok else 'failed'
+        except Exception as e:
+            logger.error(f"Error refreshing option chain for {item[0]}: {e}")
+        finally:
+            CHAIN_REFRESHES.inc(f"{item[0]}_{item[1]}", result)
+            scheduler.complete(item, token, ok)
+            slots.release()
+            wakeup.set()
+
+    async def report_stats():
+        while True:
+            await asyncio.sleep(STATS_INTERVAL)
+            try:
+                await publish_refresh_stats(redis_client, scheduler)
+                logger.info("Refresh rates/min: %s tokens: %s",
+                            scheduler.refresh_rates(), scheduler.token_stats())
+            except Exception as e:
+                logger.error(f"Could not publish refresh stats: {e}")
+
+    async def track_demand():
+        while True:
+            try:
+                pairs = demand_chains(keys)
+                counts = []
+                if pairs:
+                    pipe = queue_viewer_counts(redis_client.pipeline(transaction=False),
+                                               [chain for _, chain in pairs])
+                    counts = viewer_counts(await pipe.execute())
+                apply_demand(scheduler, pairs, counts)
+                wakeup.set()
+            except Exception as e:
+                logger.error(f"Could not read viewer demand: {e}")
+            await asyncio.sleep(DEMAND_INTERVAL)
+
+    logger.info("Async worker scheduling %d instruments x %d expiries (concurrency=%d)",
+                len(items), len(keys) // len(items), concurrency)
+    stats_task = asyncio.create_task(report_stats())
+    demand_task = asyncio.create_task(track_demand())
+    try:
+        while True:
+            wakeup.clear()
+            item, token, wait = scheduler.next_dispatch()
+            if item is None:
+                try:
+                    await asyncio.wait_for(wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await slots.acquire()
+            task = asyncio.create_task(refresh(item, token))
+            running.add(task)
+            task.add_done_callback(running.discard)
+    finally:
+        stats_task.cancel()
+        demand_task.cancel()
+        for task in running:
+            task.cancel()
+        for client in dhan_clients:
+            await client.close()
+        await redis_client.aclose()
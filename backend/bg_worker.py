@@ -1,34 +1,77 @@
 # backend/worker.py
+import asyncio
 import os
 from dotenv import load_dotenv
 import pandas as pd
-from .dhan_client import DhanClient
+from .dhan_client import DhanClient, AsyncDhanClient
 from .main import background_task
-from .redis_client import get_redis_client
+from .metrics import start_metrics_server
+from .redis_client import get_redis_client, get_async_redis_client
+
+def build_clients(client_id, access_tokens, asynchronous=False):
+    """
+    One Dhan client per access token. DHAN_REPLAY_DIR serves recorded chains
+    instead of calling Dhan, DHAN_RECORD_DIR records live responses (see
+    backend.dhan_replay).
+    """
+    replay_dir = os.getenv('DHAN_REPLAY_DIR')
+    record_dir = os.getenv('DHAN_RECORD_DIR')
+    if replay_dir:
+        from .dhan_replay import AsyncReplayDhanClient, ReplayDhanClient, faults_from_env, tape_from_env
+        tape, faults = tape_from_env(), faults_from_env()
+        client_class = AsyncReplayDhanClient if asynchronous else ReplayDhanClient
+        return [client_class(tape, faults) for _ in range(max(1, len(access_tokens)))]
+    if record_dir:
+        from .dhan_replay import AsyncRecordingDhanClient, RecordingDhanClient, TapeRecorder
+        recorder = TapeRecorder(record_dir)
+        client_class = AsyncRecordingDhanClient if asynchronous else RecordingDhanClient
+        return [client_class(client_id, os.getenv(token), recorder=recorder) for token in access_tokens]
+    client_class = AsyncDhanClient if asynchronous else DhanClient
+    return [client_class(client_id, os.getenv(token)) for token in access_tokens]
 
 def run_worker():
-    # use for local testing/development 
+    # use for local testing/development
     # load_dotenv(os.path.join(os.path.dirname(__file__), '.env.dev'))
     # use for docker deployment
     load_dotenv()
-    redis_client = get_redis_client()
+    # Both modes dispatch refreshes from the shared RefreshScheduler.
+    # threads: a pool of WORKER_THREADS blocking refreshes.
+    # async: one event loop with up to WORKER_CONCURRENCY refreshes in flight.
+    worker_mode = os.getenv('WORKER_MODE', 'threads').lower()
 
     CLIENT_ID = os.getenv('CLIENT_ID')
     ACCESS_TOKENS = os.getenv('ACCESS_TOKENS').split(',') if os.getenv('ACCESS_TOKENS') else []
 
-    if not CLIENT_ID or not ACCESS_TOKENS:
+    if os.getenv('DHAN_REPLAY_DIR'):
+        # recorded chains are served around the clock
+        os.environ.setdefault('MARKET_ALWAYS_OPEN', '1')
+    elif not CLIENT_ID or not ACCESS_TOKENS:
         raise ValueError("CLIENT_ID or ACCESS_TOKENS not configured in environment")
 
-    dh_clients = [DhanClient(CLIENT_ID, os.getenv(token)) for token in ACCESS_TOKENS]
-
     csv_path = os.path.join(os.path.dirname(__file__), 'Dependencies', 'my_instruments.csv')
     try:
         instruments = pd.read_csv(csv_path)
     except FileNotFoundError:
         raise FileNotFoundError(f"The file '{csv_path}' was not found.")
 
+    # Prometheus scrape target for this process (METRICS_PORT, 0 disables)
+    start_metrics_server()
+
+    if worker_mode == 'async':
+        print("Starting async background task...")
+        asyncio.run(_run_async(CLIENT_ID, ACCESS_TOKENS, instruments))
+        return
+
+    redis_client = get_redis_client()
+    dh_clients = build_clients(CLIENT_ID, ACCESS_TOKENS)
+
     print("Starting background task...")
     background_task(redis_client, dh_clients, instruments)
 
+async def _run_async(client_id, access_tokens, instruments):
+    from .async_worker import run_async_worker
+    dh_clients = build_clients(client_id, access_tokens, asynchronous=True)
+    await run_async_worker(get_async_redis_client(), dh_clients, instruments)
+
 if __name__ == "__main__":
-    run_worker()
\ No newline at end of file
+    run_worker()
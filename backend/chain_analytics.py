@@ -0,0 +1,122 @@
+"""
+Chain-wide open-interest analytics added to the processed totals.
+
+    max_pain        settlement strike at which option holders collect the least:
+                    argmin over K_j of sum_i call_oi_i * max(K_j - K_i, 0)
+                                     + sum_i put_oi_i * max(K_i - K_j, 0)
+    call_oi_walls   the OI_WALLS strikes with the highest call / put OI,
+    put_oi_walls    highest first: [{'strike', 'oi'}, ...]
+    pcr_trend       intraday total PCR, one point per minute (worker only)
+
+Max pain splits each sum at K_j, so with prefix sums over the ascending
+strikes of OI and of OI * strike every candidate costs O(1):
+
+    calls: K_j * sum_{i<j} call_oi_i - sum_{i<j} call_oi_i * K_i
+    puts:  sum_{i>j} put_oi_i * K_i - K_j * sum_{i>j} put_oi_i
+
+and the whole chain O(strikes) instead of O(strikes^2). The walls use
+np.argpartition, also linear, and sort only the OI_WALLS picked.
+
+The PCR trend needs the previous snapshots, so the worker keeps it per chain
+in process memory: the total PCR of the first snapshot written in each IST
+minute, reset at the start of a trading day. A restarted worker rebuilds the
+day's points from the intraday history when it is enabled. The totals carry
+the day's first point and the last PCR_TREND_POINTS points; /api/get_history
+has every snapshot.
+
+Usage:
+    totals.update(oi_analytics(strikes, call_oi, put_oi))
+    totals['pcr_trend'] = pcr_trend(scrip_id, segment, expiry, totals)
+"""
+import os
+import threading
+import time
+
+import numpy as np
+
+from . import history_store
+from .chain_store import chain_id
+
+OI_WALLS = int(os.getenv('OI_WALLS', 3))
+PCR_TREND_INTERVAL_MS = 60 * 1000
+PCR_TREND_POINTS = int(os.getenv('PCR_TREND_POINTS', 30))
+
+# chain id -> {'day': date, 'points': [[minute ms, pcr_oi, pcr_vol], ...]}
+_trends = {}
+_trends_lock = threading.Lock()
+
+
+def max_pain(strikes, call_oi, put_oi):
+    """Max pain strike of ascending `strikes`, None for an empty chain or no OI."""
+    strikes = np.asarray(strikes, dtype=float)
+    call_oi = np.asarray(call_oi, dtype=float)
+    put_oi = np.asarray(put_oi, dtype=float)
+    if not len(strikes) or not (call_oi.any() or put_oi.any()):
+        return None
+    # exclusive prefix sums: calls struck below K_j pay at K_j
+    calls_below = np.cumsum(call_oi) - call_oi
+    call_value_below = np.cumsum(call_oi * strikes) - call_oi * strikes
+    # exclusive suffix sums: puts struck above K_j pay at K_j
+    puts_above = put_oi.sum() - np.cumsum(put_oi)
+    put_value_above = (put_oi * strikes).sum() - np.cumsum(put_oi * strikes)
+    pain = (strikes * calls_below - call_value_below) + (put_value_above - strikes * puts_above)
+    return float(strikes[int(np.argmin(pain))])
+
+
+def top_oi(strikes, oi, k=OI_WALLS):
+    """The k strikes with the highest non-zero OI, highest first (lower strike on ties)."""
+    oi = np.asarray(oi)
+    k = min(k, len(oi))
+    if k <= 0:
+        return []
+    picked = np.argpartition(-oi, k - 1)[:k] if k < len(oi) else np.arange(len(oi))
+    picked = picked[np.lexsort((picked, -oi[picked]))]
+    return [{'strike': float(strikes[i]), 'oi': int(oi[i])} for i in picked.tolist() if oi[i] > 0]
+
+
+def oi_analytics(strikes, call_oi, put_oi):
+    return {
+        'max_pain': max_pain(strikes, call_oi, put_oi),
+        'call_oi_walls': top_oi(strikes, call_oi),
+        'put_oi_walls': top_oi(strikes, put_oi),
+    }
+
+
+def _history_points(scrip_id, segment, expiry, day):
+    # first recorded snapshot of every minute of the day so far
+    records = history_store.read_totals(scrip_id, segment, expiry, day)
+    if not len(records):
+        return []
+    minutes = records['ts'] // PCR_TREND_INTERVAL_MS
+    _, first = np.unique(minutes, return_index=True)
+    return [[int(minute) * PCR_TREND_INTERVAL_MS, pcr_oi, pcr_vol] for minute, pcr_oi, pcr_vol in
+            zip(minutes[first].tolist(), records['total_pcr_oi'][first].tolist(),
+                records['total_pcr_vol'][first].tolist())]
+
+
+def pcr_trend(scrip_id, segment, expiry, totals, now_ms=None):
+    """
+    Record the chain's total PCR for the current minute (first snapshot of
+    the minute wins) and return {'interval_ms', 'open': point, 'points':
+    [point, ...]}, a point being [minute (epoch ms), pcr_oi, pcr_vol].
+    """
+    now_ms = now_ms if now_ms is not None else time.time_ns() // 1_000_000
+    minute = now_ms // PCR_TREND_INTERVAL_MS * PCR_TREND_INTERVAL_MS
+    day = history_store.trading_day(now_ms)
+    key = chain_id(scrip_id, segment, expiry)
+    with _trends_lock:
+        entry = _trends.get(key)
+    if entry is None or entry['day'] != day:
+        points = []
+        if history_store.enabled():
+            try:
+                points = _history_points(scrip_id, segment, expiry, day)
+            except OSError:
+                points = []
+        entry = {'day': day, 'points': points}
+    points = entry['points']
+    if not points or points[-1][0] < minute:
+        points.append([minute, totals.get('total_pcr_oi', 0), totals.get('total_pcr_vol', 0)])
+    with _trends_lock:
+        _trends[key] = entry
+    return {'interval_ms': PCR_TREND_INTERVAL_MS, 'open': points[0], 'points': points[-PCR_TREND_POINTS:]}
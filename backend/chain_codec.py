@@ -0,0 +1,99 @@
+"""
+Storage codec for raw option chains cached under `option_chain:*`.
+
+CHAIN_CODEC selects how the worker encodes a chain before writing it:
+
+    json            plain JSON text, as before (default)
+    json+zlib       JSON, zlib-compressed
+    msgpack+zlib    MessagePack, zlib-compressed
+    msgpack+zstd    MessagePack, zstd-compressed
+
+Anything but plain JSON starts with a 6-byte header (b"\\0OC1", serializer id,
+compressor id), so readers never need the setting: decode_chain() detects
+the format from the stored bytes and also accepts legacy JSON text. That
+lets the worker switch codecs without a coordinated API rollout. msgpack
+and zstandard are imported only when a codec that needs them is used.
+
+Read encoded chains through the binary client (get_redis_binary_client);
+the text client would try to UTF-8 decode them.
+
+Usage:
+    pipe.set(key, encode_chain(chain_data), ex=300)
+    chain_data = decode_chain(binary_client.get(key))
+"""
+import json
+import os
+import zlib
+
+CHAIN_CODEC = os.getenv('CHAIN_CODEC', 'json')
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 3
+
+MAGIC = b"\x00OC1"
+_SERIALIZERS = {'json': b'j', 'msgpack': b'm'}
+_COMPRESSORS = {None: b'-', 'zlib': b'z', 'zstd': b's'}
+
+
+def _parse(codec):
+    serializer, _, compressor = codec.partition('+')
+    compressor = compressor or None
+    if serializer not in _SERIALIZERS or compressor not in _COMPRESSORS:
+        raise ValueError(f"Unknown CHAIN_CODEC {codec!r}")
+    return serializer, compressor
+
+
+def _serialize(obj, serializer):
+    if serializer == 'msgpack':
+        import msgpack
+        return msgpack.packb(obj, use_bin_type=True)
+    return json.dumps(obj, separators=(",", ":")).encode('utf-8')
+
+
+def _deserialize(data, serializer_id):
+    if serializer_id == _SERIALIZERS['msgpack']:
+        import msgpack
+        return msgpack.unpackb(data, raw=False)
+    return json.loads(data)
+
+
+def _compress(data, compressor):
+    if compressor == 'zlib':
+        return zlib.compress(data, ZLIB_LEVEL)
+    if compressor == 'zstd':
+        import zstandard
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return data
+
+
+def _decompress(data, compressor_id):
+    if compressor_id == _COMPRESSORS['zlib']:
+        return zlib.decompress(data)
+    if compressor_id == _COMPRESSORS['zstd']:
+        import zstandard
+        return zstandard.ZstdDecompressor().decompress(data)
+    return data
+
+
+def encode_chain(chain_data, codec=None):
+    """bytes (or str for plain JSON) to store for `chain_data` under `codec` (default CHAIN_CODEC)."""
+    codec = codec or CHAIN_CODEC
+    if codec == 'json':
+        return json.dumps(chain_data)
+    serializer, compressor = _parse(codec)
+    body = _compress(_serialize(chain_data, serializer), compressor)
+    return MAGIC + _SERIALIZERS[serializer] + _COMPRESSORS[compressor] + body
+
+
+def decode_chain(stored):
+    """Chain dict from a stored value in any supported format; None stays None."""
+    if stored is None:
+        return None
+    if isinstance(stored, str):
+        return json.loads(stored)
+    if not stored.startswith(MAGIC):
+        return json.loads(stored)
+    header = len(MAGIC)
+    serializer_id, compressor_id = stored[header:header + 1], stored[header + 1:header + 2]
+    if serializer_id not in _SERIALIZERS.values() or compressor_id not in _COMPRESSORS.values():
+        raise ValueError(f"Unknown chain format {stored[:header + 2]!r}")
+    return _deserialize(_decompress(stored[header + 2:], compressor_id), serializer_id)
@@ -0,0 +1,130 @@
+"""
+Change detection between consecutive processed chains.
+
+The worker remembers, per chain, a hash of every strike row and of the
+chain-wide fields (underlying price, ATM strike, totals) of the snapshot it
+last wrote. A fetch whose rows and header all hash the same is not written
+again; only the TTLs are refreshed once they are half spent. A fetch that
+changed something is written in full and, alongside the usual version
+notification, published on delta_channel() as a compact delta:
+
+    {"version": <new>, "base_version": <previous or null>,
+     "underlying_price": ..., "atm_strike": ..., "totals": {...},
+     "rows": [<changed or added rows>], "removed": [<strikes gone>]}
+
+Applying `rows`/`removed` to the snapshot `base_version` yields snapshot
+`version`; a consumer holding any other version must reload the full chain.
+base_version is null after a worker restart.
+
+Writers that apply deltas to stored state (chain_store.queue_rows) rewrite
+it in full at least every TOUCH_AFTER seconds (full_write_due), so a lost or
+evicted key cannot leave a partial layout behind for long. A TTL refresh
+that finds a key gone (Redis restarted, failed over or evicted it) calls
+forget(), so the next fetch writes the chain in full even if unchanged.
+
+Hashes use Python's hash() and live only in the worker process.
+
+Usage:
+    state = compare(chain_key, payload)
+    if state.changed: ... write, publish delta_message(state, version) ...
+    remember(chain_key, state.snapshot(version, full=state.full_write_due))
+"""
+import threading
+import time
+
+from .chain_store import SNAPSHOT_TTL, render_snapshot
+
+# Refresh the TTLs of an unchanged chain once this much of them has passed
+TOUCH_AFTER = SNAPSHOT_TTL / 2
+
+_previous = {}
+_previous_lock = threading.Lock()
+
+
+def row_hashes(payload):
+    """{strike: hash of the processed row}"""
+    return {row['strike']: hash(tuple(row.items())) for row in payload.get('chain', [])}
+
+
+def header_hash(payload):
+    return hash(render_snapshot({key: value for key, value in payload.items() if key != 'chain'}))
+
+
+class ChainState:
+    """Hashes of one processed chain compared with the last snapshot written for it."""
+
+    def __init__(self, payload, previous):
+        self.payload = payload
+        self.previous = previous
+        self.rows = row_hashes(payload)
+        self.header = header_hash(payload)
+
+    @property
+    def changed(self):
+        prev = self.previous
+        return prev is None or prev['header'] != self.header or prev['rows'] != self.rows
+
+    @property
+    def touch_due(self):
+        return time.time() - self.previous['refreshed_at'] >= TOUCH_AFTER
+
+    @property
+    def full_write_due(self):
+        return self.previous is None or time.time() - self.previous['full_written_at'] >= TOUCH_AFTER
+
+    def changed_rows(self):
+        old = self.previous['rows'] if self.previous else {}
+        return [row for row in self.payload.get('chain', []) if old.get(row['strike']) != self.rows[row['strike']]]
+
+    def removed_strikes(self):
+        old = self.previous['rows'] if self.previous else {}
+        return [strike for strike in old if strike not in self.rows]
+
+    def snapshot(self, version, full=True):
+        """What remember() keeps after snapshot `version` was written (full: not as a delta)."""
+        now = time.time()
+        return {'rows': self.rows, 'header': self.header, 'version': version, 'refreshed_at': now,
+                'full_written_at': now if full else self.previous['full_written_at']}
+
+    def touched(self):
+        """remember() value after only the TTLs of the previous snapshot were refreshed."""
+        return {**self.previous, 'refreshed_at': time.time()}
+
+
+def compare(chain_key, payload):
+    with _previous_lock:
+        previous = _previous.get(chain_key)
+    return ChainState(payload, previous)
+
+
+def remember(chain_key, snapshot):
+    with _previous_lock:
+        _previous[chain_key] = snapshot
+
+
+def forget(chain_key):
+    with _previous_lock:
+        _previous.pop(chain_key, None)
+
+
+def last_version(chain_key):
+    """Version of the snapshot last written for the chain, None if unknown."""
+    with _previous_lock:
+        previous = _previous.get(chain_key)
+    return previous['version'] if previous else None
+
+
+def delta_message(state, version) -> bytes:
+    """Delta from the previous snapshot to `version`, rendered like a snapshot body."""
+    payload = state.payload
+    base = state.previous['version'] if state.previous else None
+    return render_snapshot({
+        'version': version,
+        'base_version': base,
+        'underlying_price': payload.get('underlying_price'),
+        'atm_strike': payload.get('atm_strike'),
+        'totals': payload.get('totals'),
+        # after a restart there is nothing to diff against; consumers reload
+        'rows': state.changed_rows() if base is not None else [],
+        'removed': state.removed_strikes(),
+    })
@@ -0,0 +1,176 @@
+"""
+Columnar option-chain engine.
+
+Loads the Dhan `oc` mapping into NumPy arrays once (sorted by strike) and
+derives every per-strike and chain-wide figure with array operations instead
+of a Python loop per strike.
+
+Usage:
+    from backend.chain_engine import ChainColumns
+    payload = ChainColumns.from_chain(chain_data).to_payload()
+"""
+import numpy as np
+
+from .chain_analytics import oi_analytics
+
+# Dhan leg field -> column suffix
+LEG_FIELDS = {
+    'last_price': 'ltp',
+    'previous_close_price': 'prev_close',
+    'oi': 'oi',
+    'previous_oi': 'prev_oi',
+    'volume': 'vol',
+    'implied_volatility': 'iv',
+}
+
+# Order of keys in each processed row (matches the original per-strike dict)
+ROW_FIELDS = (
+    'strike', 'pcr_oi', 'pcr_vol', 'call_iv', 'call_tv', 'call_oi_chg', 'call_oi',
+    'call_vol', 'call_chg_pct', 'call_ltp', 'put_ltp', 'put_chg_pct', 'put_vol',
+    'put_oi', 'put_oi_chg', 'put_tv', 'put_iv',
+)
+
+
+def strike_key(strike) -> str:
+    """Strike as a JSON object key, in Dhan's `oc` format: "25000.000000"."""
+    return f"{float(strike):.6f}"
+
+
+def round2(values):
+    """
+    Vectorized equivalent of Python's round(x, 2).
+
+    np.round scales by 100 and rounds half-to-even on the scaled binary value,
+    which can disagree with round() only when x sits on a decimal tie; those
+    few elements are re-rounded with round() so the output stays identical.
+    """
+    values = np.asarray(values, dtype=float)
+    rounded = np.round(values, 2)
+    scaled = values * 100
+    distance = np.abs(np.abs(scaled - np.trunc(scaled)) - 0.5)
+    near_tie = distance < 1e-7 * np.maximum(1.0, np.abs(scaled))
+    if near_tie.any():
+        rounded[near_tie] = [round(v, 2) for v in values[near_tie].tolist()]
+    return rounded
+
+
+def _safe_ratio(num, den):
+    # num / den where den > 0, else 0 (mirrors the `if x > 0 else 0` guards)
+    out = np.zeros(len(num), dtype=float)
+    np.divide(num, den, out=out, where=den > 0)
+    return out
+
+
+def _pct_change(ltp, prev):
+    # (ltp - prev) / prev * 100, in that order, like the scalar code
+    out = np.zeros(len(ltp), dtype=float)
+    np.divide(ltp - prev, prev, out=out, where=prev != 0)
+    return out * 100
+
+
+class ChainColumns:
+    """Column arrays for one option chain, sorted by ascending strike."""
+
+    def __init__(self, underlying_price, strikes, columns):
+        self.underlying_price = underlying_price
+        self.strikes = strikes
+        self.columns = columns
+
+    @classmethod
+    def from_chain(cls, chain_data):
+        underlying_price = chain_data.get('last_price', 0)
+        oc = chain_data.get('oc', {}) or {}
+
+        items = sorted(((float(k), v or {}) for k, v in oc.items()), key=lambda kv: kv[0])
+        strikes = np.array([k for k, _ in items], dtype=float)
+
+        columns = {}
+        for side, prefix in (('ce', 'call'), ('pe', 'put')):
+            legs = [row.get(side) or {} for _, row in items]
+            for field, suffix in LEG_FIELDS.items():
+                # np.asarray keeps integer columns (oi, volume) as int64
+                col = np.asarray([leg.get(field, 0) for leg in legs])
+                if col.size == 0:
+                    col = np.zeros(0, dtype=np.int64)
+                elif col.dtype == object:
+                    col = col.astype(float)
+                columns[f"{prefix}_{suffix}"] = col
+        return cls(underlying_price, strikes, columns)
+
+    def __len__(self):
+        return len(self.strikes)
+
+    def atm_index(self):
+        """Index of the strike nearest the underlying (lower strike on ties)."""
+        n = len(self.strikes)
+        if n == 0:
+            return None
+        price = self.underlying_price
+        i = int(np.searchsorted(self.strikes, price))
+        if i == n or (i > 0 and price - self.strikes[i - 1] <= self.strikes[i] - price):
+            return i - 1
+        return i
+
+    def atm_strike(self):
+        idx = self.atm_index()
+        return None if idx is None else float(self.strikes[idx])
+
+    def derived(self):
+        """Per-strike derived columns keyed by output row field."""
+        c = self.columns
+        S, K = self.underlying_price, self.strikes
+        call_intrinsic = np.maximum(S - K, 0)
+        put_intrinsic = np.maximum(K - S, 0)
+        return {
+            'strike': K,
+            'pcr_oi': round2(_safe_ratio(c['put_oi'], c['call_oi'])),
+            'pcr_vol': round2(_safe_ratio(c['put_vol'], c['call_vol'])),
+            'call_iv': round2(c['call_iv']),
+            'call_tv': round2(c['call_ltp'] - call_intrinsic),
+            'call_oi_chg': c['call_oi'] - c['call_prev_oi'],
+            'call_oi': c['call_oi'],
+            'call_vol': c['call_vol'],
+            'call_chg_pct': round2(_pct_change(c['call_ltp'], c['call_prev_close'])),
+            'call_ltp': round2(c['call_ltp']),
+            'put_ltp': round2(c['put_ltp']),
+            'put_chg_pct': round2(_pct_change(c['put_ltp'], c['put_prev_close'])),
+            'put_vol': c['put_vol'],
+            'put_oi': c['put_oi'],
+            'put_oi_chg': c['put_oi'] - c['put_prev_oi'],
+            'put_tv': round2(c['put_ltp'] - put_intrinsic),
+            'put_iv': round2(c['put_iv']),
+        }
+
+    def totals(self):
+        c = self.columns
+        total_call_oi = c['call_oi'].sum().item()
+        total_call_vol = c['call_vol'].sum().item()
+        total_put_oi = c['put_oi'].sum().item()
+        total_put_vol = c['put_vol'].sum().item()
+        total_pcr_oi = (total_put_oi / total_call_oi) if total_call_oi > 0 else 0
+        total_pcr_vol = (total_put_vol / total_call_vol) if total_call_vol > 0 else 0
+        return {
+            'total_pcr_oi': round(total_pcr_oi, 2),
+            'total_pcr_vol': round(total_pcr_vol, 2),
+            'total_call_oi': total_call_oi,
+            'total_call_vol': total_call_vol,
+            'total_put_oi': total_put_oi,
+            'total_put_vol': total_put_vol,
+            'total_call_oi_chg': (c['call_oi'] - c['call_prev_oi']).sum().item(),
+            'total_put_oi_chg': (c['put_oi'] - c['put_prev_oi']).sum().item(),
+            **oi_analytics(self.strikes, c['call_oi'], c['put_oi']),
+        }
+
+    def rows(self):
+        """Processed rows as plain Python dicts, ready for json.dumps."""
+        derived = self.derived()
+        lists = [derived[name].tolist() for name in ROW_FIELDS]
+        return [dict(zip(ROW_FIELDS, values)) for values in zip(*lists)]
+
+    def to_payload(self):
+        return {
+            'underlying_price': self.underlying_price,
+            'atm_strike': self.atm_strike(),
+            'chain': self.rows(),
+            'totals': self.totals(),
+        }
@@ -0,0 +1,270 @@
+"""
+Processed option-chain snapshots.
+
+The worker renders the `/api/get_option_chain` response body once per fetch and
+stores it, together with a gzipped copy, so the API workers can hand the bytes
+straight to the client without parsing or re-serializing anything.
+
+After each write the worker publishes on update_channel() so streaming
+clients (/api/stream/option_chain) are pushed one message per real update.
+
+Every write also records a per-chain version and a content hash in the
+snapshot's meta hash; the hash doubles as the HTTP ETag so unchanged chains
+can be answered with 304 Not Modified. Versions are millisecond timestamps
+made strictly increasing per chain by the writing process (next_version), so
+a write needs no round trip before its MULTI/EXEC.
+
+Views of a snapshot limited to `window` strikes each side of the underlying
+(see window_payload) are cached per snapshot version in a small hash holding
+body, gzipped body and etag. The worker pre-renders PRECOMPUTED_WINDOWS; any
+other window is rendered by the first API request that asks for it.
+
+Every key is per (underlying, expiry); see chain_id().
+
+The processed rows are also kept strike by strike: a hash keyed by strike
+(plus a `_head` field with version, underlying price, ATM strike and totals)
+and a sorted set of strikes scored by strike. The worker updates both in the
+same MULTI/EXEC as the snapshot (queue_rows), so a window that was not
+pre-rendered is read with ZRANGEBYSCORE + HMGET (load_row_window) instead of
+fetching and parsing the whole chain.
+
+Usage:
+    from backend.chain_store import store_snapshot, load_snapshot, publish_update
+    _, version, _ = store_snapshot(redis_client, scrip_id, segment, expiry, payload)
+    publish_update(redis_client, scrip_id, segment, expiry, version)
+
+    # or queued into a caller's transaction together with other writes
+    _, version, _ = queue_snapshot(pipe, scrip_id, segment, expiry, payload)
+    publish_update(pipe, scrip_id, segment, expiry, version)
+    body, encoding = load_snapshot(binary_client, scrip_id, segment, expiry, accept_gzip=True)
+    version, etag = load_snapshot_meta(redis_client, scrip_id, segment, expiry)
+    etag, body, encoding = load_window(binary_client, scrip_id, segment, expiry, version, 12, 'descending')
+"""
+import bisect
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+
+# Bump when the layout of the stored body changes so old and new
+# workers/APIs never read each other's snapshots during a rollout.
+SNAPSHOT_FORMAT = "v1"
+SNAPSHOT_TTL = 300
+GZIP_LEVEL = 6
+
+ORDERS = ('ascending', 'descending')
+# Strikes-each-side windows rendered by the worker with every snapshot
+PRECOMPUTED_WINDOWS = tuple(int(w) for w in os.getenv('CHAIN_WINDOWS', '12').split(',') if w.strip())
+
+_last_versions = {}
+_versions_lock = threading.Lock()
+
+def chain_id(scrip_id, segment, expiry):
+    return f"{scrip_id}_{segment}_{expiry}"
+
+def snapshot_key(scrip_id, segment, expiry):
+    return f"processed_chain:{SNAPSHOT_FORMAT}:{chain_id(scrip_id, segment, expiry)}"
+
+def snapshot_gzip_key(scrip_id, segment, expiry):
+    return f"{snapshot_key(scrip_id, segment, expiry)}:gz"
+
+def snapshot_meta_key(scrip_id, segment, expiry):
+    return f"{snapshot_key(scrip_id, segment, expiry)}:meta"
+
+def rows_key(scrip_id, segment, expiry):
+    return f"{snapshot_key(scrip_id, segment, expiry)}:rows"
+
+def strikes_key(scrip_id, segment, expiry):
+    return f"{snapshot_key(scrip_id, segment, expiry)}:strikes"
+
+def strike_field(strike) -> str:
+    return repr(float(strike))
+
+def window_key(scrip_id, segment, expiry, version, window, order):
+    span = 'all' if window is None else f"w{window}"
+    return f"{snapshot_key(scrip_id, segment, expiry)}:{version}:{span}:{order}"
+
+def update_channel(scrip_id, segment, expiry):
+    return f"chain_updates:{chain_id(scrip_id, segment, expiry)}"
+
+def delta_channel(scrip_id, segment, expiry):
+    # per-strike deltas between snapshots, see backend.chain_delta
+    return f"chain_deltas:{chain_id(scrip_id, segment, expiry)}"
+
+def render_snapshot(payload) -> bytes:
+    """Serialize exactly like Flask's jsonify does outside debug mode."""
+    return json.dumps(payload, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+def content_etag(body) -> str:
+    return hashlib.sha1(body).hexdigest()[:20]
+
+def gzip_etag(etag) -> str:
+    # The gzipped body is a different representation, so it gets its own tag
+    return f"{etag}-gz"
+
+def next_version(scrip_id, segment, expiry):
+    """Current time in ms, bumped past the last version this process handed out for the chain."""
+    key = chain_id(scrip_id, segment, expiry)
+    with _versions_lock:
+        version = max(time.time_ns() // 1_000_000, _last_versions.get(key, 0) + 1)
+        _last_versions[key] = version
+    return version
+
+def queue_snapshot(pipe, scrip_id, segment, expiry, payload, ttl=SNAPSHOT_TTL,
+                   windows=PRECOMPUTED_WINDOWS):
+    """
+    Queue body, gzipped body, meta and the pre-rendered windows on `pipe`.
+    Only queues commands, so it works on sync and redis.asyncio pipelines
+    alike. Returns (body, version, etag).
+    """
+    body = render_snapshot(payload)
+    etag = content_etag(body)
+    version = next_version(scrip_id, segment, expiry)
+    meta_key = snapshot_meta_key(scrip_id, segment, expiry)
+    pipe.set(snapshot_key(scrip_id, segment, expiry), body, ex=ttl)
+    pipe.set(snapshot_gzip_key(scrip_id, segment, expiry), gzip.compress(body, GZIP_LEVEL), ex=ttl)
+    pipe.hset(meta_key, mapping={'version': version, 'etag': etag, 'updated_at': f"{time.time():.3f}"})
+    pipe.expire(meta_key, ttl)
+    for window in windows:
+        for order in ORDERS:
+            _queue_window(pipe, window_key(scrip_id, segment, expiry, version, window, order),
+                          window_payload(payload, window, order), ttl)
+    return body, version, etag
+
+def queue_touch(pipe, scrip_id, segment, expiry, version, ttl=SNAPSHOT_TTL,
+                windows=PRECOMPUTED_WINDOWS):
+    """Queue TTL refreshes for an unchanged snapshot `version` and its pre-rendered windows."""
+    for key in (snapshot_key(scrip_id, segment, expiry), snapshot_gzip_key(scrip_id, segment, expiry),
+                snapshot_meta_key(scrip_id, segment, expiry), rows_key(scrip_id, segment, expiry),
+                strikes_key(scrip_id, segment, expiry)):
+        pipe.expire(key, ttl)
+    for window in windows:
+        for order in ORDERS:
+            pipe.expire(window_key(scrip_id, segment, expiry, version, window, order), ttl)
+
+def queue_rows(pipe, scrip_id, segment, expiry, payload, version, rows=None, removed=(),
+               ttl=SNAPSHOT_TTL):
+    """
+    Queue the per-strike layout of snapshot `version`. rows=None rewrites
+    every row; otherwise only `rows` (changed or added) are set and the
+    `removed` strikes dropped, on top of the previous version's layout.
+    """
+    r_key, s_key = rows_key(scrip_id, segment, expiry), strikes_key(scrip_id, segment, expiry)
+    if rows is None:
+        rows = payload.get('chain', [])
+        pipe.delete(r_key, s_key)
+    head = {key: value for key, value in payload.items() if key != 'chain'}
+    fields = {strike_field(row['strike']): render_snapshot(row) for row in rows}
+    fields['_head'] = render_snapshot({**head, 'version': version})
+    pipe.hset(r_key, mapping=fields)
+    if rows:
+        pipe.zadd(s_key, {strike_field(row['strike']): row['strike'] for row in rows})
+    if removed:
+        pipe.hdel(r_key, *[strike_field(strike) for strike in removed])
+        pipe.zrem(s_key, *[strike_field(strike) for strike in removed])
+    pipe.expire(r_key, ttl)
+    pipe.expire(s_key, ttl)
+
+def load_row_window(binary_client, scrip_id, segment, expiry, version, window):
+    """
+    Payload of snapshot `version` limited to `window` strikes each side of
+    the underlying (ascending, as window_payload), read from the per-strike
+    layout. None when the layout is missing or holds another version, or
+    window is None (the full snapshot already holds the whole chain).
+    """
+    if window is None:
+        return None
+    r_key, s_key = rows_key(scrip_id, segment, expiry), strikes_key(scrip_id, segment, expiry)
+    head = binary_client.hget(r_key, '_head')
+    if head is None or json.loads(head).get('version') != version:
+        return None
+    spot = json.loads(head).get('underlying_price', 0)
+    pipe = binary_client.pipeline()
+    pipe.zrevrangebyscore(s_key, f"({spot}", '-inf', start=0, num=window)
+    pipe.zrangebyscore(s_key, spot, '+inf', start=0, num=window)
+    below, above = pipe.execute()
+    fields = list(reversed(below)) + above
+    values = binary_client.hmget(r_key, '_head', *fields)
+    head = json.loads(values[0]) if values[0] is not None else {}
+    if head.pop('version', None) != version or any(value is None for value in values[1:]):
+        return None
+    return {**head, 'chain': [json.loads(value) for value in values[1:]]}
+
+def store_snapshot(redis_client, scrip_id, segment, expiry, payload, ttl=SNAPSHOT_TTL,
+                   windows=PRECOMPUTED_WINDOWS):
+    """queue_snapshot() in its own MULTI/EXEC. Returns (body, version, etag)."""
+    pipe = redis_client.pipeline()
+    result = queue_snapshot(pipe, scrip_id, segment, expiry, payload, ttl, windows)
+    pipe.execute()
+    return result
+
+def load_snapshot_meta(redis_client, scrip_id, segment, expiry):
+    """Returns (version, etag) of the current snapshot, or (None, None)."""
+    version, etag = redis_client.hmget(snapshot_meta_key(scrip_id, segment, expiry), 'version', 'etag')
+    if isinstance(etag, bytes):
+        etag = etag.decode('utf-8')
+    return (int(version) if version is not None else None), etag
+
+def load_snapshot(binary_client, scrip_id, segment, expiry, accept_gzip=False):
+    """
+    Returns (body, content_encoding). body is None when no snapshot is cached.
+    binary_client must not decode responses (see get_redis_binary_client).
+    """
+    if accept_gzip:
+        body = binary_client.get(snapshot_gzip_key(scrip_id, segment, expiry))
+        if body is not None:
+            return body, "gzip"
+    return binary_client.get(snapshot_key(scrip_id, segment, expiry)), None
+
+def window_payload(payload, window, order='ascending'):
+    """
+    Slice a processed payload to `window` strikes below the underlying plus
+    `window` strikes at or above it (window=None keeps every strike), in the
+    requested order. Totals stay those of the full chain.
+    """
+    chain = payload.get('chain', [])
+    if window is not None:
+        strikes = [row['strike'] for row in chain]
+        split = bisect.bisect_left(strikes, payload.get('underlying_price', 0))
+        chain = chain[max(0, split - window):split + window]
+    if order == 'descending':
+        chain = chain[::-1]
+    return {**payload, 'chain': chain}
+
+def _queue_window(pipe, key, payload, ttl):
+    body = render_snapshot(payload)
+    pipe.hset(key, mapping={
+        'body': body,
+        'gz': gzip.compress(body, GZIP_LEVEL),
+        'etag': content_etag(body),
+    })
+    pipe.expire(key, ttl)
+    return body
+
+def store_window(redis_client, scrip_id, segment, expiry, version, payload, window, order, ttl=SNAPSHOT_TTL):
+    """Render and cache one window of snapshot `version`. Returns (etag, body)."""
+    pipe = redis_client.pipeline()
+    body = _queue_window(pipe, window_key(scrip_id, segment, expiry, version, window, order),
+                         window_payload(payload, window, order), ttl)
+    pipe.execute()
+    return content_etag(body), body
+
+def load_window(binary_client, scrip_id, segment, expiry, version, window, order, accept_gzip=False):
+    """
+    Returns (etag, body, content_encoding) for a cached window of snapshot
+    `version`; etag is None when that window has not been rendered yet.
+    """
+    field = 'gz' if accept_gzip else 'body'
+    etag, body = binary_client.hmget(window_key(scrip_id, segment, expiry, version, window, order), 'etag', field)
+    if etag is None or body is None:
+        return None, None, None
+    return etag.decode('utf-8'), body, ('gzip' if accept_gzip else None)
+
+def publish_update(redis_client, scrip_id, segment, expiry, version):
+    """
+    Notify subscribers that snapshot `version` is available. Returns receiver
+    count (or queues the PUBLISH when given a pipeline).
+    """
+    return redis_client.publish(update_channel(scrip_id, segment, expiry), str(version))
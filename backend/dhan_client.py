@@ -1,46 +1,249 @@
+import asyncio
+import contextvars
+import json
+import os
+import random
+import threading
+import time
 import requests
+from requests.adapters import HTTPAdapter
+
+# (connect, read) timeouts in seconds for every Dhan call
+DEFAULT_TIMEOUT = (float(os.getenv('DHAN_CONNECT_TIMEOUT', 3.05)), float(os.getenv('DHAN_READ_TIMEOUT', 10)))
+DEFAULT_MAX_RETRIES = int(os.getenv('DHAN_MAX_RETRIES', 2))
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 8.0
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def _backoff_delay(attempt, retry_after=None):
+    """Retry-After when the server sent one, else full-jitter exponential; capped."""
+    try:
+        delay = float(retry_after) if retry_after is not None else None
+    except ValueError:
+        delay = None
+    if delay is None:
+        delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * (2 ** attempt)))
+    return min(delay, BACKOFF_CAP)
+
+
+def _call_info(path, status, attempts, attempt_started, started):
+    now = time.perf_counter()
+    return {
+        "endpoint": path,
+        "status": status,
+        "attempts": attempts,
+        "latency": now - attempt_started,
+        "total_latency": now - started,
+    }
+
+
+class DhanAPIError(Exception):
+    """Non-200 response (or transport failure, status_code=None) from the Dhan API."""
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
 
 class DhanClient:
-    def __init__(self, client_id, access_token, base_url="https://api.dhan.co/v2"):
+    # One keep-alive session per access token, shared by every client using it
+    _sessions = {}
+    _sessions_lock = threading.Lock()
+
+    def __init__(self, client_id, access_token, base_url="https://api.dhan.co/v2",
+                 timeout=DEFAULT_TIMEOUT, max_retries=DEFAULT_MAX_RETRIES, on_call=None):
+        """
+        on_call: optional callable(call_info) invoked after every HTTP attempt
+        with the dict also exposed as `last_call`: endpoint, status (None on a
+        transport error), attempts so far, latency of that attempt and
+        total_latency of the call including earlier retries and backoff.
+        """
         self.client_id = client_id
         self.access_token = access_token
         self.base_url = base_url
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.on_call = on_call
+        self.session = self._session_for(access_token)
+        self._local = threading.local()
+
+    @classmethod
+    def _session_for(cls, access_token):
+        with cls._sessions_lock:
+            session = cls._sessions.get(access_token)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=2, pool_maxsize=16)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                cls._sessions[access_token] = session
+            return session
+
+    @property
+    def last_call(self):
+        """Timing/status of the most recent call made from the current thread."""
+        return getattr(self._local, 'last_call', None)
 
     def fetch_expiry_list(self, underlying_scrip, underlying_seg):
-        url = f"{self.base_url}/optionchain/expirylist"
-        headers = {
-            "access-token": self.access_token,
-            "client-id": self.client_id,
-            "Content-Type": "application/json",
-        }
         payload = {
             "UnderlyingScrip": underlying_scrip,
             "UnderlyingSeg": underlying_seg
         }
-        response = requests.post(url, headers=headers, json=payload)
-        return self.handle_post_response(response)        
+        return self._post("/optionchain/expirylist", payload)
 
     def fetch_option_chain(self, underlying_scrip, underlying_seg, expiry):
-        url = f"{self.base_url}/optionchain"
-        headers = {
-            "access-token": self.access_token,
-            "client-id": self.client_id,
-            "Content-Type": "application/json",
-            }
         payload = {
             "UnderlyingScrip": underlying_scrip,
             "UnderlyingSeg": underlying_seg,
             "Expiry": expiry
         }
-        response = requests.post(url, headers=headers, json=payload)
-        return self.handle_post_response(response)
-    
+        return self._post("/optionchain", payload)
+
+    def _post(self, path, payload):
+        """POST with bounded retries and full-jitter backoff on 429/5xx and transport errors."""
+        url = f"{self.base_url}{path}"
+        headers = {
+            "access-token": self.access_token,
+            "client-id": self.client_id,
+            "Content-Type": "application/json",
+        }
+        started = time.perf_counter()
+        for attempt in range(self.max_retries + 1):
+            attempt_started = time.perf_counter()
+            try:
+                response = self.session.post(url, headers=headers, json=payload, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as err:
+                self._record(path, None, attempt + 1, attempt_started, started)
+                if attempt == self.max_retries:
+                    raise DhanAPIError(f"POST request failed: {err}") from err
+                self._backoff(attempt)
+                continue
+
+            self._record(path, response.status_code, attempt + 1, attempt_started, started)
+            if response.status_code in RETRY_STATUSES and attempt < self.max_retries:
+                self._backoff(attempt, response.headers.get("Retry-After"))
+                continue
+            return self.handle_post_response(response)
+
+    def _backoff(self, attempt, retry_after=None):
+        time.sleep(_backoff_delay(attempt, retry_after))
+
+    def _record(self, path, status, attempts, attempt_started, started):
+        call = _call_info(path, status, attempts, attempt_started, started)
+        self._local.last_call = call
+        if self.on_call is not None:
+            try:
+                self.on_call(call)
+            except Exception:
+                pass
+
     def handle_post_response(self, response):
         """Handles the response from a POST request."""
         if response.status_code != 200:
-            raise Exception(f"POST request failed with status code {response.status_code}: {response.text}")
+            raise DhanAPIError(f"POST request failed with status code {response.status_code}: {response.text}",
+                               status_code=response.status_code)
         try:
             response.raise_for_status()
             return response.json()
         except requests.exceptions.HTTPError as err:
-            raise Exception(f"POST request failed: {err} - {response.text}")
\ No newline at end of file
+            raise DhanAPIError(f"POST request failed: {err} - {response.text}",
+                               status_code=response.status_code)
+
+
+# Per-task record of the last call; each asyncio task sees its own value
+_async_last_call = contextvars.ContextVar('dhan_async_last_call', default=None)
+
+
+class AsyncDhanClient:
+    """
+    asyncio counterpart of DhanClient (same fetch_* methods, as coroutines) on
+    a keep-alive aiohttp session. Used by the async worker mode; aiohttp is
+    only imported when the first session is opened.
+    """
+
+    def __init__(self, client_id, access_token, base_url="https://api.dhan.co/v2",
+                 timeout=DEFAULT_TIMEOUT, max_retries=DEFAULT_MAX_RETRIES, on_call=None):
+        self.client_id = client_id
+        self.access_token = access_token
+        self.base_url = base_url
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.on_call = on_call
+        self._session = None
+
+    @property
+    def last_call(self):
+        """Timing/status of the most recent call made from the current task."""
+        return _async_last_call.get()
+
+    async def _get_session(self):
+        if self._session is None or self._session.closed:
+            import aiohttp
+            connect, read = self.timeout
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(sock_connect=connect, sock_read=read),
+                connector=aiohttp.TCPConnector(limit_per_host=16, keepalive_timeout=60),
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def fetch_expiry_list(self, underlying_scrip, underlying_seg):
+        payload = {
+            "UnderlyingScrip": underlying_scrip,
+            "UnderlyingSeg": underlying_seg
+        }
+        return await self._post("/optionchain/expirylist", payload)
+
+    async def fetch_option_chain(self, underlying_scrip, underlying_seg, expiry):
+        payload = {
+            "UnderlyingScrip": underlying_scrip,
+            "UnderlyingSeg": underlying_seg,
+            "Expiry": expiry
+        }
+        return await self._post("/optionchain", payload)
+
+    async def _post(self, path, payload):
+        import aiohttp
+        session = await self._get_session()
+        url = f"{self.base_url}{path}"
+        headers = {
+            "access-token": self.access_token,
+            "client-id": self.client_id,
+            "Content-Type": "application/json",
+        }
+        started = time.perf_counter()
+        for attempt in range(self.max_retries + 1):
+            attempt_started = time.perf_counter()
+            try:
+                async with session.post(url, headers=headers, json=payload) as response:
+                    status = response.status
+                    text = await response.text()
+                    retry_after = response.headers.get("Retry-After")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+                self._record(path, None, attempt + 1, attempt_started, started)
+                if attempt == self.max_retries:
+                    raise DhanAPIError(f"POST request failed: {err!r}") from err
+                await asyncio.sleep(_backoff_delay(attempt))
+                continue
+
+            self._record(path, status, attempt + 1, attempt_started, started)
+            if status in RETRY_STATUSES and attempt < self.max_retries:
+                await asyncio.sleep(_backoff_delay(attempt, retry_after))
+                continue
+            if status != 200:
+                raise DhanAPIError(f"POST request failed with status code {status}: {text}",
+                                   status_code=status)
+            return json.loads(text)
+
+    def _record(self, path, status, attempts, attempt_started, started):
+        call = _call_info(path, status, attempts, attempt_started, started)
+        _async_last_call.set(call)
+        if self.on_call is not None:
+            try:
+                self.on_call(call)
+            except Exception:
+                pass
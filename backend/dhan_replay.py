@@ -0,0 +1,336 @@
+"""
+Record Dhan option chain responses to disk and replay them in place of the
+live API, to load-test or reproduce issues outside market hours.
+
+Recording (DHAN_RECORD_DIR set, live clients): every successful expiry-list
+and option chain response is appended to a tape under that directory, one
+gzip file per chain and per expiry list, one "<epoch ms>\\t<response JSON>"
+line per call.
+
+Replay (DHAN_REPLAY_DIR set): ReplayDhanClient / AsyncReplayDhanClient are
+DhanClient / AsyncDhanClient with the HTTP session swapped for one that
+answers from a ReplayTape, so retries, backoff, last_call and on_call (the
+scheduler's feedback) behave as they do live. Options, from the environment:
+
+    REPLAY_SPEED            1 (real time), 10, ... or "max": every call
+                            returns the chain's next recorded frame
+    REPLAY_LATENCY_MS       added to every call (default 0), plus a uniform
+    REPLAY_JITTER_MS        0..jitter on top
+    REPLAY_429_RATE         fraction of calls answered 429
+    REPLAY_FAILURE_RATE     fraction of calls answered 500
+    REPLAY_SEED             seed for the injected faults
+
+All chains share one replay clock, so they stay in step, and the tape loops
+at its end. Expiry dates are shifted forward by whole weeks so a recording
+from an earlier day still lists upcoming expiries. Point the replaying
+worker at its own Redis database (recorded expiries land in the shared
+calendar) and lower MIN_REFRESH_INTERVAL / DHAN_RATE_PER_SEC to drive more
+than real market rates. Tapes are loaded into memory.
+"""
+import asyncio
+import bisect
+import glob
+import gzip
+import json
+import math
+import os
+import random
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+import requests
+
+from .dhan_client import AsyncDhanClient, DhanClient
+from .expiry_calendar import IST
+
+EXPIRIES_SUFFIX = '.expiries.jsonl.gz'
+CHAIN_SUFFIX = '.chain.jsonl.gz'
+
+
+def _tape_name(scrip_id, segment, expiry=None):
+    if expiry is None:
+        return f"{scrip_id}_{segment}{EXPIRIES_SUFFIX}"
+    return f"{scrip_id}_{segment}_{expiry}{CHAIN_SUFFIX}"
+
+
+class TapeRecorder:
+    """Appends responses to the tape files under `directory`."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def record(self, scrip_id, segment, expiry, response):
+        line = f"{int(time.time() * 1000)}\t{json.dumps(response, separators=(',', ':'))}\n"
+        path = os.path.join(self.directory, _tape_name(scrip_id, segment, expiry))
+        with self._lock:
+            # each append is a complete gzip member; gzip.open reads them back in order
+            with gzip.open(path, 'at', encoding='utf-8') as f:
+                f.write(line)
+
+
+class RecordingDhanClient(DhanClient):
+    """DhanClient that also records successful responses (see TapeRecorder)."""
+
+    def __init__(self, *args, recorder, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.recorder = recorder
+
+    def fetch_expiry_list(self, underlying_scrip, underlying_seg):
+        response = super().fetch_expiry_list(underlying_scrip, underlying_seg)
+        if response.get('status') == 'success':
+            self.recorder.record(underlying_scrip, underlying_seg, None, response)
+        return response
+
+    def fetch_option_chain(self, underlying_scrip, underlying_seg, expiry):
+        response = super().fetch_option_chain(underlying_scrip, underlying_seg, expiry)
+        if response.get('status') == 'success':
+            self.recorder.record(underlying_scrip, underlying_seg, expiry, response)
+        return response
+
+
+class AsyncRecordingDhanClient(AsyncDhanClient):
+    """AsyncDhanClient that also records successful responses (see TapeRecorder)."""
+
+    def __init__(self, *args, recorder, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.recorder = recorder
+
+    async def fetch_expiry_list(self, underlying_scrip, underlying_seg):
+        response = await super().fetch_expiry_list(underlying_scrip, underlying_seg)
+        if response.get('status') == 'success':
+            await asyncio.to_thread(self.recorder.record, underlying_scrip, underlying_seg, None, response)
+        return response
+
+    async def fetch_option_chain(self, underlying_scrip, underlying_seg, expiry):
+        response = await super().fetch_option_chain(underlying_scrip, underlying_seg, expiry)
+        if response.get('status') == 'success':
+            await asyncio.to_thread(self.recorder.record, underlying_scrip, underlying_seg, expiry, response)
+        return response
+
+
+def _load_frames(path):
+    """(timestamps, raw response bodies) of one tape file, oldest first."""
+    frames = []
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            ts, _, body = line.rstrip('\n').partition('\t')
+            if body:
+                frames.append((int(ts), body))
+    frames.sort(key=lambda frame: frame[0])
+    return [ts for ts, _ in frames], [body for _, body in frames]
+
+
+class ReplayTape:
+    """Recorded responses of one DHAN_RECORD_DIR, served on a shared replay clock."""
+
+    def __init__(self, directory, speed=1.0, loop=True, clock=time.monotonic, today=None):
+        """speed: recorded seconds per real second; 0 serves frames back to back."""
+        self.speed = speed
+        self.loop = loop
+        self.clock = clock
+        self.chains = {}
+        self.expiry_lists = {}
+        for path in glob.glob(os.path.join(directory, f"*{CHAIN_SUFFIX}")):
+            # segments contain '_' (IDX_I); scrip ids and expiries do not
+            scrip_id, rest = os.path.basename(path)[:-len(CHAIN_SUFFIX)].split('_', 1)
+            segment, expiry = rest.rsplit('_', 1)
+            self.chains[(scrip_id, segment, expiry)] = _load_frames(path)
+        for path in glob.glob(os.path.join(directory, f"*{EXPIRIES_SUFFIX}")):
+            scrip_id, segment = os.path.basename(path)[:-len(EXPIRIES_SUFFIX)].split('_', 1)
+            self.expiry_lists[(scrip_id, segment)] = _load_frames(path)
+        if not self.chains:
+            raise ValueError(f"No recorded option chains in {directory}")
+        self.first_ts = min(ts[0] for ts, _ in self.chains.values())
+        self.last_ts = max(ts[-1] for ts, _ in self.chains.values())
+        recorded_on = datetime.fromtimestamp(self.first_ts / 1000, IST).date()
+        days = ((today or datetime.now(IST).date()) - recorded_on).days
+        self.shift = timedelta(days=7 * max(0, math.ceil(days / 7)))
+        self.started = clock()
+        self._cursors = {}
+        self._lock = threading.Lock()
+
+    def _shift(self, expiry, sign=1):
+        return (date.fromisoformat(expiry) + sign * self.shift).isoformat()
+
+    def position(self):
+        """Recorded epoch ms the replay clock is at."""
+        span = max(1, self.last_ts - self.first_ts)
+        elapsed = int((self.clock() - self.started) * self.speed * 1000)
+        if self.loop:
+            elapsed %= span + 1
+        return self.first_ts + min(elapsed, span)
+
+    def expiry_list(self, scrip_id, segment):
+        """Expiry-list response body (str), dates shifted; None if not recorded."""
+        frames = self.expiry_lists.get((str(scrip_id), segment))
+        if frames is None:
+            expiries = sorted(e for s, g, e in self.chains if (s, g) == (str(scrip_id), segment))
+            if not expiries:
+                return None
+        else:
+            expiries = json.loads(frames[1][0]).get('data') or []
+        return json.dumps({'status': 'success', 'data': [self._shift(e) for e in expiries]})
+
+    def option_chain(self, scrip_id, segment, expiry):
+        """Option chain response body (str) due now for a (shifted) expiry; None if not recorded."""
+        key = (str(scrip_id), segment, self._shift(expiry, -1))
+        frames = self.chains.get(key)
+        if frames is None:
+            return None
+        timestamps, bodies = frames
+        if self.speed <= 0:
+            with self._lock:
+                index = self._cursors.get(key, -1) + 1
+                if index >= len(bodies):
+                    index = 0 if self.loop else len(bodies) - 1
+                self._cursors[key] = index
+        else:
+            index = max(0, bisect.bisect_right(timestamps, self.position()) - 1)
+        return bodies[index]
+
+
+class ReplayFaults:
+    """Latency, 429s and 500s injected into replayed calls."""
+
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, throttle_rate=0.0, failure_rate=0.0, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.throttle_rate = throttle_rate
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def draw(self):
+        """(delay seconds, status to answer with instead of the recording or None)."""
+        with self._lock:
+            delay = (self.latency_ms + self._random.uniform(0, self.jitter_ms)) / 1000
+            roll = self._random.random()
+        if roll < self.throttle_rate:
+            return delay, 429
+        if roll < self.throttle_rate + self.failure_rate:
+            return delay, 500
+        return delay, None
+
+
+def _replay_answer(tape, faults, url, payload):
+    """(delay seconds, status, body) for one replayed POST."""
+    delay, status = faults.draw()
+    if status == 429:
+        return delay, status, json.dumps({'status': 'failure', 'remarks': 'Too many requests (replay)'})
+    if status is not None:
+        return delay, status, json.dumps({'status': 'failure', 'remarks': 'Injected failure (replay)'})
+    scrip_id, segment = payload.get('UnderlyingScrip'), payload.get('UnderlyingSeg')
+    if url.endswith('/optionchain/expirylist'):
+        body = tape.expiry_list(scrip_id, segment)
+    else:
+        body = tape.option_chain(scrip_id, segment, payload.get('Expiry'))
+    if body is None:
+        return delay, 400, json.dumps({'status': 'failure', 'remarks': 'Not in the replay tape'})
+    return delay, 200, body
+
+
+class _ReplayResponse:
+    """The parts of requests.Response that DhanClient reads."""
+
+    def __init__(self, status_code, text):
+        self.status_code = status_code
+        self.text = text
+        self.headers = {}
+
+    def json(self):
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f"{self.status_code} (replay)")
+
+
+class _ReplaySession:
+    def __init__(self, tape, faults):
+        self.tape = tape
+        self.faults = faults
+
+    def post(self, url, headers=None, json=None, timeout=None):
+        delay, status, body = _replay_answer(self.tape, self.faults, url, json or {})
+        if delay:
+            time.sleep(delay)
+        return _ReplayResponse(status, body)
+
+
+class _AsyncReplayResponse:
+    def __init__(self, status, body):
+        self.status = status
+        self.headers = {}
+        self._body = body
+
+    async def text(self):
+        return self._body
+
+
+class _AsyncReplayPost:
+    def __init__(self, tape, faults, url, payload):
+        self.args = (tape, faults, url, payload)
+
+    async def __aenter__(self):
+        delay, status, body = _replay_answer(*self.args)
+        if delay:
+            await asyncio.sleep(delay)
+        return _AsyncReplayResponse(status, body)
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class _AsyncReplaySession:
+    closed = False
+
+    def __init__(self, tape, faults):
+        self.tape = tape
+        self.faults = faults
+
+    def post(self, url, headers=None, json=None):
+        return _AsyncReplayPost(self.tape, self.faults, url, json or {})
+
+    async def close(self):
+        pass
+
+
+class ReplayDhanClient(DhanClient):
+    """DhanClient answering from a ReplayTape instead of the Dhan API."""
+
+    def __init__(self, tape, faults=None, client_id='replay', access_token='replay', **kwargs):
+        super().__init__(client_id, access_token, **kwargs)
+        self.session = _ReplaySession(tape, faults or ReplayFaults())
+
+
+class AsyncReplayDhanClient(AsyncDhanClient):
+    """AsyncDhanClient answering from a ReplayTape instead of the Dhan API."""
+
+    def __init__(self, tape, faults=None, client_id='replay', access_token='replay', **kwargs):
+        super().__init__(client_id, access_token, **kwargs)
+        self._session = _AsyncReplaySession(tape, faults or ReplayFaults())
+
+    async def close(self):
+        pass
+
+
+def replay_speed(value):
+    """REPLAY_SPEED value -> ReplayTape speed ("max" -> 0)."""
+    value = (value or '1').strip().lower()
+    return 0.0 if value == 'max' else float(value)
+
+
+def tape_from_env():
+    return ReplayTape(os.environ['DHAN_REPLAY_DIR'], speed=replay_speed(os.getenv('REPLAY_SPEED')))
+
+
+def faults_from_env():
+    seed = os.getenv('REPLAY_SEED')
+    return ReplayFaults(latency_ms=float(os.getenv('REPLAY_LATENCY_MS', 0)),
+                        jitter_ms=float(os.getenv('REPLAY_JITTER_MS', 0)),
+                        throttle_rate=float(os.getenv('REPLAY_429_RATE', 0)),
+                        failure_rate=float(os.getenv('REPLAY_FAILURE_RATE', 0)),
+                        seed=int(seed) if seed else None)
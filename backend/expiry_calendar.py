@@ -0,0 +1,139 @@
+"""
+Expiry-calendar cache shared by the worker and the API.
+
+Expiry lists change at most once a day, so instead of calling
+/optionchain/expirylist before every chain fetch the list is kept in Redis
+(`expiry_list:<scrip>_<seg>`, long TTL) and in a per-process memo. It is
+refetched only when it was fetched on an earlier IST trading date or when its
+nearest expiry has passed 15:30 IST.
+
+The worker collects the EXPIRY_DEPTH nearest upcoming expiries of every
+underlying (tracked_expiries); index 0 is the current expiry.
+
+Usage:
+    expiries = get_expiry_list(dhan_client, redis_client, scrip_id, segment)
+    expiry = current_expiry(expiries)
+    expiry = cached_current_expiry(redis_client, scrip_id, segment)   # API side, no Dhan call
+"""
+import json
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+
+IST = timezone(timedelta(hours=5, minutes=30))
+EXPIRY_LIST_TTL = 7 * 24 * 3600
+# Dhan may keep listing an expiry for a while after it closes; don't refetch
+# on every cycle in that window
+EXPIRED_REFETCH_INTERVAL = 900
+# Upcoming expiries collected per underlying
+EXPIRY_DEPTH = int(os.getenv('EXPIRY_DEPTH', 3))
+
+_memo = {}
+_memo_lock = threading.Lock()
+
+def expiry_list_key(scrip_id, segment):
+    return f"expiry_list:{scrip_id}_{segment}"
+
+def expiry_close(expiry):
+    """15:30 IST on the expiry date ('YYYY-MM-DD')."""
+    return datetime.strptime(f"{expiry} 15:30:00+05:30", "%Y-%m-%d %H:%M:%S%z")
+
+def current_expiry(expiries, now=None):
+    """Nearest expiry whose 15:30 IST close has not passed yet."""
+    now = now or datetime.now(timezone.utc)
+    for expiry in expiries or []:
+        if expiry_close(expiry) > now:
+            return expiry
+    return None
+
+def tracked_expiries(expiries, depth=EXPIRY_DEPTH, now=None):
+    """The `depth` nearest expiries whose 15:30 IST close has not passed yet."""
+    now = now or datetime.now(timezone.utc)
+    return [expiry for expiry in expiries or [] if expiry_close(expiry) > now][:depth]
+
+def memo_expiries(scrip_id, segment):
+    """Tracked expiries from this process's memo only (no I/O); [] if unknown."""
+    return tracked_expiries((_recall(scrip_id, segment) or {}).get('expiries'))
+
+def is_stale(entry, now=None):
+    if not entry or not entry.get('expiries'):
+        return True
+    now = now or datetime.now(timezone.utc)
+    if entry.get('fetched_on') != now.astimezone(IST).strftime('%Y-%m-%d'):
+        return True
+    if expiry_close(entry['expiries'][0]) > now:
+        return False
+    return now.timestamp() - entry.get('fetched_at', 0) >= EXPIRED_REFETCH_INTERVAL
+
+def _remember(scrip_id, segment, entry):
+    with _memo_lock:
+        _memo[(str(scrip_id), str(segment))] = entry
+
+def _recall(scrip_id, segment):
+    with _memo_lock:
+        return _memo.get((str(scrip_id), str(segment)))
+
+def _decode(raw):
+    if raw is None:
+        return None
+    if isinstance(raw, bytes):
+        raw = raw.decode('utf-8')
+    try:
+        return json.loads(raw)
+    except ValueError:
+        return None
+
+def _new_entry(expiry_data, now=None):
+    now = now or datetime.now(timezone.utc)
+    return {
+        'expiries': list(expiry_data.get('data') or []),
+        'fetched_on': now.astimezone(IST).strftime('%Y-%m-%d'),
+        'fetched_at': int(now.timestamp()),
+    }
+
+def load_entry(redis_client, scrip_id, segment):
+    """Cached {'expiries', 'fetched_on'} from the memo, else Redis; may be stale or None."""
+    entry = _recall(scrip_id, segment)
+    if entry is None or is_stale(entry):
+        entry = _decode(redis_client.get(expiry_list_key(scrip_id, segment))) or entry
+        if entry is not None:
+            _remember(scrip_id, segment, entry)
+    return entry
+
+def get_expiry_list(dhan_client, redis_client, scrip_id, segment):
+    """Expiry list, calling Dhan only when the cached calendar is stale."""
+    entry = load_entry(redis_client, scrip_id, segment)
+    if is_stale(entry):
+        expiry_data = dhan_client.fetch_expiry_list(underlying_scrip=scrip_id, underlying_seg=segment)
+        fresh = _new_entry(expiry_data)
+        if fresh['expiries']:
+            redis_client.set(expiry_list_key(scrip_id, segment), json.dumps(fresh), ex=EXPIRY_LIST_TTL)
+            _remember(scrip_id, segment, fresh)
+            entry = fresh
+    return (entry or {}).get('expiries') or []
+
+async def aget_expiry_list(dhan_client, redis_client, scrip_id, segment):
+    """get_expiry_list() for AsyncDhanClient + redis.asyncio."""
+    entry = _recall(scrip_id, segment)
+    if entry is None or is_stale(entry):
+        entry = _decode(await redis_client.get(expiry_list_key(scrip_id, segment))) or entry
+        if entry is not None:
+            _remember(scrip_id, segment, entry)
+    if is_stale(entry):
+        expiry_data = await dhan_client.fetch_expiry_list(underlying_scrip=scrip_id, underlying_seg=segment)
+        fresh = _new_entry(expiry_data)
+        if fresh['expiries']:
+            await redis_client.set(expiry_list_key(scrip_id, segment), json.dumps(fresh), ex=EXPIRY_LIST_TTL)
+            _remember(scrip_id, segment, fresh)
+            entry = fresh
+    return (entry or {}).get('expiries') or []
+
+def cached_expiries(redis_client, scrip_id, segment):
+    """Tracked expiries from the shared calendar without calling Dhan."""
+    entry = load_entry(redis_client, scrip_id, segment)
+    return tracked_expiries((entry or {}).get('expiries'))
+
+def cached_current_expiry(redis_client, scrip_id, segment):
+    """Current expiry from the shared calendar without calling Dhan (None if unknown)."""
+    entry = load_entry(redis_client, scrip_id, segment)
+    return current_expiry((entry or {}).get('expiries'))
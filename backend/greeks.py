@@ -0,0 +1,234 @@
+"""
+Black-Scholes implied volatility and Greeks for whole option chains.
+
+The worker prices every strike of a chain it writes, both sides, as array
+operations over the chain (backend.chain_engine columns):
+
+    iv        solved from the last traded price (percent, like Dhan's)
+    delta     per 1 point of the underlying
+    gamma     per 1 point of the underlying
+    theta     per calendar day
+    vega      per 1 volatility point
+
+The IV solver runs Newton steps on every unsolved option at once, warm
+started from Dhan's implied_volatility. Each option keeps a bracket
+[lo, hi] that its price errors shrink; a Newton step that leaves the bracket
+(or a vega too small to divide by) is replaced by the bracket midpoint, so
+every option converges even where Newton alone would not. Solved options
+drop out of the working set, so later iterations only touch the stragglers.
+Prices outside the no-arbitrage bounds, zero prices and expired chains have
+no IV and their Greeks are null.
+
+European exercise (NSE index options), no dividends, RISK_FREE_RATE
+continuously compounded; t is the exact fraction of a year to the 15:30 IST
+close of the expiry at the snapshot time.
+
+Results are stored next to the processed chain, one body per chain
+(`greeks:<scrip>_<seg>_<expiry>`, a hash of body, etag and version), with
+the snapshot's TTL, and the API serves them unparsed.
+
+Usage:
+    greeks = chain_greeks(ChainColumns.from_chain(chain_data), expiry, version)
+    queue_greeks(pipe, scrip_id, segment, expiry, version, greeks)
+    etag, body, version = load_greeks(binary_client, scrip_id, segment, expiry)
+"""
+import math
+import os
+from datetime import datetime, timezone
+
+import numpy as np
+
+from .chain_store import SNAPSHOT_TTL, chain_id, content_etag, render_snapshot
+from .expiry_calendar import expiry_close
+
+RISK_FREE_RATE = float(os.getenv('GREEKS_RISK_FREE_RATE', 0.067))
+YEAR_SECONDS = 365 * 24 * 3600
+
+# IV search range (annualized) and stopping rule: price within PRICE_TOLERANCE
+# or bracket narrower than VOL_TOLERANCE
+MIN_VOL = 1e-4
+MAX_VOL = 5.0
+PRICE_TOLERANCE = 1e-4
+VOL_TOLERANCE = 1e-6
+MAX_ITERATIONS = 64
+# Newton steps are not trusted below this vega (price change per unit vol)
+MIN_VEGA = 1e-8
+
+GREEK_FIELDS = ('iv', 'delta', 'gamma', 'theta', 'vega')
+
+_SQRT_2PI = math.sqrt(2 * math.pi)
+
+
+def greeks_key(scrip_id, segment, expiry):
+    return f"greeks:{chain_id(scrip_id, segment, expiry)}"
+
+
+def _erfc(x):
+    # Chebyshev fit of erfc (Numerical Recipes erfcc), fractional error < 1.2e-7
+    # everywhere, so deep out-of-the-money prices keep their precision
+    z = np.abs(x)
+    t = 1 / (1 + 0.5 * z)
+    poly = -1.26551223 + t * (1.00002368 + t * (0.37409196 + t * (0.09678418 + t * (
+        -0.18628806 + t * (0.27886807 + t * (-1.13520398 + t * (1.48851587 + t * (
+            -0.82215223 + t * 0.17087277))))))))
+    r = t * np.exp(-z * z + poly)
+    return np.where(x >= 0, r, 2 - r)
+
+
+def norm_cdf(x):
+    return 0.5 * _erfc(-x / math.sqrt(2))
+
+
+def norm_pdf(x):
+    return np.exp(-0.5 * x * x) / _SQRT_2PI
+
+
+def _d1_d2(spot, strikes, t, rate, vol):
+    sqrt_t = math.sqrt(t)
+    d1 = (np.log(spot / strikes) + (rate + 0.5 * vol * vol) * t) / (vol * sqrt_t)
+    return d1, d1 - vol * sqrt_t
+
+
+def bs_price(spot, strikes, t, rate, vol, is_call):
+    """Black-Scholes prices; is_call is a bool array (or scalar) choosing the side."""
+    d1, d2 = _d1_d2(spot, strikes, t, rate, vol)
+    discounted = strikes * math.exp(-rate * t)
+    call = spot * norm_cdf(d1) - discounted * norm_cdf(d2)
+    put = discounted * norm_cdf(-d2) - spot * norm_cdf(-d1)
+    return np.where(is_call, call, put)
+
+
+def bs_vega(spot, strikes, t, rate, vol):
+    """dPrice/dVol per unit (not percent) of volatility, same for calls and puts."""
+    d1, _ = _d1_d2(spot, strikes, t, rate, vol)
+    return spot * norm_pdf(d1) * math.sqrt(t)
+
+
+def implied_vol(prices, spot, strikes, t, rate, is_call, guess=None):
+    """
+    Annualized implied volatility of each price (NaN where the price has no
+    solution). Arrays of equal length; guess is an optional starting vol.
+    """
+    prices = np.asarray(prices, dtype=float)
+    strikes = np.asarray(strikes, dtype=float)
+    is_call = np.broadcast_to(np.asarray(is_call, dtype=bool), prices.shape)
+    vol = np.full(prices.shape, np.nan)
+    if t <= 0 or spot <= 0:
+        return vol
+
+    discounted = strikes * math.exp(-rate * t)
+    lower = np.where(is_call, np.maximum(spot - discounted, 0), np.maximum(discounted - spot, 0))
+    upper = np.where(is_call, spot, discounted)
+    solvable = (prices > lower) & (prices < upper) & (strikes > 0)
+
+    idx = np.flatnonzero(solvable)
+    target, K, calls = prices[idx], strikes[idx], is_call[idx]
+    lo = np.full(len(idx), MIN_VOL)
+    hi = np.full(len(idx), MAX_VOL)
+    if guess is not None:
+        sigma = np.asarray(guess, dtype=float)[idx]
+        sigma = np.where((sigma > MIN_VOL) & (sigma < MAX_VOL), sigma, 0.2)
+    else:
+        sigma = np.full(len(idx), 0.2)
+
+    for _ in range(MAX_ITERATIONS):
+        if not len(idx):
+            break
+        diff = bs_price(spot, K, t, rate, sigma, calls) - target
+        done = (np.abs(diff) < PRICE_TOLERANCE) | (hi - lo < VOL_TOLERANCE)
+        if done.any():
+            vol[idx[done]] = sigma[done]
+            keep = ~done
+            idx, target, K, calls = idx[keep], target[keep], K[keep], calls[keep]
+            lo, hi, sigma, diff = lo[keep], hi[keep], sigma[keep], diff[keep]
+            if not len(idx):
+                break
+        # price rises with vol: a price above target bounds vol from above
+        high = diff > 0
+        hi = np.where(high, sigma, hi)
+        lo = np.where(high, lo, sigma)
+        vega = bs_vega(spot, K, t, rate, sigma)
+        step = np.divide(diff, vega, out=np.full(len(idx), np.inf), where=vega > MIN_VEGA)
+        newton = sigma - step
+        sigma = np.where((newton > lo) & (newton < hi), newton, 0.5 * (lo + hi))
+    return vol
+
+
+def greeks(spot, strikes, t, rate, vol, is_call):
+    """{field: array} of delta, gamma, theta (per day) and vega (per vol point); NaN where vol is."""
+    strikes = np.asarray(strikes, dtype=float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        d1, d2 = _d1_d2(spot, strikes, t, rate, vol)
+        pdf = norm_pdf(d1)
+        sqrt_t = math.sqrt(t)
+        discounted = strikes * math.exp(-rate * t)
+        decay = -spot * pdf * vol / (2 * sqrt_t)
+        call_theta = decay - rate * discounted * norm_cdf(d2)
+        put_theta = decay + rate * discounted * norm_cdf(-d2)
+        return {
+            'delta': np.where(is_call, norm_cdf(d1), norm_cdf(d1) - 1),
+            'gamma': pdf / (spot * vol * sqrt_t),
+            'theta': np.where(is_call, call_theta, put_theta) / 365,
+            'vega': spot * pdf * sqrt_t / 100,
+        }
+
+
+def _rounded(values, digits):
+    # JSON column: rounded floats, None where there is no value
+    out = np.round(values, digits).astype(object)
+    out[np.isnan(values)] = None
+    return out.tolist()
+
+
+def chain_greeks(columns, expiry, version, rate=RISK_FREE_RATE):
+    """
+    Greeks body for one chain (backend.chain_engine.ChainColumns) at snapshot
+    `version` (epoch ms): {'version', 'expiry', 'underlying_price', 't', 'rate',
+    'strikes': [...], 'call': {field: [...]}, 'put': {field: [...]}}, one value
+    per strike in ascending strike order.
+    """
+    at = datetime.fromtimestamp(version / 1000, timezone.utc)
+    t = max((expiry_close(expiry) - at).total_seconds(), 0) / YEAR_SECONDS
+    spot = float(columns.underlying_price or 0)
+    strikes = columns.strikes
+    n = len(strikes)
+
+    # both sides solved in one pass: calls then puts
+    both_strikes = np.concatenate([strikes, strikes])
+    prices = np.concatenate([columns.columns['call_ltp'], columns.columns['put_ltp']]).astype(float)
+    guess = np.concatenate([columns.columns['call_iv'], columns.columns['put_iv']]).astype(float) / 100
+    is_call = np.arange(2 * n) < n
+    vol = implied_vol(prices, spot, both_strikes, t, rate, is_call, guess)
+    values = {'iv': vol * 100}
+    if t > 0 and spot > 0:
+        values.update(greeks(spot, both_strikes, t, rate, vol, is_call))
+    else:
+        values.update({field: np.full(2 * n, np.nan) for field in GREEK_FIELDS[1:]})
+
+    digits = {'iv': 2, 'delta': 4, 'gamma': 6, 'theta': 2, 'vega': 2}
+    return {
+        'version': version,
+        'expiry': expiry,
+        'underlying_price': columns.underlying_price,
+        't': t,
+        'rate': rate,
+        'strikes': strikes.tolist(),
+        'call': {field: _rounded(values[field][:n], digits[field]) for field in GREEK_FIELDS},
+        'put': {field: _rounded(values[field][n:], digits[field]) for field in GREEK_FIELDS},
+    }
+
+
+def queue_greeks(pipe, scrip_id, segment, expiry, version, body_payload, ttl=SNAPSHOT_TTL):
+    """Queue the Greeks body of snapshot `version` (works on sync and asyncio pipelines)."""
+    body = render_snapshot(body_payload)
+    key = greeks_key(scrip_id, segment, expiry)
+    pipe.hset(key, mapping={'body': body, 'etag': content_etag(body), 'version': version})
+    pipe.expire(key, ttl)
+
+
+def load_greeks(binary_client, scrip_id, segment, expiry):
+    """(etag, body, version) of the chain's stored Greeks, or (None, None, None)."""
+    etag, body, version = binary_client.hmget(greeks_key(scrip_id, segment, expiry), 'etag', 'body', 'version')
+    if etag is None or body is None:
+        return None, None, None
+    return etag.decode('utf-8'), body, int(version)
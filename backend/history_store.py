@@ -0,0 +1,250 @@
+"""
+Intraday history of processed option chains, on local disk.
+
+Every snapshot the worker writes is also appended here as fixed-width NumPy
+records, one file pair per trading day and chain:
+
+    <HISTORY_DIR>/<YYYY-MM-DD>/<scrip>_<seg>_<expiry>.strikes   STRIKE_RECORD
+    <HISTORY_DIR>/<YYYY-MM-DD>/<scrip>_<seg>_<expiry>.totals    TOTALS_RECORD
+
+`ts` is the snapshot version (epoch ms), so records line up with the
+versions the API serves and files are sorted by ts. A snapshot appends one
+totals record and a strike record for every row whose recorded fields
+changed since the chain's previous record of the day (every row on the
+first snapshot of a day or after a worker restart); a strike's values hold
+until its next record. Rows that changed only in fields history does not
+keep (time value, change %) are skipped. Appends are a single write() of
+whole records and readers ignore a trailing partial record, so the API can
+read a file the worker is appending to.
+
+Size: a strike record is 64 bytes (LTP and IV as float32, which holds
+their two decimals; OI as int32; volume stays int64), a totals record 88.
+A chain whose 100 strikes all trade between 3s snapshots writes about
+100 x 64 B x 7500 = 48 MB a day; in practice far OTM and ITM strikes that
+did not trade are skipped and the file is a fraction of that. Budget for
+the worst case times the chains tracked times HISTORY_RETENTION_DAYS.
+
+Readers np.memmap the file and binary-search the ts range, so a time
+window only reads the pages holding it. Records of all strikes are
+interleaved, though: read_strike() filters every record in the window,
+so one strike over a whole day reads the whole file (tens of MB, a few
+tens of ms from the page cache). Day directories older than
+HISTORY_RETENTION_DAYS are removed when a new day starts. History is off
+unless HISTORY_DIR is set; the API and the worker must see the same
+directory.
+
+Usage:
+    append_snapshot(scrip_id, segment, expiry, version, payload, rows)
+    records = read_strike(scrip_id, segment, expiry, day, 25000.0, start, end)
+    body = to_columns(records)
+    ltp = column(records, 'call_ltp')
+"""
+import logging
+import os
+import shutil
+import threading
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+from .chain_store import chain_id
+from .expiry_calendar import IST
+
+logger = logging.getLogger(__name__)
+
+HISTORY_DIR = os.getenv('HISTORY_DIR')
+HISTORY_RETENTION_DAYS = int(os.getenv('HISTORY_RETENTION_DAYS', 30))
+# Part of every file name; bump when a record layout changes so old files are not misread
+HISTORY_FORMAT = "v2"
+
+# ts needs int64 (epoch ms) and strikes stay float64 so they compare equal
+# to the API's strikes; prices and IVs have two decimals, so float32 keeps
+# them (column() rounds them back on read). Per-strike OI fits int32, volume
+# in shares can pass 2^31.
+STRIKE_RECORD = np.dtype([
+    ('ts', '<i8'), ('strike', '<f8'),
+    ('call_ltp', '<f4'), ('call_iv', '<f4'),
+    ('call_oi', '<i4'), ('call_oi_chg', '<i4'), ('call_vol', '<i8'),
+    ('put_ltp', '<f4'), ('put_iv', '<f4'),
+    ('put_oi', '<i4'), ('put_oi_chg', '<i4'), ('put_vol', '<i8'),
+])
+
+TOTALS_RECORD = np.dtype([
+    ('ts', '<i8'), ('underlying_price', '<f8'), ('atm_strike', '<f8'),
+    ('total_call_oi', '<i8'), ('total_put_oi', '<i8'),
+    ('total_call_vol', '<i8'), ('total_put_vol', '<i8'),
+    ('total_call_oi_chg', '<i8'), ('total_put_oi_chg', '<i8'),
+    ('total_pcr_oi', '<f8'), ('total_pcr_vol', '<f8'),
+])
+
+_KINDS = {'strikes': STRIKE_RECORD, 'totals': TOTALS_RECORD}
+
+_days_seen = set()
+_days_lock = threading.Lock()
+
+# (chain id, day) -> {strike: recorded fields of the strike's last record}
+_last_recorded = {}
+_last_recorded_lock = threading.Lock()
+
+
+def enabled():
+    return bool(HISTORY_DIR)
+
+
+def trading_day(ts_ms):
+    """IST calendar date of an epoch-ms timestamp."""
+    return datetime.fromtimestamp(ts_ms / 1000, IST).date()
+
+
+def history_path(scrip_id, segment, expiry, day, kind):
+    return os.path.join(HISTORY_DIR, day.isoformat(), f"{chain_id(scrip_id, segment, expiry)}.{HISTORY_FORMAT}.{kind}")
+
+
+def strike_records(ts, rows):
+    """STRIKE_RECORD array for processed chain rows, all stamped `ts`."""
+    records = np.zeros(len(rows), dtype=STRIKE_RECORD)
+    records['ts'] = ts
+    for name in STRIKE_RECORD.names[1:]:
+        records[name] = [row[name] or 0 for row in rows]
+    return records
+
+
+def totals_record(ts, payload):
+    record = np.zeros(1, dtype=TOTALS_RECORD)
+    record['ts'] = ts
+    record['underlying_price'] = payload.get('underlying_price') or 0
+    record['atm_strike'] = payload.get('atm_strike') or 0
+    totals = payload.get('totals') or {}
+    for name in TOTALS_RECORD.names[3:]:
+        record[name] = totals.get(name) or 0
+    return record
+
+
+def _append(path, records):
+    with open(path, 'ab') as f:
+        f.write(records.tobytes())
+
+
+def _start_day(day):
+    # First write of a day: create its directory and drop expired days
+    with _days_lock:
+        if day in _days_seen:
+            return False
+        _days_seen.add(day)
+    os.makedirs(os.path.join(HISTORY_DIR, day.isoformat()), exist_ok=True)
+    prune(day - timedelta(days=HISTORY_RETENTION_DAYS))
+    return True
+
+
+def _recorded_changes(key, rows, chain):
+    # rows whose recorded fields differ from the strike's last record in this
+    # file; a file this process has not written yet gets every row of the chain
+    names = STRIKE_RECORD.names[2:]
+    with _last_recorded_lock:
+        last = _last_recorded.get(key)
+        if last is None:
+            last = _last_recorded[key] = {}
+            rows = chain
+        changed = []
+        for row in rows:
+            values = tuple(row[name] or 0 for name in names)
+            if last.get(row['strike']) != values:
+                last[row['strike']] = values
+                changed.append(row)
+    return changed
+
+
+def append_snapshot(scrip_id, segment, expiry, version, payload, rows):
+    """Record snapshot `version` of a chain: its totals and the given (changed) rows."""
+    if not enabled():
+        return
+    day = trading_day(version)
+    if _start_day(day):
+        with _last_recorded_lock:
+            for key in [key for key in _last_recorded if key[1] != day]:
+                del _last_recorded[key]
+    rows = _recorded_changes((chain_id(scrip_id, segment, expiry), day), rows, payload.get('chain') or [])
+    if rows:
+        _append(history_path(scrip_id, segment, expiry, day, 'strikes'), strike_records(version, rows))
+    _append(history_path(scrip_id, segment, expiry, day, 'totals'), totals_record(version, payload))
+
+
+def prune(before):
+    """Remove the day directories older than `before`."""
+    try:
+        names = os.listdir(HISTORY_DIR)
+    except FileNotFoundError:
+        return
+    for name in names:
+        try:
+            day = date.fromisoformat(name)
+        except ValueError:
+            continue
+        if day < before:
+            shutil.rmtree(os.path.join(HISTORY_DIR, name), ignore_errors=True)
+            logger.info(f"Removed history for {name}")
+
+
+def open_records(scrip_id, segment, expiry, day, kind):
+    """Read-only memmap over one history file (empty array if there is none)."""
+    dtype = _KINDS[kind]
+    path = history_path(scrip_id, segment, expiry, day, kind)
+    try:
+        count = os.path.getsize(path) // dtype.itemsize
+    except FileNotFoundError:
+        count = 0
+    if count == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', shape=(count,))
+
+
+def _ts_slice(records, start, end):
+    ts = records['ts']
+    lo = 0 if start is None else int(np.searchsorted(ts, start, side='left'))
+    hi = len(records) if end is None else int(np.searchsorted(ts, end, side='right'))
+    return records[lo:hi]
+
+
+def read_totals(scrip_id, segment, expiry, day, start=None, end=None):
+    """Totals records with start <= ts <= end (epoch ms, either may be None)."""
+    records = open_records(scrip_id, segment, expiry, day, 'totals')
+    return np.array(_ts_slice(records, start, end))
+
+
+def read_strike(scrip_id, segment, expiry, day, strike, start=None, end=None):
+    """Records of one strike with start <= ts <= end (epoch ms, either may be None)."""
+    records = _ts_slice(open_records(scrip_id, segment, expiry, day, 'strikes'), start, end)
+    return np.array(records[records['strike'] == float(strike)])
+
+
+def totals_at(scrip_id, segment, expiry, day, at=None):
+    """The totals record in effect at `at` (epoch ms; None: the day's last), or None."""
+    records = _ts_slice(open_records(scrip_id, segment, expiry, day, 'totals'), None, at)
+    return records[-1].copy() if len(records) else None
+
+
+def strikes_at(scrip_id, segment, expiry, day, at=None):
+    """
+    Every strike's record in effect at `at` (epoch ms; None: the day's last),
+    sorted by strike. Strikes that left the chain earlier in the day keep
+    their last record.
+    """
+    records = _ts_slice(open_records(scrip_id, segment, expiry, day, 'strikes'), None, at)
+    if not len(records):
+        return np.zeros(0, dtype=STRIKE_RECORD)
+    # np.unique keeps the first occurrence; search the reversed (newest first) strikes
+    _, newest = np.unique(records['strike'][::-1], return_index=True)
+    return np.array(records[len(records) - 1 - newest])
+
+
+def column(records, name):
+    """One field as float64/int64, float32 fields rounded back to their two decimals."""
+    values = records[name]
+    if values.dtype == np.float32:
+        return np.round(values.astype(np.float64), 2)
+    return values.astype(np.int64 if values.dtype.kind == 'i' else np.float64)
+
+
+def to_columns(records):
+    """{field: [values]} for a JSON response."""
+    return {name: column(records, name).tolist() for name in records.dtype.names}
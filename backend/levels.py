@@ -0,0 +1,77 @@
+"""
+Batch support/resistance levels from one option chain snapshot.
+
+For a strike K with put and call prices P and C, spot S and time to expiry
+t (years, whole days / 365) the reversal level is
+
+    level(K) = K + (S - K + P - C + K * (1 - exp(RISK_FREE_RATE * t)))
+
+A strike's support is its own level and its resistance the level of the
+next strike up. The lowest strike's support and the highest strike's
+resistance would need a strike outside the chain, so they are 0. t and the
+discount term are resolved once per chain and the levels computed as array
+operations over the sorted strikes, in the same operation order as the
+scalar formula so the formatted results are unchanged.
+
+Usage:
+    levels = strike_levels(nine_thirty_data, time_to_expiry(expiry, now))
+    # {'25000.000000': {'support': '25012.3456', 'resistance': '25061.0000'}, ...}
+"""
+import math
+
+import numpy as np
+
+from .chain_engine import strike_key
+from .expiry_calendar import expiry_close
+
+RISK_FREE_RATE = -0.067
+DAY_MS = 1000 * 60 * 60 * 24
+
+
+def time_to_expiry(expiry, at):
+    """Years from `at` (aware datetime) to the 15:30 IST close of `expiry`, in whole days; 0 once passed."""
+    diff_ms = (expiry_close(expiry) - at).total_seconds() * 1000
+    if diff_ms <= 0:
+        return 0
+    return math.ceil(diff_ms / DAY_MS) / 365
+
+
+def discount_term(t):
+    """1 - exp(RISK_FREE_RATE * t), the carry adjustment per unit of strike."""
+    return 1 - math.exp(RISK_FREE_RATE * t)
+
+
+def reversal_levels(spot, strikes, puts, calls, t):
+    """level(K) for every strike, as an array (inputs are array-likes of equal length)."""
+    strikes = np.asarray(strikes, dtype=float)
+    reversal = spot - strikes + np.asarray(puts, dtype=float) - np.asarray(calls, dtype=float) \
+        + strikes * discount_term(t)
+    return strikes + reversal
+
+
+def support_resistance(levels):
+    """(support, resistance) arrays from the levels of ascending strikes."""
+    support = np.zeros(len(levels))
+    resistance = np.zeros(len(levels))
+    support[1:] = levels[1:]
+    resistance[:-1] = levels[1:]
+    return support, resistance
+
+
+def format_levels(strikes, support, resistance):
+    return {strike: {'support': f"{s:.4f}", 'resistance': f"{r:.4f}"}
+            for strike, s, r in zip(strikes, support.tolist(), resistance.tolist())}
+
+
+def strike_levels(nine_thirty_data, t):
+    """
+    {strike_key(strike): {'support': "%.4f", 'resistance': "%.4f"}} for a
+    nine_thirty_data-style snapshot: {'s': spot, 'strikes': {strike: {'p', 'c'}}}.
+    """
+    quotes = (nine_thirty_data or {}).get('strikes')
+    if not quotes:
+        return {}
+    rows = sorted((float(strike), quote['p'], quote['c']) for strike, quote in quotes.items())
+    strikes, puts, calls = zip(*rows)
+    levels = reversal_levels(nine_thirty_data.get('s', 0), strikes, puts, calls, t)
+    return format_levels([strike_key(strike) for strike in strikes], *support_resistance(levels))
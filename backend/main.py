@@ -1,5 +1,5 @@
 import email
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, Response, request, jsonify, current_app, g
 import numpy as np
 import os
 from dotenv import load_dotenv
@@ -7,11 +7,29 @@ import pandas as pd
 import json
 import time
 import logging
+import threading
 from concurrent.futures import ThreadPoolExecutor
-from datetime import datetime, timezone
-import math
+from datetime import date, datetime, timezone
 import smtplib
 from email.message import EmailMessage
+from .chain_codec import encode_chain, decode_chain
+from .chain_delta import compare, delta_message, forget, last_version, remember
+from .chain_analytics import pcr_trend
+from .chain_engine import ChainColumns, strike_key
+from .greeks import chain_greeks, greeks_key, load_greeks, queue_greeks
+from .levels import reversal_levels, strike_levels, time_to_expiry
+from . import history_store
+from .snapshot_levels import levels_at
+from .expiry_calendar import (IST, EXPIRY_DEPTH, get_expiry_list, tracked_expiries, memo_expiries,
+                              cached_expiries, cached_current_expiry)
+from .scheduler import RefreshScheduler, REFRESH_STATS_KEY, FAR_EXPIRY_SLOWDOWN, publish_refresh_stats
+from .chain_store import (ORDERS, chain_id, queue_snapshot, queue_touch, queue_rows, load_snapshot,
+                          load_snapshot_meta, load_window, load_row_window, store_window, window_payload, publish_update, update_channel,
+                          delta_channel, gzip_etag)
+from .user_store import add_pending, get_user, normalize_email, set_status, users_with_status
+from .viewers import record_viewer, viewer_id, queue_viewer_counts, viewer_counts
+from .metrics import (CHAIN_REFRESHES, CONTENT_TYPE, DHAN_CALLS, DHAN_FETCH_SECONDS, HTTP_REQUEST_SECONDS,
+                      HTTP_RESPONSE_BYTES, mark_refreshed, render_api_metrics)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -19,131 +37,270 @@ logger = logging.getLogger(__name__)
 
 main_bp = Blueprint('main', __name__)
 
+# Server-Sent Events: comment line sent when no update arrived for this long,
+# and the lifetime after which a stream is closed (EventSource reconnects).
+SSE_HEARTBEAT_SECONDS = 15
+SSE_MAX_STREAM_SECONDS = int(os.getenv('SSE_MAX_STREAM_SECONDS', 900))
+
+def build_option_chain_payload(chain_data):
+    # Build the /api/get_option_chain response body from the raw Dhan chain
+    return ChainColumns.from_chain(chain_data).to_payload()
+
 def process_option_chain(chain_data):
-    # Process the option chain data as needed
-    
-    underlying_price = chain_data.get('last_price', 0)
-    oc = chain_data.get('oc', {})
-
-    strikes = sorted([float(k) for k in oc.keys()])
-    processed_chain = []
-    total_call_oi = total_call_vol = total_put_oi = total_put_vol = 0
-    total_call_oi_chg = total_put_oi_chg = 0
-
-    for strike in strikes:
-        str_strike = f"{strike:.6f}"
-        ce = oc.get(str_strike, {}).get('ce', {})
-        pe = oc.get(str_strike, {}).get('pe', {})
-
-        def get_val(d, key): return d.get(key, 0)
-
-        ce_ltp = get_val(ce, 'last_price')
-        ce_prev_close = get_val(ce, 'previous_close_price')
-        ce_chg_pct = ((ce_ltp - ce_prev_close) / ce_prev_close * 100) if ce_prev_close else 0
-        ce_oi = get_val(ce, 'oi')
-        ce_prev_oi = get_val(ce, 'previous_oi')
-        ce_oi_chg = ce_oi - ce_prev_oi
-        ce_vol = get_val(ce, 'volume')
-        ce_iv = get_val(ce, 'implied_volatility')
-        ce_intrinsic = max(underlying_price - strike, 0)
-        ce_tv = ce_ltp - ce_intrinsic
-
-        pe_ltp = get_val(pe, 'last_price')
-        pe_prev_close = get_val(pe, 'previous_close_price')
-        pe_chg_pct = ((pe_ltp - pe_prev_close) / pe_prev_close * 100) if pe_prev_close else 0
-        pe_oi = get_val(pe, 'oi')
-        pe_prev_oi = get_val(pe, 'previous_oi')
-        pe_oi_chg = pe_oi - pe_prev_oi
-        pe_vol = get_val(pe, 'volume')
-        pe_iv = get_val(pe, 'implied_volatility')
-        pe_intrinsic = max(strike - underlying_price, 0)
-        pe_tv = pe_ltp - pe_intrinsic
-
-        pcr_oi = (pe_oi / ce_oi) if ce_oi > 0 else 0
-        pcr_vol = (pe_vol / ce_vol) if ce_vol > 0 else 0
-
-        processed_chain.append({
-            'strike': strike,
-            'pcr_oi': round(pcr_oi, 2),
-            'pcr_vol': round(pcr_vol, 2),
-            'call_iv': round(ce_iv, 2),
-            'call_tv': round(ce_tv, 2),
-            'call_oi_chg': ce_oi_chg,
-            'call_oi': ce_oi,
-            'call_vol': ce_vol,
-            'call_chg_pct': round(ce_chg_pct, 2),
-            'call_ltp': round(ce_ltp, 2),
-            'put_ltp': round(pe_ltp, 2),
-            'put_chg_pct': round(pe_chg_pct, 2),
-            'put_vol': pe_vol,
-            'put_oi': pe_oi,
-            'put_oi_chg': pe_oi_chg,
-            'put_tv': round(pe_tv, 2),
-            'put_iv': round(pe_iv, 2)
-        })
+    return jsonify(build_option_chain_payload(chain_data))
 
-        total_call_oi += ce_oi
-        total_call_vol += ce_vol
-        total_put_oi += pe_oi
-        total_put_vol += pe_vol
-        total_call_oi_chg += ce_oi_chg
-        total_put_oi_chg += pe_oi_chg
-
-    total_pcr_oi = (total_put_oi / total_call_oi) if total_call_oi > 0 else 0
-    total_pcr_vol = (total_put_vol / total_call_vol) if total_call_vol > 0 else 0
-    atm_strike = min(strikes, key=lambda x: abs(x - underlying_price))
-
-    return jsonify({
-        'underlying_price': underlying_price,
-        'atm_strike': atm_strike,
-        'chain': processed_chain,
-        'totals': {
-            'total_pcr_oi': round(total_pcr_oi, 2),
-            'total_pcr_vol': round(total_pcr_vol, 2),
-            'total_call_oi': total_call_oi,
-            'total_call_vol': total_call_vol,
-            'total_put_oi': total_put_oi,
-            'total_put_vol': total_put_vol,
-            'total_call_oi_chg': total_call_oi_chg,
-            'total_put_oi_chg': total_put_oi_chg
-        }
-    })
+@main_bp.before_request
+def before_request():
+    g.request_started = time.perf_counter()
 
 @main_bp.after_request
 def after_request(response):
     response.headers.add('Access-Control-Allow-Origin', '*')
-    response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
+    response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization,If-None-Match')
     response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
+    response.headers.add('Access-Control-Expose-Headers', 'ETag,X-Chain-Version')
+    _observe_request(response)
+    return response
+
+def _observe_request(response):
+    # streamed responses (SSE) are timed up to their first byte and have no size
+    started = g.get('request_started')
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    if started is not None:
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint, request.method,
+                                     response.status_code)
+    if not response.is_streamed and response.content_length is not None:
+        HTTP_RESPONSE_BYTES.observe(response.content_length, endpoint)
+
+def _etag_matches(etag):
+    # If-None-Match uses the weak comparison, and POST polls send it too
+    return request.if_none_match.contains_weak(etag)
+
+def _not_modified(etag, version=None):
+    response = current_app.response_class(status=304)
+    response.set_etag(etag)
+    if version is not None:
+        response.headers['X-Chain-Version'] = str(version)
+    return response
+
+def _conditional_json(payload):
+    """jsonify() with a content ETag; 304 with no body if the client already has it."""
+    response = jsonify(payload)
+    response.add_etag()
+    etag, _ = response.get_etag()
+    if _etag_matches(etag):
+        return _not_modified(etag)
+    return response
+
+def _window_params(params):
+    """
+    (window, order) from request params. window is the number of strikes kept
+    each side of the underlying; None means the whole chain.
+    """
+    window = params.get('window')
+    window = int(window) if window not in (None, '') else None
+    if window is not None and window < 1:
+        raise ValueError('window must be >= 1')
+    order = params.get('order') or 'ascending'
+    if order not in ORDERS:
+        raise ValueError(f"order must be one of {ORDERS}")
+    return window, order
+
+def _request_expiry(params, scrip_id, segment):
+    """Expiry asked for in request params, else the current one from the expiry calendar."""
+    return params.get('expiry') or cached_current_expiry(current_app.redis_client, scrip_id, segment)
+
+def _record_viewer(redis_client, scrip_id, segment, expiry, viewer):
+    # Demand signal for the worker; never let it fail a chain request
+    try:
+        record_viewer(redis_client, scrip_id, segment, expiry, viewer)
+    except Exception as e:
+        logger.warning("Could not record viewer for %s %s %s: %s", scrip_id, segment, expiry, e)
+
+def _load_window_body(binary_client, scrip_id, segment, expiry, version, window, order, accept_gzip=False):
+    """
+    (etag, body, encoding) for one window of snapshot `version` (window None:
+    the whole chain in `order`). A window the worker did not pre-render is
+    built once, from the per-strike layout when it holds that version, else
+    from the full snapshot, and cached.
+    """
+    etag, body, encoding = load_window(binary_client, scrip_id, segment, expiry, version,
+                                       window, order, accept_gzip=accept_gzip)
+    if etag is None:
+        payload = None
+        if window is not None:
+            payload = load_row_window(binary_client, scrip_id, segment, expiry, version, window)
+        if payload is None:
+            full, _ = load_snapshot(binary_client, scrip_id, segment, expiry)
+            if full is None:
+                return None, None, None
+            payload = json.loads(full)
+        etag, body = store_window(binary_client, scrip_id, segment, expiry, version,
+                                  payload, window, order)
+        encoding = None
+    return etag, body, encoding
+
+def _chain_body_response(body, encoding, etag, version):
+    response = current_app.response_class(body, mimetype='application/json')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    if etag is not None:
+        response.set_etag(etag)
+        response.headers['X-Chain-Version'] = str(version)
     return response
 
 @main_bp.route('/api/get_option_chain', methods=['GET', 'POST'])
 def get_option_chain():
+    """
+    Body: { "underlying_scrip": <id>, "underlying_seg": "<segment>",
+            "expiry": "YYYY-MM-DD" (optional, default: current expiry),
+            "window": <strikes each side of spot, optional>,
+            "order": "ascending"|"descending" }
+    """
     data = request.get_json() or {}
     underlying_scrip = data.get('underlying_scrip')
     underlying_seg = data.get('underlying_seg')
 
     if not underlying_scrip or not underlying_seg:
         return jsonify({'error': 'Missing underlying_scrip or underlying_seg'}), 400
-
-    cache_key = f"option_chain:{underlying_scrip}_{underlying_seg}"
-    cached_data = current_app.redis_client.get(cache_key)
+    try:
+        window, order = _window_params(data)
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': f"Invalid window/order: {e}"}), 400
+    expiry = _request_expiry(data, underlying_scrip, underlying_seg)
+    if not expiry:
+        return jsonify({'error': 'Data not available in cache'}), 404
+    _record_viewer(current_app.redis_client, underlying_scrip, underlying_seg, expiry, viewer_id(request))
+
+    # Fast path: the worker already rendered the response body for this chain
+    accept_gzip = request.accept_encodings['gzip'] > 0
+    binary_client = current_app.redis_binary_client
+    version, etag = load_snapshot_meta(current_app.redis_client, underlying_scrip, underlying_seg, expiry)
+
+    if window is None and order == 'ascending':
+        if etag is not None:
+            response_etag = gzip_etag(etag) if accept_gzip else etag
+            if _etag_matches(response_etag):
+                return _not_modified(response_etag, version)
+        body, encoding = load_snapshot(binary_client, underlying_scrip, underlying_seg,
+                                       expiry, accept_gzip=accept_gzip)
+        if body is not None:
+            if etag is not None:
+                etag = gzip_etag(etag) if encoding else etag
+            return _chain_body_response(body, encoding, etag, version)
+    elif version is not None:
+        etag, body, encoding = _load_window_body(binary_client, underlying_scrip, underlying_seg, expiry,
+                                                 version, window, order, accept_gzip=accept_gzip)
+        if body is not None:
+            etag = gzip_etag(etag) if encoding else etag
+            if _etag_matches(etag):
+                return _not_modified(etag, version)
+            return _chain_body_response(body, encoding, etag, version)
+
+    # Fallback for chains cached by a worker that does not write snapshots yet
+    cache_key = f"option_chain:{chain_id(underlying_scrip, underlying_seg, expiry)}"
+    cached_data = binary_client.get(cache_key)
     if not cached_data:
         return jsonify({'error': 'Data not available in cache'}), 404
 
-    # cached_data is stored as JSON string -> ensure it's a Python dict
-    if isinstance(cached_data, (bytes,)):
-        cached_data = cached_data.decode('utf-8')
+    # stored in whichever CHAIN_CODEC format the worker runs with
     try:
-        chain_dict = json.loads(cached_data)
+        chain_dict = decode_chain(cached_data)
     except Exception:
         return jsonify({'error': 'Cached data corrupted'}), 500
 
-    processed_response = process_option_chain(chain_dict)
-    return processed_response
+    return jsonify(window_payload(build_option_chain_payload(chain_dict), window, order))
+
+
+def _sse_event(body, event=None):
+    prefix = b"event: " + event.encode() + b"\n" if event else b""
+    return prefix + b"data: " + body + b"\n\n"
+
+@main_bp.route('/api/stream/option_chain', methods=['GET'])
+def stream_option_chain():
+    """
+    Server-Sent Events stream of processed chains. Sends the current snapshot on
+    connect, then one `data:` message per snapshot the worker publishes.
+    Query: ?underlying_scrip=<id>&underlying_seg=<segment>[&expiry=<YYYY-MM-DD>&window=<n>&order=<order>]
+
+    With delta=1 (whole chain only) updates arrive as `event: delta` messages
+    holding the changed strikes (see backend.chain_delta); a full snapshot is
+    sent again whenever a delta does not apply to the last version sent.
+    """
+    underlying_scrip = request.args.get('underlying_scrip')
+    underlying_seg = request.args.get('underlying_seg')
+
+    if not underlying_scrip or not underlying_seg:
+        return jsonify({'error': 'Missing underlying_scrip or underlying_seg'}), 400
+    try:
+        window, order = _window_params(request.args)
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': f"Invalid window/order: {e}"}), 400
+    expiry = _request_expiry(request.args, underlying_scrip, underlying_seg)
+    if not expiry:
+        return jsonify({'error': 'Data not available in cache'}), 404
+
+    binary_client = current_app.redis_binary_client
+    redis_client = current_app.redis_client
+    viewer = viewer_id(request)
+    full_chain = window is None and order == 'ascending'
+    delta = request.args.get('delta') in ('1', 'true')
+    if delta and not full_chain:
+        return jsonify({'error': 'Delta streams carry the whole chain; drop window/order'}), 400
+    channel = (delta_channel if delta else update_channel)(underlying_scrip, underlying_seg, expiry)
+
+    def current_body(version):
+        if full_chain:
+            return load_snapshot(binary_client, underlying_scrip, underlying_seg, expiry)[0]
+        if version is None:
+            return None
+        return _load_window_body(binary_client, underlying_scrip, underlying_seg, expiry,
+                                 version, window, order)[1]
+
+    def events():
+        pubsub = binary_client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(channel)
+        deadline = time.monotonic() + SSE_MAX_STREAM_SECONDS
+        try:
+            version, _ = load_snapshot_meta(binary_client, underlying_scrip, underlying_seg, expiry)
+            body = current_body(version)
+            if body is not None:
+                yield _sse_event(body)
+            while time.monotonic() < deadline:
+                _record_viewer(redis_client, underlying_scrip, underlying_seg, expiry, viewer)
+                message = pubsub.get_message(timeout=SSE_HEARTBEAT_SECONDS)
+                if message is None:
+                    yield b": keep-alive\n\n"
+                    continue
+                if delta:
+                    update = json.loads(message['data'])
+                    if version is not None and update['base_version'] == version:
+                        version = update['version']
+                        yield _sse_event(message['data'], 'delta')
+                        continue
+                    version, _ = load_snapshot_meta(binary_client, underlying_scrip, underlying_seg, expiry)
+                    body = current_body(version)
+                else:
+                    body = current_body(int(message['data']))
+                if body is not None:
+                    yield _sse_event(body)
+        except Exception as e:
+            logger.error("Chain stream error for %s %s: %s", underlying_scrip, underlying_seg, e)
+        finally:
+            pubsub.close()
+
+    return Response(events(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
 
 
 @main_bp.route('/api/get_expiries', methods=['GET','POST'])
 def get_expiries():
+    """
+    { "data": <current expiry>, "expiries": [<expiries the worker collects, nearest first>] }
+    """
     try:
         data = request.get_json() or {}
         underlying_scrip = data.get('underlying_scrip')
@@ -152,19 +309,129 @@ def get_expiries():
         if not underlying_scrip or not underlying_seg:
             return jsonify({"error": "Missing underlying_scrip or underlying_seg"}), 400
 
+        expiries = cached_expiries(current_app.redis_client, underlying_scrip, underlying_seg)
+        if expiries:
+            return _conditional_json({'data': expiries[0], 'expiries': expiries})
+
         cache_key = f"expiry_date:{underlying_scrip}_{underlying_seg}"
         cached_data = current_app.redis_client.get(cache_key)
         if cached_data is None:
             return jsonify({'data': None})
         if isinstance(cached_data, (bytes,)):
             cached_data = cached_data.decode('utf-8')
-        return jsonify({'data': cached_data})
+        return _conditional_json({'data': cached_data, 'expiries': [cached_data]})
         
     except Exception as e:
         print(f"Error in get_expiries: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
 
+@main_bp.route('/api/get_greeks', methods=['GET', 'POST'])
+def get_greeks():
+    """
+    Body: { "underlying_scrip": <id>, "underlying_seg": "<segment>",
+            "expiry": "YYYY-MM-DD" (optional, default: current expiry) }
+    Returns the worker's IV and Greeks for the current snapshot (see
+    backend.greeks.chain_greeks), with an ETag; X-Chain-Version is the
+    snapshot they were computed from.
+    """
+    data = request.get_json(silent=True) or request.args
+    underlying_scrip = data.get('underlying_scrip')
+    underlying_seg = data.get('underlying_seg')
+    if not underlying_scrip or not underlying_seg:
+        return jsonify({'error': 'Missing underlying_scrip or underlying_seg'}), 400
+    expiry = _request_expiry(data, underlying_scrip, underlying_seg)
+    if not expiry:
+        return jsonify({'error': 'Data not available in cache'}), 404
+
+    etag, body, version = load_greeks(current_app.redis_binary_client, underlying_scrip, underlying_seg, expiry)
+    if etag is None:
+        return jsonify({'error': 'Data not available in cache'}), 404
+    if _etag_matches(etag):
+        return _not_modified(etag, version)
+    return _chain_body_response(body, None, etag, version)
+
+
+@main_bp.route('/api/get_history', methods=['GET', 'POST'])
+def get_history():
+    """
+    Body: { "underlying_scrip": <id>, "underlying_seg": "<segment>",
+            "expiry": "YYYY-MM-DD" (optional, default: current expiry),
+            "date": "YYYY-MM-DD" (optional, default: today IST),
+            "strike": <strike> (optional, default: chain totals),
+            "start": <epoch ms>, "end": <epoch ms> (optional) }
+    Returns { "expiry", "date", "strike", "data": {field: [values]} }, one
+    value per recorded snapshot, oldest first.
+    """
+    if not history_store.enabled():
+        return jsonify({'error': 'History is not enabled'}), 404
+    data = request.get_json(silent=True) or request.args
+    underlying_scrip = data.get('underlying_scrip')
+    underlying_seg = data.get('underlying_seg')
+    if not underlying_scrip or not underlying_seg:
+        return jsonify({'error': 'Missing underlying_scrip or underlying_seg'}), 400
+    try:
+        day = date.fromisoformat(data['date']) if data.get('date') else datetime.now(IST).date()
+        strike = float(data['strike']) if data.get('strike') not in (None, '') else None
+        start = int(data['start']) if data.get('start') not in (None, '') else None
+        end = int(data['end']) if data.get('end') not in (None, '') else None
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': f"Invalid history query: {e}"}), 400
+    expiry = _request_expiry(data, underlying_scrip, underlying_seg)
+    if not expiry:
+        return jsonify({'error': 'Data not available in cache'}), 404
+
+    if strike is None:
+        records = history_store.read_totals(underlying_scrip, underlying_seg, expiry, day, start, end)
+    else:
+        records = history_store.read_strike(underlying_scrip, underlying_seg, expiry, day, strike, start, end)
+    return _conditional_json({'expiry': expiry, 'date': day.isoformat(), 'strike': strike,
+                              'data': history_store.to_columns(records)})
+
+
+def _snapshot_time(day, params):
+    """Epoch ms asked for by `ts` (epoch ms) or `time` ("HH:MM[:SS]" IST on `day`); None: day's last."""
+    if params.get('ts') not in (None, ''):
+        return int(params['ts'])
+    if params.get('time'):
+        clock = datetime.strptime(params['time'], '%H:%M:%S' if params['time'].count(':') == 2 else '%H:%M').time()
+        return int(datetime.combine(day, clock, IST).timestamp() * 1000)
+    return None
+
+
+@main_bp.route('/api/get_levels', methods=['GET', 'POST'])
+def get_levels():
+    """
+    Body: { "underlying_scrip": <id>, "underlying_seg": "<segment>",
+            "expiry": "YYYY-MM-DD" (optional, default: current expiry),
+            "date": "YYYY-MM-DD" (optional, default: today IST),
+            "time": "HH:MM[:SS]" IST or "ts": <epoch ms> (optional, default:
+            the day's last snapshot, i.e. the close for a past day) }
+    Returns the nine_thirty_data-style levels of the snapshot in effect at
+    that time: { "expiry", "date", "ts", "s", "t", "strikes", "strikeLevels" }.
+    """
+    if not history_store.enabled():
+        return jsonify({'error': 'History is not enabled'}), 404
+    data = request.get_json(silent=True) or request.args
+    underlying_scrip = data.get('underlying_scrip')
+    underlying_seg = data.get('underlying_seg')
+    if not underlying_scrip or not underlying_seg:
+        return jsonify({'error': 'Missing underlying_scrip or underlying_seg'}), 400
+    try:
+        day = date.fromisoformat(data['date']) if data.get('date') else datetime.now(IST).date()
+        at = _snapshot_time(day, data)
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': f"Invalid levels query: {e}"}), 400
+    expiry = _request_expiry(data, underlying_scrip, underlying_seg)
+    if not expiry:
+        return jsonify({'error': 'Data not available in cache'}), 404
+
+    result = levels_at(current_app.redis_client, underlying_scrip, underlying_seg, expiry, day, at)
+    if result is None:
+        return jsonify({'error': 'No snapshot recorded by that time'}), 404
+    return _conditional_json(result)
+
+
 @main_bp.route('/api/get_all_scrips', methods=['GET'])
 def get_all_scrips():
 
@@ -191,82 +458,60 @@ def get_nine_thirty_data():
 
         cache_key = f"nine_thirty_data:{underlying_scrip}_{underlying_seg}"
         cached_data = current_app.redis_client.get(cache_key)
+        if cached_data is None:
+            cached_data = _recorded_nine_thirty_data(underlying_scrip, underlying_seg)
         if cached_data is None:
             return jsonify({'data': None})
         if isinstance(cached_data, (bytes,)):
             cached_data = cached_data.decode('utf-8')
-        return jsonify({'data': cached_data})
+        return _conditional_json({'data': cached_data})
     
     except Exception as e:
         print(f"Error in get_nine_thirty_data: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
 
+def _recorded_nine_thirty_data(scrip_id, segment):
+    """Today's 09:30 levels from the history when the worker did not store them (e.g. it started late)."""
+    now = datetime.now(IST)
+    if not history_store.enabled() or (now.hour, now.minute) < (9, 30):
+        return None
+    expiry = cached_current_expiry(current_app.redis_client, scrip_id, segment)
+    if not expiry:
+        return None
+    at = int(now.replace(hour=9, minute=30, second=0, microsecond=0).timestamp() * 1000)
+    result = levels_at(current_app.redis_client, scrip_id, segment, expiry, now.date(), at)
+    return json.dumps(result) if result else None
+
 def calculate_nine_thirty_strike_levels(nine_thirty_data, scrip_id, segment, redis_client):
+    # One time-to-expiry lookup per chain; levels for all strikes at once (backend.levels)
     if not nine_thirty_data or not nine_thirty_data.get('strikes'):
         return {}
-    
-    strikes_array = sorted(list(nine_thirty_data['strikes'].keys()), key=lambda x: float(x))
-    chain = [{'strike': float(strike), 'put_ltp': nine_thirty_data['strikes'][strike]['p'], 
-              'call_ltp': nine_thirty_data['strikes'][strike]['c']} for strike in strikes_array]
-    nine_thirty_strike_levels = {}
-
-    strikes = [float(s) for s in strikes_array]
-    step = strikes[1] - strikes[0] if len(strikes) > 1 else 50
-    lowest_strike = strikes_array[0]
-    lowest_data = nine_thirty_data['strikes'][lowest_strike]
-    hypothetical_low = {'strike': float(lowest_strike) - step, 'put_ltp': lowest_data['p'], 'call_ltp': lowest_data['c']}
-    low_support = calculate_reversal(hypothetical_low, nine_thirty_data, scrip_id, segment, redis_client)
-    
-    for i, row in enumerate(chain):
-        support = low_support if i == 0 else calculate_reversal(row, nine_thirty_data, scrip_id, segment, redis_client)
-        if i < len(strikes) - 1:
-            resistance = calculate_reversal(chain[i + 1], nine_thirty_data, scrip_id, segment, redis_client)
-        else:
-            hypothetical_high = {**row, 'strike': float(row['strike']) + step}
-            resistance = calculate_reversal(hypothetical_high, nine_thirty_data, scrip_id, segment, redis_client)
-        nine_thirty_strike_levels[row['strike']] = {
-            'support': f"{support:.4f}",
-            'resistance': f"{resistance:.4f}"
-        }
-    
-    return nine_thirty_strike_levels
+    return strike_levels(nine_thirty_data, calculate_t(scrip_id, segment, redis_client))
 
 def calculate_reversal(row, nine_thirty_data, scrip_id, segment, redis_client):
-    RISK_FREE_RATE = -0.067
-    P = row.get('put_ltp') if isinstance(row, dict) else row['put_ltp']
-    C = row.get('call_ltp') if isinstance(row, dict) else row['call_ltp']
+    """Level of a single strike; calculate_nine_thirty_strike_levels() does the whole chain."""
     K = float(row.get('strike') if isinstance(row, dict) else row['strike'])
-    # prefer nine_thirty_data's S if provided
-    S = nine_thirty_data.get('s', 0)
-    strike_data = nine_thirty_data.get('strikes', {}).get(str(K)) or nine_thirty_data.get('strikes', {}).get(K)
-    if strike_data:
-        P = strike_data.get('p', P)
-        C = strike_data.get('c', C)
-    else:
+    # snapshot keys are Dhan's strike strings ("25000.000000"); match numerically
+    strike_data = next((quote for strike, quote in nine_thirty_data.get('strikes', {}).items()
+                        if float(strike) == K), None)
+    if not strike_data:
         # if strike data missing, return 0 as safe default
         return 0
     t = calculate_t(scrip_id, segment, redis_client)
-    exp_term = math.exp(RISK_FREE_RATE * t)
-    one_minus_exp = 1 - exp_term
-    reversal = S - K + P - C + K * one_minus_exp
-    return K + reversal
+    return reversal_levels(nine_thirty_data.get('s', 0), [K], [strike_data['p']], [strike_data['c']], t)[0].item()
 
 def calculate_t(scrip_id, segment, redis_client):
     now = datetime.now(timezone.utc)
-    cache_key = f"expiry_date:{scrip_id}_{segment}"
-    selected_expiry = redis_client.get(cache_key)
+    selected_expiry = cached_current_expiry(redis_client, scrip_id, segment)
+    if selected_expiry is None:
+        # calendar not cached yet: fall back to the expiry the worker last used
+        selected_expiry = redis_client.get(f"expiry_date:{scrip_id}_{segment}")
     if selected_expiry is None:
         return 0
     if isinstance(selected_expiry, (bytes,)):
         selected_expiry = selected_expiry.decode('utf-8')
-    expiry_date = datetime.strptime(f"{selected_expiry} 15:30:00+05:30", "%Y-%m-%d %H:%M:%S%z")
-    diff_ms = (expiry_date - now).total_seconds() * 1000
-    if diff_ms <= 0:
-        return 0
-    diff_days_fractional = diff_ms / (1000 * 60 * 60 * 24)
-    days = math.ceil(diff_days_fractional)
-    return days / 365
+    return time_to_expiry(selected_expiry, now)
 
 def calc_nine_thirty_data(chain_data: dict, scrip_id, segment, redis_client):
     
@@ -276,7 +521,7 @@ def calc_nine_thirty_data(chain_data: dict, scrip_id, segment, redis_client):
         'date': datetime.now().strftime('%Y-%m-%d')
     }
     for key, value in chain_data.get('oc', {}).items():
-        nine_thirty_chain_data['strikes'][str(key)] = {'p': value['pe']['last_price'], 'c': value['ce']['last_price']}
+        nine_thirty_chain_data['strikes'][strike_key(key)] = {'p': value['pe']['last_price'], 'c': value['ce']['last_price']}
     
     nine_thirty_strike_levels = calculate_nine_thirty_strike_levels(nine_thirty_chain_data, scrip_id, segment, redis_client)
     nine_thirty_data = {
@@ -288,9 +533,22 @@ def calc_nine_thirty_data(chain_data: dict, scrip_id, segment, redis_client):
 
     return nine_thirty_data
 
+# NSE session (IST) during which chains change; generous around 09:15-15:30
+MARKET_OPEN = (9, 0)
+MARKET_CLOSE = (15, 40)
+
+def is_market_open(now=None):
+    if os.getenv('MARKET_ALWAYS_OPEN') == '1':
+        # replay and load tests outside market hours
+        return True
+    now = now or datetime.now(IST)
+    if now.weekday() >= 5 or now.strftime('%Y-%m-%d') in (os.getenv('NSE_HOLIDAYS') or ''):
+        return False
+    return MARKET_OPEN <= (now.hour, now.minute) < MARKET_CLOSE
+
 def is_start_of_trading_day():
     load_dotenv()
-    nse_holidays = os.getenv('NSE_HOLIDAYS')
+    nse_holidays = os.getenv('NSE_HOLIDAYS') or ''
     state = False
     now = datetime.now()
     day = now.weekday()
@@ -303,82 +561,299 @@ def is_start_of_trading_day():
             state = True
     return state
 
-# Function to fetch and cache option chain data
-def fetch_and_cache_option_chain(dhan_client, redis_client, scrip_id, segment):
-    while True:
-        try:
-            expiry_data = dhan_client.fetch_expiry_list(underlying_scrip=scrip_id,
-                                            underlying_seg=segment)
-            expiry_list = expiry_data.get('data', {})
-            if not expiry_list:
-                logger.error(f"No expiry list for {scrip_id} {segment}, retrying")
-                time.sleep(5)
-                continue
-            expiry_date = expiry_list[0]
-            option_chain = dhan_client.fetch_option_chain(underlying_scrip=scrip_id,
-                                                    underlying_seg=segment,
-                                                    expiry=expiry_date)
-            # DO NOT return on non-success; retry after a short sleep
-            if option_chain.get('status') != 'success':
-                logger.error(f"Failed to fetch option chain for {scrip_id} in {segment}. Status: {option_chain.get('status')}. Retrying...")
-                time.sleep(5)
-                continue
-
-            cache_key_oc = f"option_chain:{scrip_id}_{segment}"
-            cache_key_exp = f"expiry_date:{scrip_id}_{segment}"
-            cache_key_nine_thirty_data = f"nine_thirty_data:{scrip_id}_{segment}"
-            chain_data = option_chain.get('data', {})
+# Seconds between refreshes of one instrument, and after a failed attempt
+REFRESH_INTERVAL = 3
+RETRY_INTERVAL = 5
+# Threaded worker: concurrent refreshes, scheduler poll cap, stats cadence
+WORKER_THREADS = int(os.getenv('WORKER_THREADS', 16))
+DISPATCH_POLL = 0.25
+STATS_INTERVAL = 10
+# How often the worker re-reads viewer counts and the market session
+DEMAND_INTERVAL = 2
+
+# (scrip_id, segment) -> date whose nine-thirty levels this process stored
+_nine_thirty_stored = {}
+
+def nine_thirty_due(scrip_id, segment):
+    """True in the 9:30 minute until this process has stored the day's levels."""
+    today = datetime.now().strftime('%Y-%m-%d')
+    return _nine_thirty_stored.get((scrip_id, segment)) != today and is_start_of_trading_day()
+
+def nine_thirty_levels(chain_data, scrip_id, segment, redis_client):
+    """calc_nine_thirty_data(), or None when it fails: the levels never cost the chain write."""
+    try:
+        return calc_nine_thirty_data(chain_data, scrip_id, segment, redis_client)
+    except Exception as e:
+        logger.error(f"Could not compute nine-thirty levels for {scrip_id} {segment}: {e}")
+        return None
 
-            # expiry
-            redis_client.set(cache_key_exp, expiry_date, ex=300)
+def mark_nine_thirty_stored(scrip_id, segment):
+    _nine_thirty_stored[(scrip_id, segment)] = datetime.now().strftime('%Y-%m-%d')
 
-            # Cache the processed response (TTL=300s for live data)
-            json_data = json.dumps(chain_data)
-            set_res = redis_client.set(cache_key_oc, json_data, ex=300)
-            logger.info(f"Redis SET {cache_key_oc} -> {set_res}")
+def queue_chain_writes(pipe, scrip_id, segment, expiry_date, chain_data, front_month=True,
+                       nine_thirty_data=None):
+    """
+    Queue every write for one fetched chain: raw chain and processed snapshot
+    under its expiry's keys (including the per-strike layout), its IV and
+    Greeks (backend.greeks), the update notification and the per-strike
+    delta. The totals also get the intraday PCR trend
+    (backend.chain_analytics). The current expiry (front_month) also sets
+    expiry_date, and nine_thirty_data when given is stored unless the day's
+    levels already are.
+
+    A chain whose processed rows and totals match the last snapshot written
+    (backend.chain_delta) is not rewritten; its TTLs are refreshed once half
+    spent. Works on sync and redis.asyncio pipelines. Returns None when
+    nothing was queued, else a value to pass with the pipeline's replies to
+    settle_chain_writes() once the pipeline has executed.
+    """
+    cache_key_oc = f"option_chain:{chain_id(scrip_id, segment, expiry_date)}"
+    cache_key_exp = f"expiry_date:{scrip_id}_{segment}"
+    cache_key_nine_thirty_data = f"nine_thirty_data:{scrip_id}_{segment}"
+
+    if nine_thirty_data is not None:
+        pipe.set(cache_key_nine_thirty_data, json.dumps(nine_thirty_data), ex=86340, nx=True)
+
+    # Render the API response once here instead of once per request
+    columns = ChainColumns.from_chain(chain_data)
+    payload = columns.to_payload()
+    payload['totals']['pcr_trend'] = pcr_trend(scrip_id, segment, expiry_date, payload['totals'])
+    key = chain_id(scrip_id, segment, expiry_date)
+    state = compare(key, payload)
+    if not state.changed:
+        if not state.touch_due:
+            return None
+        touched_from = len(pipe.command_stack)
+        if front_month:
+            pipe.expire(cache_key_exp, 300)
+        pipe.expire(cache_key_oc, 300)
+        pipe.expire(greeks_key(scrip_id, segment, expiry_date), 300)
+        queue_touch(pipe, scrip_id, segment, expiry_date, state.previous['version'])
+        return key, state.touched(), None, slice(touched_from, len(pipe.command_stack))
+
+    if front_month:
+        pipe.set(cache_key_exp, expiry_date, ex=300)
+    pipe.set(cache_key_oc, encode_chain(chain_data), ex=300)
+    _, version, _ = queue_snapshot(pipe, scrip_id, segment, expiry_date, payload)
+    full = state.full_write_due
+    queue_rows(pipe, scrip_id, segment, expiry_date, payload, version,
+               rows=None if full else state.changed_rows(),
+               removed=() if full else state.removed_strikes())
+    queue_greeks(pipe, scrip_id, segment, expiry_date, version,
+                 chain_greeks(columns, expiry_date, version))
+    publish_update(pipe, scrip_id, segment, expiry_date, version)
+    pipe.publish(delta_channel(scrip_id, segment, expiry_date), delta_message(state, version))
+    history = None
+    if history_store.enabled():
+        history = (scrip_id, segment, expiry_date, version, payload, state.changed_rows())
+    return key, state.snapshot(version, full=full), history, None
+
+def settle_chain_writes(written, replies):
+    """
+    Record what the executed pipeline of queue_chain_writes() wrote (`replies`
+    are its results) and return the history to append, or None. An EXPIRE
+    that found its key gone means Redis lost the chain: it is forgotten so
+    the next refresh writes it in full.
+    """
+    if written is None:
+        return None
+    key, snapshot, history, touches = written
+    if touches is not None and not all(replies[touches]):
+        logger.warning(f"Keys of {key} missing on TTL refresh; rewriting it on the next refresh")
+        forget(key)
+        return None
+    remember(key, snapshot)
+    return history
+
+def cache_option_chain(redis_client, scrip_id, segment, expiry_date, chain_data, front_month=True):
+    """
+    Write one fetched chain to Redis in a single MULTI/EXEC (see
+    queue_chain_writes). Returns the seconds the write phase took.
+    """
+    started = time.perf_counter()
+    nine_thirty_data = None
+    if front_month and nine_thirty_due(scrip_id, segment):
+        nine_thirty_data = nine_thirty_levels(chain_data, scrip_id, segment, redis_client)
+    pipe = redis_client.pipeline()
+    written = queue_chain_writes(pipe, scrip_id, segment, expiry_date, chain_data,
+                                 front_month=front_month, nine_thirty_data=nine_thirty_data)
+    record_history(settle_chain_writes(written, pipe.execute()))
+    key = chain_id(scrip_id, segment, expiry_date)
+    mark_refreshed(key, last_version(key))
+    if nine_thirty_data is not None:
+        mark_nine_thirty_stored(scrip_id, segment)
+    return time.perf_counter() - started
+
+def record_history(history):
+    # Disk history is best effort; never fail a refresh over it
+    if history is None:
+        return
+    try:
+        history_store.append_snapshot(*history)
+    except OSError as e:
+        logger.error(f"Could not append history for {history[0]} {history[2]}: {e}")
 
-            # Verify immediately: read-back and TTL
-            try:
-                stored = redis_client.get(cache_key_oc)
-                stored_len = len(stored) if stored else 0
-                ttl = redis_client.ttl(cache_key_oc)
-                logger.info(f"Redis VERIFY {cache_key_oc}: size={stored_len} ttl={ttl}")
-            except Exception as re:
-                logger.error(f"Redis verify error for {cache_key_oc}: {re}")
+def refresh_option_chain(dhan_client, redis_client, scrip_id, segment, rank=0):
+    """
+    One fetch-and-cache cycle for the rank-th upcoming expiry (0 = current).
+    Returns False when the caller should retry later.
+    """
+    expiries = tracked_expiries(get_expiry_list(dhan_client, redis_client, scrip_id, segment))
+    if not expiries:
+        logger.error(f"No expiry list for {scrip_id} {segment}, retrying")
+        return False
+    if rank >= len(expiries):
+        # fewer upcoming expiries listed than EXPIRY_DEPTH; nothing to fetch
+        return True
+    expiry_date = expiries[rank]
+    option_chain = dhan_client.fetch_option_chain(underlying_scrip=scrip_id,
+                                            underlying_seg=segment,
+                                            expiry=expiry_date)
+    # DO NOT return on non-success; retry after a short sleep
+    if option_chain.get('status') != 'success':
+        logger.error(f"Failed to fetch option chain for {scrip_id} in {segment}. Status: {option_chain.get('status')}. Retrying...")
+        return False
 
-            cached_data = redis_client.get(cache_key_nine_thirty_data)
-            if not cached_data and is_start_of_trading_day():
-                nine_thirty_data = calc_nine_thirty_data(chain_data, scrip_id, segment, redis_client)
-                redis_client.set(cache_key_nine_thirty_data, json.dumps(nine_thirty_data), ex=86340)
+    chain_call = dhan_client.last_call or {}
+    DHAN_FETCH_SECONDS.observe(chain_call.get('total_latency', 0), f"{scrip_id}_{segment}", rank)
+    write_time = cache_option_chain(redis_client, scrip_id, segment, expiry_date,
+                                    option_chain.get('data', {}), front_month=(rank == 0))
 
-            logger.info("fetched option chain for: %s", scrip_id)
-            time.sleep(3)  # To avoid hitting rate limits
+    logger.info("fetched option chain for: %s %s (fetch %.0f ms, attempts=%s, write %.1f ms)",
+                scrip_id, expiry_date, chain_call.get('total_latency', 0) * 1000,
+                chain_call.get('attempts'), write_time * 1000)
+    return True
 
+# Function to fetch and cache option chain data
+def fetch_and_cache_option_chain(dhan_client, redis_client, scrip_id, segment):
+    while True:
+        try:
+            ok = refresh_option_chain(dhan_client, redis_client, scrip_id, segment)
         except Exception as e:
             logger.error(f"Error in fetch_and_cache_option_chain for {scrip_id}: {e}")
-            time.sleep(5)
-            continue
+            ok = False
+        time.sleep(REFRESH_INTERVAL if ok else RETRY_INTERVAL)  # To avoid hitting rate limits
+
+def instrument_list(instruments):
+    """[(scrip_id, segment), ...] from the instruments DataFrame, skipping bad rows."""
+    result = []
+    for idx, row in instruments.iterrows():
+        try:
+            result.append((int(row['scrip_id']), row['segment']))
+        except Exception as ex:
+            logger.error(f"Skipping invalid instrument row {idx}: {ex}")
+    return result
+
+def chain_keys(items, depth=EXPIRY_DEPTH):
+    """Scheduler keys (scrip_id, segment, rank): one per upcoming expiry of each instrument."""
+    return [(scrip_id, segment, rank) for scrip_id, segment in items for rank in range(depth)]
+
+def build_scheduler(dhan_clients, keys):
+    """RefreshScheduler over every client's token, fed by their per-call statuses."""
+    scheduler = RefreshScheduler(len(dhan_clients))
+
+    def on_call(call, token):
+        scheduler.record_call(token, call['status'], budgeted=(
+            call['endpoint'] == '/optionchain' and call['attempts'] == 1))
+        DHAN_CALLS.inc(call['endpoint'], call['status'] or 'error')
+
+    for i, client in enumerate(dhan_clients):
+        client.on_call = lambda call, i=i: on_call(call, i)
+    # Spread the first round over one interval instead of bursting it
+    for i, key in enumerate(keys):
+        scheduler.add(key, delay=i * scheduler.min_interval / len(keys),
+                      interval=scheduler.min_interval * FAR_EXPIRY_SLOWDOWN ** key[2])
+    return scheduler
+
+def demand_chains(keys):
+    """[(key, (scrip_id, segment, expiry))] for the scheduler keys whose expiry this process knows."""
+    pairs = []
+    for scrip_id, segment, rank in keys:
+        expiries = memo_expiries(scrip_id, segment)
+        if rank < len(expiries):
+            pairs.append(((scrip_id, segment, rank), (scrip_id, segment, expiries[rank])))
+    return pairs
+
+def apply_demand(scheduler, pairs, counts):
+    """Feed the market session and viewer counts (see backend.viewers) into the scheduler."""
+    scheduler.set_market_open(is_market_open())
+    for (key, _), viewers in zip(pairs, counts):
+        scheduler.set_demand(key, viewers)
+
+def update_demand(redis_client, scheduler, keys):
+    pairs = demand_chains(keys)
+    counts = []
+    if pairs:
+        pipe = queue_viewer_counts(redis_client.pipeline(transaction=False), [chain for _, chain in pairs])
+        counts = viewer_counts(pipe.execute())
+    apply_demand(scheduler, pairs, counts)
 
 def background_task(redis_client, dhan_clients, instruments):
     """
     instruments: pandas.DataFrame with columns ['scrip_id','segment', ...]
-    dhan_clients: list of DhanClient instances (can be fewer than instruments; will be used round-robin)
+    dhan_clients: list of DhanClient instances, one per access token; the
+    scheduler picks whichever token has capacity for each refresh
     """
-    # instruments is a DataFrame; ensure we assign clients round-robin and keep threads alive
     if len(dhan_clients) == 0:
         logger.error("No Dhan clients available in background_task")
         return
+    items = instrument_list(instruments)
+    if not items:
+        logger.error("No instruments to refresh")
+        return
 
-    with ThreadPoolExecutor(max_workers=min(12, max(1, len(instruments)))) as executor:
-        for idx, row in instruments.iterrows():
-            try:
-                scrip_id = int(row['scrip_id'])
-                segment = row['segment']
-            except Exception as ex:
-                logger.error(f"Skipping invalid instrument row {idx}: {ex}")
+    keys = chain_keys(items)
+    scheduler = build_scheduler(dhan_clients, keys)
+    slots = threading.Semaphore(WORKER_THREADS)
+
+    def run(item, token):
+        ok = False
+        result = 'error'
+        try:
+            ok = refresh_option_chain(dhan_clients[token], redis_client, *item)
+            result = 'ok' if ok else 'failed'
+        except Exception as e:
+            logger.error(f"Error in fetch_and_cache_option_chain for {item[0]}: {e}")
+        finally:
+            CHAIN_REFRESHES.inc(f"{item[0]}_{item[1]}", result)
+            scheduler.complete(item, token, ok)
+            slots.release()
+
+    next_stats = time.monotonic() + STATS_INTERVAL
+    next_demand = time.monotonic()
+    with ThreadPoolExecutor(max_workers=WORKER_THREADS) as executor:
+        while True:
+            if time.monotonic() >= next_demand:
+                next_demand = time.monotonic() + DEMAND_INTERVAL
+                try:
+                    update_demand(redis_client, scheduler, keys)
+                except Exception as e:
+                    logger.error(f"Could not read viewer demand: {e}")
+            if time.monotonic() >= next_stats:
+                next_stats = time.monotonic() + STATS_INTERVAL
+                try:
+                    publish_refresh_stats(redis_client, scheduler)
+                    logger.info("Refresh rates/min: %s tokens: %s",
+                                scheduler.refresh_rates(), scheduler.token_stats())
+                except Exception as e:
+                    logger.error(f"Could not publish refresh stats: {e}")
+
+            item, token, wait = scheduler.next_dispatch()
+            if item is None:
+                time.sleep(min(wait, DISPATCH_POLL))
                 continue
-            dc = dhan_clients[idx % len(dhan_clients)]
-            executor.submit(fetch_and_cache_option_chain, dc, redis_client, scrip_id, segment)
+            slots.acquire()
+            executor.submit(run, item, token)
+
+@main_bp.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus text exposition, summed over every API process (see backend.metrics)."""
+    try:
+        body = render_api_metrics(current_app.redis_client)
+    except Exception as e:
+        logger.error(f"Could not render metrics: {e}")
+        return jsonify({'error': str(e)}), 500
+    return current_app.response_class(body, content_type=CONTENT_TYPE)
 
 @main_bp.route('/api/debug/redis_status', methods=['GET'])
 def debug_redis_status():
@@ -396,7 +871,7 @@ def debug_redis_status():
         if option_keys:
             sample_key = option_keys[0]
             try:
-                sample_val = r.get(sample_key)
+                sample_val = decode_chain(current_app.redis_binary_client.get(sample_key))
             except Exception as ex:
                 sample_val = f"error_reading:{ex}"
             sample[sample_key] = sample_val
@@ -405,6 +880,7 @@ def debug_redis_status():
             'option_chain_count': len(option_keys),
             'expiry_count': len(expiry_keys),
             'nine_thirty_count': len(nine_keys),
+            'refresh_rates_per_min': r.hgetall(REFRESH_STATS_KEY),
             'sample': sample
         })
     except Exception as e:
@@ -470,30 +946,20 @@ def signin():
         if not email or password is None:
             return jsonify({"error": "Email and password required"}), 400
 
-        r = current_app.redis_client
-        entries = r.lrange('users', 0, -1)
-
-        if not entries:
-            return jsonify({"error": "Invalid credentials"}), 400
-
-        # Find matching approved user
-        for entry in entries:
-            user = json.loads(entry)
-            if (user.get('email', '').lower() == email and
-                str(user.get('password')) == str(password)):  # handles number/string
-
-                if user.get('status') != 'approved':
-                    return jsonify({"error": "Account not approved"}), 403
-
-                # Success
-                return jsonify({
-                    "message": "Login successful",
-                    "user": {
-                        "email": user['email'],
-                        "status": user['status'],
-                        "expiryDate": user.get('expiryDate')
-                    }
-                }), 200
+        user = get_user(current_app.redis_client, email)
+        if user is not None and user.get('password') == str(password):  # handles number/string
+            if user.get('status') != 'approved':
+                return jsonify({"error": "Account not approved"}), 403
+
+            # Success
+            return jsonify({
+                "message": "Login successful",
+                "user": {
+                    "email": user['email'],
+                    "status": user['status'],
+                    "expiryDate": user.get('expiryDate')
+                }
+            }), 200
 
         return jsonify({"error": "Invalid credentials"}), 400
 
@@ -504,7 +970,7 @@ def signin():
 @main_bp.route('/api/signup', methods=['POST'])
 def signup():
     """
-    Accepts user signup data, stores to Redis pending list and notifies the approver via email.
+    Accepts user signup data, stores it as a pending account (backend.user_store) and notifies the approver via email.
     """
     try:
         data = request.get_json() or {}
@@ -517,15 +983,9 @@ def signup():
         if not email or not password:
             return jsonify({'error': 'email and password are required'}), 400
         
-        r = current_app.redis_client
-        # Check if email already exists
-        entries = r.lrange('pending_users', 0, -1) or []
-        if any(json.loads(e).get('email') == email for e in entries):
-            return jsonify({"error": "Email already registered"}), 400
-
         # build pending user object
         pending_user = {
-            'email': email,
+            'email': normalize_email(email),
             # 'phone': phone,
             # 'dob': dob,
             # 'state': state,
@@ -534,8 +994,9 @@ def signup():
             'status': 'pending'
         }
 
-        # push to Redis list 'pending_users'
-        r.rpush('pending_users', json.dumps(pending_user))
+        # fails if the email already has a pending or approved account
+        if not add_pending(current_app.redis_client, pending_user):
+            return jsonify({"error": "Email already registered"}), 400
 
         # send notification to approver (best-effort)
         _send_approval_email(pending_user)
@@ -567,10 +1028,7 @@ def admin_pending():
         if not _require_admin(data):
             return jsonify({'error': 'unauthorized'}), 401
 
-        r = current_app.redis_client
-        entries = r.lrange('pending_users', 0, -1) or []
-        parsed = [json.loads(e) for e in entries]
-        return jsonify({'pending': parsed})
+        return jsonify({'pending': users_with_status(current_app.redis_client, 'pending')})
     except Exception as e:
         logger.error("Error in /admin/pending: %s", e)
         return jsonify({'error': str(e)}), 500
@@ -595,38 +1053,11 @@ def admin_action():
         if not email or action not in ('approve', 'reject'):
             return jsonify({'error': 'invalid payload'}), 400
 
-        r = current_app.redis_client
-        # find pending entry and remove it
-        entries = r.lrange('pending_users', 0, -1) or []
-        matched = None
-        for e in entries:
-            try:
-                obj = json.loads(e)
-            except Exception:
-                continue
-            if obj.get('email') == email:
-                matched = obj
-                # remove this specific element
-                r.lrem('pending_users', 1, e)
-                break
-
-        if not matched:
+        status = 'approved' if action == 'approve' else 'rejected'
+        user = set_status(current_app.redis_client, email, status, expiry_date=expiry)
+        if user is None:
             return jsonify({'error': 'user not found in pending list'}), 404
-
-        if action == 'approve':
-            # mark approved and push to 'users' list
-            matched['status'] = 'approved'
-            if expiry:
-                matched['expiryDate'] = expiry
-            else:
-                matched['expiryDate'] = None
-            r.rpush('users', json.dumps(matched))
-            return jsonify({'message': 'user approved'}), 200
-
-        # reject
-        matched['status'] = 'rejected'
-        r.rpush('rejected_users', json.dumps(matched))
-        return jsonify({'message': 'user rejected'}), 200
+        return jsonify({'message': f"user {status}"}), 200
 
     except Exception as e:
         logger.error("Error in /admin/action: %s", e)
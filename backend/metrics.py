@@ -0,0 +1,328 @@
+"""
+Prometheus-style metrics for the API and the worker.
+
+A small in-process registry of counters, gauges and histograms rendered in
+the Prometheus text format (version 0.0.4), so nothing needs
+prometheus_client. What is measured:
+
+    dhan_calls_total{endpoint,status}            every Dhan HTTP attempt (status 429 = throttled,
+                                                 "error" = transport failure)
+    dhan_fetch_seconds{instrument,rank}          option chain fetch per instrument, retries included
+    chain_refreshes_total{instrument,result}     refresh cycles: ok / failed / error
+    chain_data_age_seconds{chain}                since the chain was last refreshed successfully (worker)
+    chain_snapshot_age_seconds{chain}            since the stored snapshot last changed (worker)
+    redis_command_seconds{command}               Redis round trips (a pipeline counts as one)
+    http_request_seconds{endpoint,method,status} API handler time
+    http_response_bytes{endpoint}                API response body size
+    levels_cache_total{tier}                     snapshot levels lookups: memory / redis / miss
+
+The worker serves its registry on METRICS_PORT (start_metrics_server). The
+API runs in several gunicorn processes: each stores a snapshot of its own
+registry in Redis every PUSH_INTERVAL seconds and GET /metrics renders the
+sum over the live processes, so any worker can answer a scrape. Counters of
+a process that exits disappear with it, which Prometheus treats as a reset.
+Gauges are read from the state of the process that renders them; the chain
+age gauges are only known to the worker, so /metrics leaves gauges out and
+data freshness is scraped from the worker.
+
+Scrape targets in the prod compose setup: the worker at worker:9101 and
+the API at app:8000/metrics on the compose network, or through nginx at
+/metrics, which only answers loopback and private (RFC 1918) addresses.
+
+Usage:
+    HTTP_REQUEST_SECONDS.observe(0.004, '/api/get_option_chain', 'POST', '200')
+    DHAN_CALLS.inc('/optionchain', '429')
+    text = REGISTRY.render()
+"""
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+METRICS_PORT = int(os.getenv('METRICS_PORT', 9101))
+PUSH_INTERVAL = 5
+API_PROCESSES_KEY = "metrics:api:processes"
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+FETCH_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30)
+REDIS_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def snapshot(self):
+        """{metric name: {label values (JSON list): state}} of counters and histograms."""
+        return {m.name: m.snapshot() for m in self.metrics if m.kind != 'gauge'}
+
+    def render(self, snapshots=None):
+        """
+        Text exposition; with `snapshots`, counters and histograms are their
+        sum instead and gauges (this process's own state) are left out.
+        """
+        lines = []
+        for metric in self.metrics:
+            if snapshots is not None and metric.kind == 'gauge':
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            if snapshots is not None:
+                lines.extend(metric.render(metric.merged(snapshots)))
+            else:
+                lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=(), registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def inc(self, *labels, amount=1):
+        labels = tuple(str(v) for v in labels)
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return {json.dumps(k): v for k, v in self._values.items()}
+
+    def merged(self, snapshots):
+        values = {}
+        for snapshot in snapshots:
+            for labels, value in snapshot.get(self.name, {}).items():
+                values[labels] = values.get(labels, 0) + value
+        return {tuple(json.loads(k)): v for k, v in values.items()}
+
+    def render(self, values=None):
+        if values is None:
+            with self._lock:
+                values = dict(self._values)
+        return [f"{self.name}{_format_labels(self.label_names, k)} {_format_value(v)}"
+                for k, v in sorted(values.items())]
+
+
+class Gauge:
+    """Value computed when rendered: fn() returns {label values: value}."""
+    kind = 'gauge'
+
+    def __init__(self, name, help, labels=(), fn=None, registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.fn = fn or dict
+        registry.register(self)
+
+    def render(self):
+        return [f"{self.name}{_format_labels(self.label_names, k)} {_format_value(v)}"
+                for k, v in sorted(self.fn().items())]
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS, registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.buckets = tuple(buckets)
+        # label values -> [count per bucket (last: +Inf), sum, count]
+        self._series = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def observe(self, value, *labels):
+        labels = tuple(str(v) for v in labels)
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def time(self, *labels):
+        return _Timer(self, labels)
+
+    def snapshot(self):
+        with self._lock:
+            return {json.dumps(k): [list(s[0]), s[1], s[2]] for k, s in self._series.items()}
+
+    def merged(self, snapshots):
+        series = {}
+        for snapshot in snapshots:
+            for labels, (counts, total, count) in snapshot.get(self.name, {}).items():
+                merged = series.setdefault(labels, [[0] * len(counts), 0.0, 0])
+                merged[0] = [a + b for a, b in zip(merged[0], counts)]
+                merged[1] += total
+                merged[2] += count
+        return {tuple(json.loads(k)): v for k, v in series.items()}
+
+    def render(self, series=None):
+        if series is None:
+            with self._lock:
+                series = {k: [list(s[0]), s[1], s[2]] for k, s in self._series.items()}
+        lines = []
+        for labels, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket in zip((*self.buckets, float('inf')), counts):
+                cumulative += bucket
+                le = _format_labels(self.label_names, labels, [('le', _format_value(bound))])
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, labels)} {count}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+        return False
+
+
+# chain id -> (time of the last successful refresh, version of the stored snapshot)
+_refreshed = {}
+_refreshed_lock = threading.Lock()
+
+
+def mark_refreshed(chain, version):
+    with _refreshed_lock:
+        _refreshed[chain] = (time.time(), version)
+
+
+def _ages(index):
+    now = time.time()
+    with _refreshed_lock:
+        items = list(_refreshed.items())
+    if index == 0:
+        return {(chain,): round(now - at, 3) for chain, (at, _) in items}
+    return {(chain,): round(now - version / 1000, 3) for chain, (_, version) in items if version}
+
+
+DHAN_CALLS = Counter('dhan_calls_total', 'Dhan API HTTP attempts by endpoint and status.',
+                     ('endpoint', 'status'))
+DHAN_FETCH_SECONDS = Histogram('dhan_fetch_seconds', 'Option chain fetch time per instrument, retries included.',
+                               ('instrument', 'rank'), buckets=FETCH_BUCKETS)
+CHAIN_REFRESHES = Counter('chain_refreshes_total', 'Chain refresh cycles by instrument and result.',
+                          ('instrument', 'result'))
+CHAIN_DATA_AGE = Gauge('chain_data_age_seconds', 'Seconds since the chain was last refreshed successfully.',
+                       ('chain',), fn=lambda: _ages(0))
+CHAIN_SNAPSHOT_AGE = Gauge('chain_snapshot_age_seconds', 'Seconds since the stored snapshot of the chain last changed.',
+                           ('chain',), fn=lambda: _ages(1))
+REDIS_COMMAND_SECONDS = Histogram('redis_command_seconds', 'Redis round trip time by command (pipelines count once).',
+                                  ('command',), buckets=REDIS_BUCKETS)
+HTTP_REQUEST_SECONDS = Histogram('http_request_seconds', 'API request handling time.',
+                                 ('endpoint', 'method', 'status'))
+HTTP_RESPONSE_BYTES = Histogram('http_response_bytes', 'API response body size in bytes.',
+                                ('endpoint',), buckets=SIZE_BUCKETS)
+LEVELS_CACHE = Counter('levels_cache_total', 'Snapshot levels lookups by the cache tier that answered.',
+                       ('tier',))
+
+
+def _process_key():
+    return f"metrics:api:{socket.gethostname()}:{os.getpid()}"
+
+
+def push_snapshot(redis_client):
+    """Store this process's counters and histograms for render_api_metrics()."""
+    key = _process_key()
+    now = time.time()
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.set(key, json.dumps(REGISTRY.snapshot()), ex=PUSH_INTERVAL * 3)
+    pipe.zadd(API_PROCESSES_KEY, {key: now})
+    pipe.zremrangebyscore(API_PROCESSES_KEY, 0, now - PUSH_INTERVAL * 3)
+    pipe.execute()
+
+
+def start_pusher(redis_client):
+    """Push this process's snapshot every PUSH_INTERVAL seconds from a daemon thread."""
+    def run():
+        while True:
+            time.sleep(PUSH_INTERVAL)
+            try:
+                push_snapshot(redis_client)
+            except Exception as e:
+                logger.warning(f"Could not push metrics: {e}")
+
+    thread = threading.Thread(target=run, name='metrics-pusher', daemon=True)
+    thread.start()
+    return thread
+
+
+def render_api_metrics(redis_client):
+    """Exposition of the summed registries of every live API process."""
+    push_snapshot(redis_client)
+    keys = redis_client.zrange(API_PROCESSES_KEY, 0, -1)
+    raw = redis_client.mget(keys) if keys else []
+    return REGISTRY.render([json.loads(value) for value in raw if value])
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = REGISTRY.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_metrics_server(port=METRICS_PORT):
+    """Serve this process's registry over HTTP from a daemon thread (port 0: disabled)."""
+    if not port:
+        return None
+    server = ThreadingHTTPServer(('0.0.0.0', port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    logger.info(f"Serving metrics on :{port}")
+    return server
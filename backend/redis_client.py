@@ -4,33 +4,68 @@ Centralized Redis client factory.
 Usage:
     from backend.redis_client import get_redis_client
     r = get_redis_client()
+
+    # bytes in / bytes out, for pre-rendered or compressed payloads
+    from backend.redis_client import get_redis_binary_client
+    rb = get_redis_binary_client()
+
+    # redis.asyncio client for the async worker (create inside the running loop)
+    from backend.redis_client import get_async_redis_client
+    ra = get_async_redis_client()
+
+The sync clients time every round trip into metrics.REDIS_COMMAND_SECONDS.
 """
 from dotenv import load_dotenv
 import os
 import redis
+from redis.client import Pipeline
 from typing import Optional
 
+from .metrics import REDIS_COMMAND_SECONDS
+
 load_dotenv()
 
 _client: Optional[redis.Redis] = None
+_binary_client: Optional[redis.Redis] = None
+
+class _TimedPipeline(Pipeline):
+    def execute(self, raise_on_error: bool = True):
+        if not self.command_stack:
+            # nothing queued: no round trip to time
+            return super().execute(raise_on_error)
+        with REDIS_COMMAND_SECONDS.time('MULTI' if self.transaction else 'PIPELINE'):
+            return super().execute(raise_on_error)
+
+class _TimedRedis(redis.Redis):
+    """redis.Redis recording the latency of each command and pipeline."""
+
+    def execute_command(self, *args, **options):
+        with REDIS_COMMAND_SECONDS.time(str(args[0]).upper()):
+            return super().execute_command(*args, **options)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return _TimedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+def _connection_settings() -> dict:
+    return {
+        "host": os.getenv("REDIS_HOST", "redis"),
+        "port": int(os.getenv("REDIS_PORT", 6379)),
+        "db": int(os.getenv("REDIS_DB", 0)),
+        "password": os.getenv("REDIS_PASSWORD") or None,
+    }
 
 def get_redis_client() -> redis.Redis:
     global _client
     if _client is not None:
         return _client
 
-    host = os.getenv("REDIS_HOST", "redis")
-    port = int(os.getenv("REDIS_PORT", 6379))
-    db = int(os.getenv("REDIS_DB", 0))
-    password = os.getenv("REDIS_PASSWORD") or None
+    settings = _connection_settings()
+    host, port, db = settings["host"], settings["port"], settings["db"]
     decode_flag = os.getenv("REDIS_DECODE", "true").lower() in ("1", "true", "yes")
 
-    _client = redis.Redis(
-        host=host,
-        port=port,
-        db=db,
-        password=password,
-        decode_responses=decode_flag
+    _client = _TimedRedis(
+        decode_responses=decode_flag,
+        **settings
     )
 
     try:
@@ -43,12 +78,36 @@ def get_redis_client() -> redis.Redis:
 
     return _client
 
+def get_redis_binary_client() -> redis.Redis:
+    """
+    Same server as get_redis_client() but never decodes responses, so values
+    such as gzipped bodies come back as raw bytes.
+    """
+    global _binary_client
+    if _binary_client is not None:
+        return _binary_client
+
+    _binary_client = _TimedRedis(decode_responses=False, **_connection_settings())
+    return _binary_client
+
+def get_async_redis_client():
+    """
+    redis.asyncio client with the same settings as get_redis_client(). Not
+    cached: the connection pool is bound to the event loop that first uses it.
+    """
+    import redis.asyncio as aioredis
+
+    decode_flag = os.getenv("REDIS_DECODE", "true").lower() in ("1", "true", "yes")
+    return aioredis.Redis(decode_responses=decode_flag, **_connection_settings())
+
 def close_redis_client() -> None:
-    global _client
-    if _client is None:
-        return
-    try:
-        _client.connection_pool.disconnect()
-    except Exception:
-        pass
+    global _client, _binary_client
+    for client in (_client, _binary_client):
+        if client is None:
+            continue
+        try:
+            client.connection_pool.disconnect()
+        except Exception:
+            pass
     _client = None
+    _binary_client = None
@@ -0,0 +1,270 @@
+"""
+Rate-limit-aware refresh scheduling for Dhan API calls.
+
+Every access token gets a TokenBucket sized to Dhan's published limits. The
+RefreshScheduler hands out (instrument, token) pairs: the most overdue
+instrument whose underlying was not fetched in the last UNDERLYING_SPACING
+seconds goes to whichever token currently has the most capacity, so a
+slow or throttled token sheds load onto the others instead of holding its
+instruments back. A 429 halves that token's rate and every successful call
+grows it back towards the configured rate (AIMD).
+
+Refresh intervals follow demand (set_demand, viewer counts from
+backend.viewers): a key somebody is watching runs at its own interval (far
+expiries get longer ones, see FAR_EXPIRY_SLOWDOWN) divided by its viewer
+count, never below MIN_REFRESH_INTERVAL; the current expiry is therefore
+refreshed as fast as Dhan allows, and the token buckets decide how many of
+those fit. Keys nobody watches drop to COLD_REFRESH_INTERVAL, and everything
+to AFTER_HOURS_REFRESH_INTERVAL while the market is closed
+(set_market_open). A key that gets hotter is pulled forward at once.
+
+The scheduler does no I/O and is guarded by a lock, so the threaded and the
+asyncio worker drive the same object.
+
+Usage:
+    scheduler = RefreshScheduler(token_count=len(clients))
+    scheduler.add((13, 'IDX_I'))
+    key, token, wait = scheduler.next_dispatch()
+    ... refresh key with clients[token] ...
+    scheduler.complete(key, token, ok=True)
+"""
+import collections
+import heapq
+import itertools
+import os
+import threading
+import time
+
+# Dhan Data API limit per access token, and the option chain rule of one
+# request per underlying every 3 seconds (UNDERLYING_SPACING, whatever the
+# expiry: the ranks of one underlying are never fetched back to back).
+DHAN_RATE_PER_SEC = float(os.getenv('DHAN_RATE_PER_SEC', 5))
+DHAN_BURST = float(os.getenv('DHAN_BURST', 5))
+MIN_REFRESH_INTERVAL = float(os.getenv('MIN_REFRESH_INTERVAL', 3))
+UNDERLYING_SPACING = float(os.getenv('UNDERLYING_SPACING', 3))
+RETRY_INTERVAL = 5
+# Idle interval multiplier per step away from the current expiry
+FAR_EXPIRY_SLOWDOWN = float(os.getenv('FAR_EXPIRY_SLOWDOWN', 4))
+# Background refresh of chains without viewers, and of everything after hours;
+# keep both below the snapshot TTL (300s) so cached chains never lapse
+COLD_REFRESH_INTERVAL = float(os.getenv('COLD_REFRESH_INTERVAL', 30))
+AFTER_HOURS_REFRESH_INTERVAL = float(os.getenv('AFTER_HOURS_REFRESH_INTERVAL', 120))
+# Tokens reserved per refresh (the option chain call). Expiry-list refetches
+# and retries are charged when they happen, see record_call().
+REFRESH_COST = 1
+
+# AIMD tuning: a throttled token never drops below this fraction of its rate
+MIN_RATE_FRACTION = 0.1
+RECOVERY_STEP = 0.05
+# Window over which achieved refresh rates are reported
+RATE_WINDOW = 60
+
+REFRESH_STATS_KEY = "worker:refresh_rates"
+
+
+def _underlying(key):
+    # chain keys are (scrip_id, segment, expiry rank)
+    return key[:2] if isinstance(key, tuple) else key
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.base_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.clock = clock
+        self.updated = clock()
+        self.throttled = 0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def available(self, now):
+        self._refill(now)
+        return self.tokens
+
+    def try_acquire(self, cost, now):
+        self._refill(now)
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return True
+        return False
+
+    def wait_time(self, cost, now):
+        self._refill(now)
+        return max(0.0, (cost - self.tokens) / self.rate)
+
+    def on_throttled(self, now):
+        self._refill(now)
+        self.rate = max(self.base_rate * MIN_RATE_FRACTION, self.rate / 2)
+        self.tokens = 0
+        self.throttled += 1
+
+    def debit(self, cost):
+        # may go negative; wait_time() then covers the overdraft
+        self.tokens -= cost
+
+    def on_success(self):
+        self.rate = min(self.base_rate, self.rate + self.base_rate * RECOVERY_STEP)
+
+
+class RefreshScheduler:
+    def __init__(self, token_count, rate=DHAN_RATE_PER_SEC, burst=DHAN_BURST,
+                 min_interval=MIN_REFRESH_INTERVAL, retry_interval=RETRY_INTERVAL,
+                 cold_interval=COLD_REFRESH_INTERVAL, after_hours_interval=AFTER_HOURS_REFRESH_INTERVAL,
+                 cost=REFRESH_COST, spacing=UNDERLYING_SPACING, clock=time.monotonic):
+        if token_count < 1:
+            raise ValueError("RefreshScheduler needs at least one access token")
+        self.buckets = [TokenBucket(rate, max(burst, cost), clock) for _ in range(token_count)]
+        self.min_interval = min_interval
+        self.retry_interval = retry_interval
+        self.cold_interval = cold_interval
+        self.after_hours_interval = after_hours_interval
+        self.market_open = True
+        self.cost = cost
+        self.spacing = spacing
+        self.clock = clock
+        self._heap = []
+        self._seq = itertools.count()
+        self._started = {}
+        # underlying (scrip, segment) -> start of its last refresh, any expiry
+        self._underlying_started = {}
+        self._intervals = {}
+        self._demand = {}
+        self._completions = collections.defaultdict(collections.deque)
+        self._lock = threading.Lock()
+
+    def add(self, key, delay=0.0, interval=None):
+        """Schedule `key`; interval is its idle refresh interval (default min_interval)."""
+        with self._lock:
+            if interval is not None:
+                self._intervals[key] = max(self.min_interval, interval)
+            heapq.heappush(self._heap, (self.clock() + delay, next(self._seq), key))
+
+    def set_demand(self, key, viewers):
+        """Number of clients currently viewing `key`."""
+        with self._lock:
+            before = self.interval_for(key)
+            self._demand[key] = max(0, viewers)
+            if self.interval_for(key) < before:
+                self._pull_forward({key})
+
+    def set_market_open(self, market_open):
+        with self._lock:
+            reopened = market_open and not self.market_open
+            self.market_open = market_open
+            if reopened:
+                self._pull_forward()
+
+    def interval_for(self, key):
+        """Seconds between refresh starts for `key` while it is healthy."""
+        interval = self._intervals.get(key, self.min_interval)
+        viewers = self._demand.get(key, 0)
+        if not self.market_open:
+            return max(interval, self.after_hours_interval)
+        if not viewers:
+            return max(interval, self.cold_interval)
+        return max(self.min_interval, interval / viewers)
+
+    def _pull_forward(self, keys=None):
+        # Move queued keys (all, or `keys`) up to their current interval
+        changed = False
+        for i, (due, seq, key) in enumerate(self._heap):
+            if keys is not None and key not in keys:
+                continue
+            started = self._started.get(key)
+            if started is not None and started + self.interval_for(key) < due:
+                self._heap[i] = (started + self.interval_for(key), seq, key)
+                changed = True
+        if changed:
+            heapq.heapify(self._heap)
+
+    def next_dispatch(self):
+        """
+        (key, token_index, 0) when a refresh should start now, otherwise
+        (None, None, seconds until something may become dispatchable).
+        """
+        with self._lock:
+            now = self.clock()
+            if not self._heap:
+                return None, None, self.min_interval
+            due = self._heap[0][0]
+            if due > now:
+                return None, None, due - now
+            # most overdue key whose underlying is free; others wait their spacing
+            entry, free_at, next_due = None, float('inf'), float('inf')
+            for candidate in self._heap:
+                if candidate[0] > now:
+                    next_due = min(next_due, candidate[0])
+                    continue
+                ready = self._underlying_started.get(_underlying(candidate[2]), float('-inf')) + self.spacing
+                if ready > now:
+                    free_at = min(free_at, ready)
+                elif entry is None or candidate[:2] < entry[:2]:
+                    entry = candidate
+            if entry is None:
+                return None, None, min(free_at, next_due) - now
+            token = max(range(len(self.buckets)), key=lambda i: self.buckets[i].available(now))
+            if not self.buckets[token].try_acquire(self.cost, now):
+                return None, None, min(b.wait_time(self.cost, now) for b in self.buckets)
+            self._heap.remove(entry)
+            heapq.heapify(self._heap)
+            key = entry[2]
+            self._started[key] = now
+            self._underlying_started[_underlying(key)] = now
+            return key, token, 0
+
+    def complete(self, key, token_index, ok):
+        """Reschedule `key` after a refresh on token `token_index` finished."""
+        with self._lock:
+            now = self.clock()
+            if ok:
+                done = self._completions[key]
+                done.append(now)
+                while done and done[0] < now - RATE_WINDOW:
+                    done.popleft()
+                # Interval counts from the previous start, not from completion
+                due = max(now, self._started.get(key, now) + self.interval_for(key))
+            else:
+                due = now + self.retry_interval
+            heapq.heappush(self._heap, (due, next(self._seq), key))
+
+    def record_call(self, token_index, status, budgeted=True):
+        """
+        Feed every HTTP attempt's status back into that token's bucket. Calls
+        not reserved by next_dispatch() (budgeted=False) are charged here.
+        """
+        with self._lock:
+            bucket = self.buckets[token_index]
+            if not budgeted:
+                bucket.debit(1)
+            if status == 429:
+                bucket.on_throttled(self.clock())
+            elif status == 200:
+                bucket.on_success()
+
+    def refresh_rates(self):
+        """{key: successful refreshes per minute over the last RATE_WINDOW seconds}"""
+        with self._lock:
+            cutoff = self.clock() - RATE_WINDOW
+            return {key: sum(1 for t in done if t >= cutoff) * 60 / RATE_WINDOW
+                    for key, done in self._completions.items()}
+
+    def token_stats(self):
+        with self._lock:
+            return [{'rate': round(b.rate, 3), 'throttled': b.throttled} for b in self.buckets]
+
+
+def publish_refresh_stats(redis_client, scheduler):
+    """
+    Store achieved refresh rates (per minute) in REFRESH_STATS_KEY, one field
+    per key with its parts joined by '_'. Returns the client call, so it can
+    be awaited with a redis.asyncio client.
+    """
+    rates = {"_".join(str(part) for part in key): f"{rate:.2f}"
+             for key, rate in scheduler.refresh_rates().items()}
+    for i, stats in enumerate(scheduler.token_stats()):
+        rates[f"token:{i}"] = f"rate={stats['rate']} throttled={stats['throttled']}"
+    return redis_client.hset(REFRESH_STATS_KEY, mapping=rates)
@@ -0,0 +1,118 @@
+"""
+Support/resistance levels at any recorded snapshot of a chain.
+
+The worker stores levels only for the 09:30 snapshot (nine_thirty_data).
+This computes the same levels from the intraday history (history_store) for
+any snapshot: 09:20, 10:00, the previous day's close. A request time
+resolves to the snapshot in effect at that time, and since a recorded
+snapshot never changes its levels are cached by (chain, snapshot version):
+
+    per process   LRU of LEVELS_CACHE_SIZE results (cachetools)
+    Redis         levels:v2:<scrip>_<seg>_<expiry>:<version>, LEVELS_CACHE_TTL
+                  seconds (0 disables), shared by every API process
+
+Time to expiry is taken at the snapshot time, so a result is the same
+whenever it is asked for. Strike keys are chain_engine.strike_key(), as in
+the worker's nine_thirty_data.
+
+Usage:
+    result = levels_at(redis_client, scrip_id, segment, expiry, day, at_ms)
+    # {'expiry', 'date', 'ts', 's', 't', 'strikes': {strike: {'p', 'c'}},
+    #  'strikeLevels': {strike: {'support', 'resistance'}}} or None
+"""
+import json
+import logging
+import os
+import threading
+from datetime import datetime, timezone
+
+from cachetools import LRUCache
+
+from . import history_store
+from .chain_engine import strike_key
+from .chain_store import chain_id
+from .levels import format_levels, reversal_levels, support_resistance, time_to_expiry
+from .metrics import LEVELS_CACHE
+
+logger = logging.getLogger(__name__)
+
+LEVELS_CACHE_SIZE = int(os.getenv('LEVELS_CACHE_SIZE', 256))
+LEVELS_CACHE_TTL = int(os.getenv('LEVELS_CACHE_TTL', 24 * 3600))
+
+_cache = LRUCache(maxsize=LEVELS_CACHE_SIZE)
+_cache_lock = threading.Lock()
+
+
+def levels_key(scrip_id, segment, expiry, version):
+    return f"levels:v2:{chain_id(scrip_id, segment, expiry)}:{version}"
+
+
+def compute_levels(scrip_id, segment, expiry, day, version, spot):
+    """Levels of snapshot `version` (epoch ms) from its recorded strikes."""
+    records = history_store.strikes_at(scrip_id, segment, expiry, day, version)
+    strikes = [strike_key(strike) for strike in records['strike'].tolist()]
+    puts, calls = history_store.column(records, 'put_ltp'), history_store.column(records, 'call_ltp')
+    t = time_to_expiry(expiry, datetime.fromtimestamp(version / 1000, timezone.utc))
+    result = {
+        'expiry': expiry,
+        'date': day.isoformat(),
+        'ts': version,
+        's': spot,
+        't': t,
+        'strikes': {strike: {'p': p, 'c': c} for strike, p, c in
+                    zip(strikes, puts.tolist(), calls.tolist())},
+        'strikeLevels': {},
+    }
+    if strikes:
+        levels = reversal_levels(spot, records['strike'], puts, calls, t)
+        result['strikeLevels'] = format_levels(strikes, *support_resistance(levels))
+    return result
+
+
+def _cached(key):
+    with _cache_lock:
+        return _cache.get(key)
+
+
+def _remember(key, result):
+    with _cache_lock:
+        _cache[key] = result
+
+
+def levels_at(redis_client, scrip_id, segment, expiry, day, at=None):
+    """
+    Levels of the snapshot in effect at `at` (epoch ms; None: the day's last
+    snapshot) on trading day `day`, or None if nothing was recorded by then.
+    """
+    totals = history_store.totals_at(scrip_id, segment, expiry, day, at)
+    if totals is None:
+        return None
+    version = int(totals['ts'])
+    key = levels_key(scrip_id, segment, expiry, version)
+
+    result = _cached(key)
+    if result is not None:
+        LEVELS_CACHE.inc('memory')
+        return result
+
+    if LEVELS_CACHE_TTL:
+        try:
+            raw = redis_client.get(key)
+        except Exception as e:
+            logger.warning(f"Could not read cached levels {key}: {e}")
+            raw = None
+        if raw is not None:
+            result = json.loads(raw)
+            _remember(key, result)
+            LEVELS_CACHE.inc('redis')
+            return result
+
+    LEVELS_CACHE.inc('miss')
+    result = compute_levels(scrip_id, segment, expiry, day, version, float(totals['underlying_price']))
+    _remember(key, result)
+    if LEVELS_CACHE_TTL:
+        try:
+            redis_client.set(key, json.dumps(result), ex=LEVELS_CACHE_TTL)
+        except Exception as e:
+            logger.warning(f"Could not cache levels {key}: {e}")
+    return result
@@ -0,0 +1,175 @@
+"""
+User accounts indexed by email.
+
+Every account is one hash, `user:<email>`, keyed by the normalized
+(stripped, lower-cased) email, with the account fields as strings (an
+empty string for a missing expiryDate). Its status is also kept as
+membership of exactly one of the sets `users:pending`, `users:approved`
+and `users:rejected`. Sign-in, the signup duplicate check and approvals
+are O(1) lookups instead of scans of JSON lists. Status changes use
+SMOVE, which only succeeds while the account is still in the source set,
+so two admins acting on one signup cannot both win.
+
+migrate_lists() copies the accounts of the former `users`,
+`pending_users` and `rejected_users` lists once, marked by
+`users:migrated`, and leaves the lists untouched. An email found in
+several lists keeps the entry of the most advanced list (users >
+pending_users > rejected_users). create_app() runs it on startup; it can also be run by hand:
+
+    python -m backend.user_store
+
+Usage:
+    user = get_user(redis_client, email)
+    created = add_pending(redis_client, {'email': ..., 'password': ..., 'createdAt': ...})
+    user = set_status(redis_client, email, 'approved', expiry_date='2026-12-31')
+"""
+import json
+import logging
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+STATUSES = ('pending', 'approved', 'rejected')
+MIGRATED_KEY = "users:migrated"
+# former lists, lowest precedence first: later lists win for the same email
+LEGACY_LISTS = (('rejected_users', 'rejected'), ('pending_users', 'pending'), ('users', 'approved'))
+# add_pending() transactions tried before giving up on a contended account
+SIGNUP_ATTEMPTS = 5
+
+
+def normalize_email(email):
+    return (email or '').strip().lower()
+
+
+def user_key(email):
+    return f"user:{normalize_email(email)}"
+
+
+def status_key(status):
+    return f"users:{status}"
+
+
+def _decode(value):
+    # works with clients that do not decode responses too
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+def _to_hash(user):
+    return {field: '' if value is None else str(value) for field, value in user.items()}
+
+
+def _from_hash(fields):
+    if not fields:
+        return None
+    user = dict(fields)
+    if 'expiryDate' in user:
+        user['expiryDate'] = user['expiryDate'] or None
+    return user
+
+
+def get_user(redis_client, email):
+    """The account of `email` as a dict of strings, or None."""
+    return _from_hash(redis_client.hgetall(user_key(email)))
+
+
+def add_pending(redis_client, user):
+    """
+    Store a new pending signup. False if the email already has a pending or
+    approved account; a rejected account may sign up again. Raises
+    redis.WatchError if the account changed under every one of
+    SIGNUP_ATTEMPTS tries.
+    """
+    email = normalize_email(user.get('email'))
+    key = user_key(email)
+    with redis_client.pipeline() as pipe:
+        for _ in range(SIGNUP_ATTEMPTS):
+            # WATCH makes the check and the write one step: if another signup
+            # (or an admin action) touches the account in between, EXEC fails
+            # and the check runs again on what it wrote
+            try:
+                pipe.watch(key)
+                if _decode(pipe.hget(key, 'status')) in ('pending', 'approved'):
+                    return False
+                pipe.multi()
+                pipe.delete(key)
+                pipe.hset(key, mapping=_to_hash({**user, 'email': email, 'status': 'pending'}))
+                for status in STATUSES:
+                    pipe.srem(status_key(status), email)
+                pipe.sadd(status_key('pending'), email)
+                pipe.execute()
+                return True
+            except redis.WatchError:
+                continue
+    raise redis.WatchError(f"Account {email} kept changing during signup")
+
+
+def set_status(redis_client, email, status, expiry_date=None, from_status='pending'):
+    """
+    Move an account from `from_status` to `status` (approved accounts get
+    expiryDate). Returns the updated account, or None if the email was not
+    in `from_status`.
+    """
+    email = normalize_email(email)
+    if not redis_client.smove(status_key(from_status), status_key(status), email):
+        return None
+    fields = {'status': status}
+    if status == 'approved':
+        fields['expiryDate'] = expiry_date or ''
+    pipe = redis_client.pipeline()
+    pipe.hset(user_key(email), mapping=fields)
+    pipe.hgetall(user_key(email))
+    return _from_hash(pipe.execute()[-1])
+
+
+def users_with_status(redis_client, status):
+    """Accounts in one status, oldest signup first."""
+    emails = redis_client.smembers(status_key(status))
+    if not emails:
+        return []
+    pipe = redis_client.pipeline(transaction=False)
+    for email in emails:
+        pipe.hgetall(user_key(email))
+    users = [_from_hash(fields) for fields in pipe.execute() if fields]
+    return sorted(users, key=lambda user: user.get('createdAt') or '')
+
+
+def migrate_lists(redis_client):
+    """
+    Copy the accounts of the former Redis lists into the indexed store,
+    once. Returns the number of accounts written (0 if already migrated).
+    """
+    # the marker expires if a migration dies half way, so a later start retries
+    if not redis_client.set(MIGRATED_KEY, 'running', nx=True, ex=300):
+        return 0
+    accounts = {}
+    for list_key, status in LEGACY_LISTS:
+        for entry in redis_client.lrange(list_key, 0, -1) or []:
+            try:
+                user = json.loads(entry)
+            except ValueError:
+                logger.warning(f"Skipping unreadable entry in {list_key}")
+                continue
+            email = normalize_email(user.get('email'))
+            if email:
+                # an entry's own status wins over the list it was found in
+                accounts[email] = {**user, 'email': email,
+                                   'status': user.get('status') if user.get('status') in STATUSES else status}
+
+    pipe = redis_client.pipeline()
+    for email, user in accounts.items():
+        pipe.delete(user_key(email))
+        pipe.hset(user_key(email), mapping=_to_hash(user))
+        for status in STATUSES:
+            pipe.srem(status_key(status), email)
+        pipe.sadd(status_key(user['status']), email)
+    pipe.set(MIGRATED_KEY, 'done')
+    pipe.execute()
+    logger.info(f"Migrated {len(accounts)} user accounts from the legacy lists")
+    return len(accounts)
+
+
+if __name__ == '__main__':
+    from .redis_client import get_redis_client
+    logging.basicConfig(level=logging.INFO)
+    print(f"Migrated {migrate_lists(get_redis_client())} accounts")
@@ -0,0 +1,78 @@
+"""
+Active-viewer heartbeats, the worker's demand signal.
+
+The chain endpoints (/api/get_option_chain polls and /api/stream/option_chain
+streams) record who is looking at which (underlying, expiry): one sorted set
+per chain, `viewers:<scrip>_<seg>_<expiry>`, member = viewer id, score = last
+heartbeat. A viewer counts as active for VIEWER_TTL seconds after its last
+heartbeat. Each API process writes a given viewer's heartbeat at most every
+HEARTBEAT_INTERVAL seconds, so 1 Hz polling does not turn into 1 Hz writes.
+
+The worker reads the counts for every chain it schedules in one pipeline and
+feeds them to RefreshScheduler.set_demand().
+
+Usage:
+    record_viewer(redis_client, scrip_id, segment, expiry, viewer_id(request))
+    pipe = queue_viewer_counts(redis_client.pipeline(), chains)
+    counts = viewer_counts(pipe.execute())
+"""
+import hashlib
+import threading
+import time
+
+from .chain_store import chain_id
+
+VIEWER_TTL = 20
+HEARTBEAT_INTERVAL = 5
+# Bound on remembered (chain, viewer) heartbeats per process
+_MAX_BEATS = 10000
+
+_last_beat = {}
+_beat_lock = threading.Lock()
+
+def viewers_key(scrip_id, segment, expiry):
+    return f"viewers:{chain_id(scrip_id, segment, expiry)}"
+
+def viewer_id(req):
+    """Stable id for one browser: client address (behind nginx) + user agent."""
+    raw = f"{req.access_route[0] if req.access_route else req.remote_addr}|{req.user_agent.string}"
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:16]
+
+def _due(key, viewer, now):
+    with _beat_lock:
+        last = _last_beat.get((key, viewer))
+        if last is not None and now - last < HEARTBEAT_INTERVAL:
+            return False
+        if len(_last_beat) >= _MAX_BEATS:
+            for stale in [k for k, t in _last_beat.items() if now - t >= VIEWER_TTL]:
+                del _last_beat[stale]
+        _last_beat[(key, viewer)] = now
+        return True
+
+def record_viewer(redis_client, scrip_id, segment, expiry, viewer):
+    """Heartbeat `viewer` on this chain (no-op if this process did so recently)."""
+    key = viewers_key(scrip_id, segment, expiry)
+    now = time.time()
+    if not _due(key, viewer, now):
+        return
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.zadd(key, {viewer: now})
+    pipe.expire(key, VIEWER_TTL)
+    pipe.execute()
+
+def queue_viewer_counts(pipe, chains, now=None):
+    """
+    Queue the active-viewer count of every (scrip_id, segment, expiry) in
+    `chains`, dropping expired heartbeats on the way. Works on sync and
+    redis.asyncio pipelines; read the results with viewer_counts().
+    """
+    cutoff = (now or time.time()) - VIEWER_TTL
+    for scrip_id, segment, expiry in chains:
+        key = viewers_key(scrip_id, segment, expiry)
+        pipe.zremrangebyscore(key, 0, cutoff)
+        pipe.zcard(key)
+    return pipe
+
+def viewer_counts(results):
+    """Counts from an executed queue_viewer_counts() pipeline, in `chains` order."""
+    return [int(count) for count in results[1::2]]
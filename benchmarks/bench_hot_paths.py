@@ -0,0 +1,214 @@
+"""
+Benchmarks for the chain-processing and levels hot paths.
+
+Runs every case on synthetic 50/200/1000-strike chains (benchmarks.fixtures)
+against an in-process fake Redis and reports, per case:
+
+    p50/p90/p99/mean   per-call latency, microseconds
+    peak_kb            peak traced allocation of one call (tracemalloc)
+    rps                calls per second over the measured run (for the API
+                       cases: requests/s through the Flask test client)
+
+Cases: process_option_chain, chain_greeks (IV solve and Greeks, both
+sides), calc_nine_thirty_data, calculate_nine_thirty_strike_levels, and
+/api/get_option_chain for the full chain, a 10-strike window and an
+If-None-Match revalidation (304).
+
+--save writes the results as a baseline; --compare checks a run against one
+and exits 1 when p50 or peak_kb grew, or rps dropped, by more than the
+tolerance. Baselines are machine specific; compare runs from the same host.
+
+Usage (from the repository root, with benchmarks/requirements.txt installed):
+    python -m benchmarks.bench_hot_paths --save benchmarks/baseline.json
+    python -m benchmarks.bench_hot_paths --compare benchmarks/baseline.json
+"""
+import argparse
+import gc
+import json
+import logging
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from benchmarks.fixtures import STRIKE_COUNTS, install_fake_redis, make_chain, seed_chain
+
+SCRIP_ID = 13
+SEGMENT = 'IDX_I'
+WARMUP_CALLS = 5
+DEFAULT_MIN_TIME = 1.0
+DEFAULT_MAX_CALLS = 2000
+# Each case is measured this many times and the round with the lowest p50
+# kept, which filters out most of the noise from other load on the host
+DEFAULT_ROUNDS = 3
+DEFAULT_TOLERANCE = 0.25
+DEFAULT_MEMORY_TOLERANCE = 0.10
+
+
+def measure(fn, min_time=DEFAULT_MIN_TIME, max_calls=DEFAULT_MAX_CALLS):
+    """Latency percentiles, peak allocation and throughput of calling fn()."""
+    for _ in range(WARMUP_CALLS):
+        fn()
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    samples = []
+    started = time.perf_counter()
+    while len(samples) < max_calls and (time.perf_counter() - started < min_time or len(samples) < 10):
+        t0 = time.perf_counter_ns()
+        fn()
+        samples.append(time.perf_counter_ns() - t0)
+    elapsed = time.perf_counter() - started
+
+    micros = np.array(samples, dtype=float) / 1000
+    p50, p90, p99 = np.percentile(micros, [50, 90, 99])
+    return {
+        'calls': len(samples),
+        'p50_us': round(float(p50), 1),
+        'p90_us': round(float(p90), 1),
+        'p99_us': round(float(p99), 1),
+        'mean_us': round(float(micros.mean()), 1),
+        'peak_kb': round(peak / 1024, 1),
+        'rps': round(len(samples) / elapsed, 1),
+    }
+
+
+def build_cases(strike_counts):
+    """{case name: zero-argument callable}, with every chain seeded in the fake Redis."""
+    text, _ = install_fake_redis()
+    from backend import create_app
+    from backend.chain_engine import ChainColumns
+    from backend.config import ProductionConfig
+    from backend.greeks import chain_greeks
+    from backend.main import (calc_nine_thirty_data, calculate_nine_thirty_strike_levels,
+                              process_option_chain)
+
+    # production settings: compact JSON, no debug hooks
+    app = create_app(ProductionConfig)
+    client = app.test_client()
+    cases = {}
+    for count in strike_counts:
+        # one instrument per size, so every size has its own snapshot
+        scrip_id = f"{SCRIP_ID}{count}"
+        chain = make_chain(count, seed=count)
+        expiry = seed_chain(text, scrip_id, SEGMENT, chain)
+        nine_thirty = {'s': chain['last_price'],
+                       'strikes': {k: {'p': v['pe']['last_price'], 'c': v['ce']['last_price']}
+                                   for k, v in chain['oc'].items()}}
+
+        def run_process(chain=chain):
+            with app.app_context():
+                process_option_chain(chain)
+
+        columns = ChainColumns.from_chain(chain)
+        version = int(time.time() * 1000)
+
+        body = {'underlying_scrip': scrip_id, 'underlying_seg': SEGMENT}
+        etag = client.post('/api/get_option_chain', json=body).headers.get('ETag')
+
+        def api(extra=None, headers=None, expected=200, body=body):
+            def call():
+                response = client.post('/api/get_option_chain', json={**body, **(extra or {})}, headers=headers)
+                if response.status_code != expected:
+                    raise RuntimeError(f"/api/get_option_chain returned {response.status_code}")
+                response.close()
+            return call
+
+        cases[f"process_option_chain[{count}]"] = run_process
+        cases[f"chain_greeks[{count}]"] = (
+            lambda columns=columns, expiry=expiry, version=version: chain_greeks(columns, expiry, version))
+        cases[f"calc_nine_thirty_data[{count}]"] = (
+            lambda chain=chain, scrip_id=scrip_id: calc_nine_thirty_data(chain, scrip_id, SEGMENT, text))
+        cases[f"calculate_nine_thirty_strike_levels[{count}]"] = (
+            lambda data=nine_thirty, scrip_id=scrip_id: calculate_nine_thirty_strike_levels(data, scrip_id, SEGMENT, text))
+        cases[f"api_get_option_chain[{count}]"] = api()
+        cases[f"api_get_option_chain_window10[{count}]"] = api({'window': 10})
+        cases[f"api_get_option_chain_304[{count}]"] = api(headers={'If-None-Match': etag}, expected=304)
+    return cases
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE, memory_tolerance=DEFAULT_MEMORY_TOLERANCE):
+    """Regression messages for `results` against `baseline` results (empty when none)."""
+    regressions = []
+    for name, base in baseline.items():
+        current = results.get(name)
+        if current is None:
+            continue
+        if current['p50_us'] > base['p50_us'] * (1 + tolerance):
+            regressions.append(f"{name}: p50 {base['p50_us']} -> {current['p50_us']} us")
+        if current['peak_kb'] > base['peak_kb'] * (1 + memory_tolerance) + 1:
+            regressions.append(f"{name}: peak {base['peak_kb']} -> {current['peak_kb']} KB")
+        if current['rps'] < base['rps'] * (1 - tolerance):
+            regressions.append(f"{name}: rps {base['rps']} -> {current['rps']}")
+    return regressions
+
+
+def print_table(results, baseline=None):
+    header = f"{'case':48} {'p50 us':>10} {'p90 us':>10} {'p99 us':>10} {'peak KB':>9} {'rps':>10}"
+    print(header)
+    print('-' * len(header))
+    for name, r in results.items():
+        line = f"{name:48} {r['p50_us']:>10} {r['p90_us']:>10} {r['p99_us']:>10} {r['peak_kb']:>9} {r['rps']:>10}"
+        if baseline and name in baseline:
+            line += f"   ({(r['p50_us'] / baseline[name]['p50_us'] - 1) * 100:+.0f}% p50)"
+        print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--strikes', type=int, nargs='+', default=list(STRIKE_COUNTS))
+    parser.add_argument('--only', help='run the cases whose name contains this text')
+    parser.add_argument('--min-time', type=float, default=DEFAULT_MIN_TIME, help='seconds per case')
+    parser.add_argument('--max-calls', type=int, default=DEFAULT_MAX_CALLS)
+    parser.add_argument('--rounds', type=int, default=DEFAULT_ROUNDS, help='measurements per case, best kept')
+    parser.add_argument('--save', metavar='FILE', help='write the results as a baseline')
+    parser.add_argument('--compare', metavar='FILE', help='fail on regressions against a baseline')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='allowed fractional p50/rps regression')
+    parser.add_argument('--memory-tolerance', type=float, default=DEFAULT_MEMORY_TOLERANCE,
+                        help='allowed fractional peak allocation growth')
+    args = parser.parse_args(argv)
+    logging.getLogger().setLevel(logging.WARNING)
+
+    cases = build_cases(args.strikes)
+    results = {}
+    for name, fn in cases.items():
+        if args.only and args.only not in name:
+            continue
+        rounds = [measure(fn, args.min_time, args.max_calls) for _ in range(max(1, args.rounds))]
+        results[name] = min(rounds, key=lambda r: r['p50_us'])
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+    print_table(results, baseline)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'python': sys.version.split()[0], 'numpy': np.__version__,
+                       'machine': platform.platform(), 'saved_at': int(time.time()),
+                       'results': results}, f, indent=2)
+        print(f"\nBaseline written to {args.save}")
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance, args.memory_tolerance)
+        if regressions:
+            print("\nRegressions:")
+            for message in regressions:
+                print(f"  {message}")
+            return 1
+        print("\nNo regressions against the baseline.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,91 @@
+"""
+Synthetic option chains and an in-process Redis for the benchmarks and the
+load-test harness.
+
+Chains have the shape Dhan returns from /optionchain ('last_price' plus an
+'oc' mapping of "%.6f" strike -> ce/pe legs) and are deterministic per seed.
+The fake Redis is fakeredis (benchmarks/requirements.txt); install_fake_redis()
+makes backend.redis_client hand it out, so create_app() and the worker code
+run unchanged on top of it.
+
+Usage:
+    text, binary = install_fake_redis()
+    expiry = seed_chain(text, 13, 'IDX_I', make_chain(200))
+    app = create_app()
+"""
+import random
+from datetime import datetime, timedelta
+
+from backend import redis_client as redis_factory
+from backend.expiry_calendar import IST, get_expiry_list
+
+STRIKE_COUNTS = (50, 200, 1000)
+
+
+def make_chain(strikes=200, spot=25013.4, step=50, seed=1):
+    """Dhan-shaped option chain with `strikes` strikes centred on `spot`."""
+    rnd = random.Random(seed)
+    base = round(spot / step) * step - (strikes // 2) * step
+
+    def leg():
+        return {
+            'last_price': round(rnd.uniform(0.05, 500), 2),
+            'previous_close_price': round(rnd.uniform(0.05, 500), 2),
+            'oi': rnd.randint(0, 5_000_000),
+            'previous_oi': rnd.randint(0, 5_000_000),
+            'volume': rnd.randint(0, 90_000_000),
+            'implied_volatility': round(rnd.uniform(5, 40), 4),
+        }
+
+    oc = {f"{base + i * step:.6f}": {'ce': leg(), 'pe': leg()} for i in range(strikes)}
+    return {'last_price': spot, 'oc': oc}
+
+
+def tick_chain(chain, seed, moved=0.2):
+    """Copy of `chain` one tick later: spot and about `moved` of the legs changed."""
+    rnd = random.Random(seed)
+    oc = {}
+    for strike, legs in chain['oc'].items():
+        if rnd.random() < moved:
+            legs = {side: {**leg, 'last_price': round(max(0.05, leg['last_price'] + rnd.uniform(-2, 2)), 2),
+                           'volume': leg['volume'] + rnd.randint(0, 5000)}
+                    for side, leg in legs.items()}
+        oc[strike] = legs
+    return {'last_price': round(chain['last_price'] + rnd.uniform(-5, 5), 2), 'oc': oc}
+
+
+def next_expiry(weekday=1, today=None):
+    """Next date (ISO) falling on `weekday` (Tuesday by default) after today, IST."""
+    today = today or datetime.now(IST).date()
+    return (today + timedelta(days=(weekday - today.weekday() - 1) % 7 + 1)).isoformat()
+
+
+def install_fake_redis():
+    """(text, binary) fakeredis clients sharing one server, installed as the backend's clients."""
+    import fakeredis
+
+    server = fakeredis.FakeServer()
+    text = fakeredis.FakeRedis(server=server, decode_responses=True)
+    binary = fakeredis.FakeRedis(server=server)
+    redis_factory._client, redis_factory._binary_client = text, binary
+    return text, binary
+
+
+class _CalendarSource:
+    """Stands in for DhanClient.fetch_expiry_list when seeding the expiry calendar."""
+
+    def __init__(self, expiries):
+        self.expiries = expiries
+
+    def fetch_expiry_list(self, underlying_scrip, underlying_seg):
+        return {'status': 'success', 'data': self.expiries}
+
+
+def seed_chain(redis_client, scrip_id, segment, chain, expiry=None):
+    """Store `chain` as the worker would, as the current expiry; returns that expiry."""
+    from backend.main import cache_option_chain
+
+    expiry = expiry or next_expiry()
+    get_expiry_list(_CalendarSource([expiry]), redis_client, scrip_id, segment)
+    cache_option_chain(redis_client, scrip_id, segment, expiry, chain)
+    return expiry
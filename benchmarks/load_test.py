@@ -0,0 +1,313 @@
+"""
+HTTP load test for the gunicorn API tier.
+
+Starts a stand-in Redis (fakeredis over TCP, or --redis-url for a real
+one), seeds it with synthetic chains and approved users, keeps the chains
+moving like the worker does (one refresh per instrument every --tick
+seconds) and then, for every --workers x --worker-class combination, starts
+gunicorn on the app and drives it with:
+
+    dashboards  --dashboards clients polling /api/get_option_chain once a
+                second with the dashboard's request (window/order) and its
+                If-None-Match, spread over the instruments
+    signins     Poisson arrivals at --signin-rate per second, one in ten
+                with a wrong password
+
+After --warmup seconds, requests completing in the next --duration seconds
+are counted. The report gives, per configuration and endpoint, achieved
+requests/s against the offered rate, p50/p99/max latency and the error rate
+(transport errors, timeouts and 5xx; 304s and the expected 400s of wrong
+passwords count as successes).
+
+The load generator shares the host with gunicorn, so leave it CPU to spare
+(or compare configurations on the same machine only). Requires gunicorn
+and benchmarks/requirements.txt.
+
+Usage (from the repository root):
+    python -m benchmarks.load_test --dashboards 300 --workers 2 4 --worker-class sync gthread
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+import redis
+
+from benchmarks.fixtures import make_chain, next_expiry, seed_chain, tick_chain
+
+SEGMENT = 'IDX_I'
+APP_SPEC = "backend:create_app('backend.config.ProductionConfig')"
+REQUEST_TIMEOUT = 10
+STARTUP_TIMEOUT = 30
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_stand_in_redis():
+    """(host, port, server) of a fakeredis server on a local TCP port."""
+    from fakeredis import TcpFakeServer
+
+    port = free_port()
+    server = TcpFakeServer(('127.0.0.1', port), server_type='redis')
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return '127.0.0.1', port, server
+
+
+def seed_users(redis_client, count):
+    """Approved accounts in the user store; returns their (email, password) pairs."""
+    from backend.user_store import MIGRATED_KEY, add_pending, set_status
+
+    users = [(f"load{i}@example.com", f"pw{i}") for i in range(count)]
+    # nothing to migrate: keep the API's startup migration from running
+    redis_client.set(MIGRATED_KEY, 'done')
+    for email, password in users:
+        add_pending(redis_client, {'email': email, 'password': password, 'createdAt': ''})
+        set_status(redis_client, email, 'approved', expiry_date='2099-12-31')
+    return users
+
+
+class ChainTicker(threading.Thread):
+    """Refreshes every seeded chain each `interval` seconds, like the worker."""
+
+    def __init__(self, redis_client, chains, expiry, interval):
+        super().__init__(daemon=True)
+        self.redis_client = redis_client
+        self.chains = chains
+        self.expiry = expiry
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        from backend.main import cache_option_chain
+
+        seq = 0
+        while not self.stopped.wait(self.interval):
+            seq += 1
+            for scrip_id, chain in list(self.chains.items()):
+                chain = self.chains[scrip_id] = tick_chain(chain, seed=seq * 1000 + int(scrip_id))
+                cache_option_chain(self.redis_client, scrip_id, SEGMENT, self.expiry, chain)
+
+
+def start_gunicorn(workers, worker_class, threads, redis_host, redis_port):
+    """(process, base url) of a gunicorn serving the API, once it answers."""
+    port = free_port()
+    command = [sys.executable, '-m', 'gunicorn', '-w', str(workers), '-k', worker_class,
+               '-b', f'127.0.0.1:{port}', '--log-level', 'warning', APP_SPEC]
+    if worker_class == 'gthread':
+        command[5:5] = ['--threads', str(threads)]
+    env = {**os.environ, 'REDIS_HOST': redis_host, 'REDIS_PORT': str(redis_port)}
+    process = subprocess.Popen(command, cwd=ROOT, env=env)
+    deadline = time.time() + STARTUP_TIMEOUT
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with {process.returncode}")
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return process, f'http://127.0.0.1:{port}'
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError('gunicorn did not start listening in time')
+
+
+def stop_gunicorn(process):
+    process.terminate()
+    try:
+        process.wait(10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+class Recorder:
+    """Latencies and outcomes per endpoint, for requests done inside the window."""
+
+    def __init__(self, window_start, window_end):
+        self.window = (window_start, window_end)
+        self.latencies = {}
+        self.errors = {}
+        self.statuses = {}
+
+    def add(self, endpoint, done_at, latency, status, ok):
+        if not self.window[0] <= done_at < self.window[1]:
+            return
+        self.latencies.setdefault(endpoint, []).append(latency)
+        self.statuses.setdefault(endpoint, {}).setdefault(status, 0)
+        self.statuses[endpoint][status] += 1
+        if not ok:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    def summary(self, duration, offered):
+        report = {}
+        for endpoint, latencies in sorted(self.latencies.items()):
+            ms = np.array(latencies) * 1000
+            count = len(latencies)
+            report[endpoint] = {
+                'offered_rps': round(offered.get(endpoint, 0), 1),
+                'rps': round(count / duration, 1),
+                'p50_ms': round(float(np.percentile(ms, 50)), 1),
+                'p99_ms': round(float(np.percentile(ms, 99)), 1),
+                'max_ms': round(float(ms.max()), 1),
+                'error_rate': round(self.errors.get(endpoint, 0) / count, 4),
+                'statuses': {str(k): v for k, v in sorted(self.statuses[endpoint].items(), key=str)},
+            }
+        return report
+
+
+async def _request(session, recorder, endpoint, url, body, headers=None, ok_statuses=(200, 304)):
+    started = time.perf_counter()
+    status = 'error'
+    etag = None
+    try:
+        async with session.post(url, json=body, headers=headers) as response:
+            await response.read()
+            status = response.status
+            etag = response.headers.get('ETag')
+    except asyncio.TimeoutError:
+        status = 'timeout'
+    except Exception:
+        status = 'error'
+    recorder.add(endpoint, time.monotonic(), time.perf_counter() - started, status, status in ok_statuses)
+    return status, etag
+
+
+async def dashboard(session, recorder, base_url, scrip_id, view, start_delay, until):
+    await asyncio.sleep(start_delay)
+    body = {'underlying_scrip': scrip_id, 'underlying_seg': SEGMENT, **view}
+    etag = None
+    next_poll = time.monotonic()
+    while time.monotonic() < until:
+        headers = {'If-None-Match': etag} if etag else None
+        status, new_etag = await _request(session, recorder, 'get_option_chain',
+                                          f'{base_url}/api/get_option_chain', body, headers)
+        if status == 200:
+            etag = new_etag
+        next_poll += 1.0
+        await asyncio.sleep(max(0.0, next_poll - time.monotonic()))
+
+
+async def signins(session, recorder, base_url, users, rate, until, rnd):
+    tasks = set()
+    while rate > 0 and time.monotonic() < until:
+        await asyncio.sleep(rnd.expovariate(rate))
+        email, password = rnd.choice(users)
+        wrong = rnd.random() < 0.1
+        body = {'email': email, 'password': 'wrong' if wrong else password}
+        task = asyncio.create_task(_request(session, recorder, 'signin', f'{base_url}/api/signin', body,
+                                            ok_statuses=(400,) if wrong else (200,)))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.wait(tasks)
+
+
+async def run_load(base_url, scrip_ids, users, args):
+    import aiohttp
+
+    now = time.monotonic()
+    window_start = now + args.warmup
+    until = window_start + args.duration
+    recorder = Recorder(window_start, until)
+    view = {'window': args.window, 'order': args.order} if args.window else {}
+    rnd = random.Random(args.seed)
+    connector = aiohttp.TCPConnector(limit=0)
+    timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        clients = [dashboard(session, recorder, base_url, scrip_ids[i % len(scrip_ids)], view,
+                             rnd.uniform(0, args.ramp), until)
+                   for i in range(args.dashboards)]
+        clients.append(signins(session, recorder, base_url, users, args.signin_rate, until, rnd))
+        await asyncio.gather(*clients)
+    offered = {'get_option_chain': args.dashboards, 'signin': args.signin_rate}
+    return recorder.summary(args.duration, offered)
+
+
+def print_report(results):
+    header = (f"{'workers':>7} {'class':>8} {'endpoint':>17} {'offered/s':>10} {'done/s':>8} "
+              f"{'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {'errors':>7}")
+    print(header)
+    print('-' * len(header))
+    for result in results:
+        for endpoint, r in result['endpoints'].items():
+            print(f"{result['workers']:>7} {result['worker_class']:>8} {endpoint:>17} {r['offered_rps']:>10} "
+                  f"{r['rps']:>8} {r['p50_ms']:>8} {r['p99_ms']:>8} {r['max_ms']:>8} "
+                  f"{r['error_rate'] * 100:>6.2f}%")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--dashboards', type=int, default=100, help='clients polling at 1 Hz')
+    parser.add_argument('--signin-rate', type=float, default=2.0, help='signins per second')
+    parser.add_argument('--workers', type=int, nargs='+', default=[4])
+    parser.add_argument('--worker-class', nargs='+', default=['gthread'], help='sync, gthread, gevent, ...')
+    parser.add_argument('--threads', type=int, default=64, help='threads per gthread worker')
+    parser.add_argument('--instruments', type=int, default=5)
+    parser.add_argument('--strikes', type=int, default=200)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--window', type=int, default=12, help='strikes each side in the dashboard request (0: full chain)')
+    parser.add_argument('--order', default='descending')
+    parser.add_argument('--tick', type=float, default=3.0, help='seconds between chain refreshes')
+    parser.add_argument('--ramp', type=float, default=1.0, help='seconds over which dashboards start (0: market-open spike)')
+    parser.add_argument('--warmup', type=float, default=5.0)
+    parser.add_argument('--duration', type=float, default=30.0)
+    parser.add_argument('--redis-url', help='use this Redis instead of the in-process stand-in')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--out', metavar='FILE', help='also write the results as JSON')
+    args = parser.parse_args(argv)
+    logging.getLogger().setLevel(logging.WARNING)
+
+    if args.redis_url:
+        redis_client = redis.Redis.from_url(args.redis_url, decode_responses=True)
+        kwargs = redis_client.connection_pool.connection_kwargs
+        redis_host, redis_port = kwargs['host'], kwargs['port']
+    else:
+        redis_host, redis_port, _ = start_stand_in_redis()
+        redis_client = redis.Redis(host=redis_host, port=redis_port, decode_responses=True)
+
+    expiry = next_expiry()
+    chains = {}
+    for i in range(args.instruments):
+        scrip_id = str(13 + i)
+        chains[scrip_id] = make_chain(args.strikes, seed=i + 1)
+        seed_chain(redis_client, scrip_id, SEGMENT, chains[scrip_id], expiry)
+    users = seed_users(redis_client, args.users)
+    ticker = ChainTicker(redis_client, chains, expiry, args.tick)
+    ticker.start()
+
+    results = []
+    try:
+        for worker_class in args.worker_class:
+            for workers in args.workers:
+                process, base_url = start_gunicorn(workers, worker_class, args.threads, redis_host, redis_port)
+                try:
+                    endpoints = asyncio.run(run_load(base_url, [int(s) for s in chains], users, args))
+                finally:
+                    stop_gunicorn(process)
+                results.append({'workers': workers, 'worker_class': worker_class,
+                                'threads': args.threads if worker_class == 'gthread' else None,
+                                'endpoints': endpoints})
+    finally:
+        ticker.stopped.set()
+
+    print_report(results)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump({'args': vars(args), 'results': results}, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,200 @@
+"""
+The vectorized chain engine and levels against the per-strike code they
+replaced, on fixed synthetic chains.
+
+    pytest tests/
+"""
+import math
+import random
+
+import pytest
+
+from backend.chain_engine import ChainColumns, round2, strike_key
+from backend.levels import strike_levels
+
+
+def make_chain(count, seed, spot=25012.35):
+    """Dhan-shaped chain: zero, NaN and missing previous prices, half-cent ties."""
+    rng = random.Random(seed)
+    first = round(spot / 50) * 50 - count // 2 * 50
+    oc = {}
+    for i in range(count):
+        strike = first + 50 * i
+        row = {}
+        for side in ('ce', 'pe'):
+            ltp = rng.choice([0, round(rng.uniform(0.05, 900), 2), rng.randint(1, 900) + 0.005])
+            leg = {
+                'last_price': ltp,
+                'previous_close_price': rng.choice([0, math.nan, round(ltp * rng.uniform(0.5, 1.5), 2),
+                                                    rng.randint(1, 900) + 0.125]),
+                'oi': rng.choice([0, rng.randint(1, 5_000_000)]),
+                'previous_oi': rng.randint(0, 5_000_000),
+                'volume': rng.choice([0, rng.randint(1, 90_000_000)]),
+                'implied_volatility': rng.choice([0, round(rng.uniform(5, 60), 3), 12.345]),
+            }
+            if rng.random() < 0.05:
+                del leg['previous_close_price']
+            row[side] = leg
+        oc[f"{strike:.6f}"] = row
+    return {'last_price': spot, 'oc': oc}
+
+
+def same(a, b):
+    # equal values, NaN included; the scalar code's zero fallbacks are int 0
+    # where the engine has 0.0, which JSON clients read as the same number
+    if isinstance(a, float) and isinstance(b, float) and math.isnan(a) and math.isnan(b):
+        return True
+    return a == b
+
+
+def scalar_process(chain_data):
+    # process_option_chain() before the columnar engine, less jsonify()
+    underlying_price = chain_data.get('last_price', 0)
+    oc = chain_data.get('oc', {})
+    strikes = sorted([float(k) for k in oc.keys()])
+    processed_chain = []
+    total_call_oi = total_call_vol = total_put_oi = total_put_vol = 0
+    total_call_oi_chg = total_put_oi_chg = 0
+    for strike in strikes:
+        str_strike = f"{strike:.6f}"
+        ce = oc.get(str_strike, {}).get('ce', {})
+        pe = oc.get(str_strike, {}).get('pe', {})
+
+        def get_val(d, key): return d.get(key, 0)
+
+        ce_ltp = get_val(ce, 'last_price')
+        ce_prev_close = get_val(ce, 'previous_close_price')
+        ce_chg_pct = ((ce_ltp - ce_prev_close) / ce_prev_close * 100) if ce_prev_close else 0
+        ce_oi = get_val(ce, 'oi')
+        ce_oi_chg = ce_oi - get_val(ce, 'previous_oi')
+        ce_vol = get_val(ce, 'volume')
+        ce_iv = get_val(ce, 'implied_volatility')
+        ce_tv = ce_ltp - max(underlying_price - strike, 0)
+
+        pe_ltp = get_val(pe, 'last_price')
+        pe_prev_close = get_val(pe, 'previous_close_price')
+        pe_chg_pct = ((pe_ltp - pe_prev_close) / pe_prev_close * 100) if pe_prev_close else 0
+        pe_oi = get_val(pe, 'oi')
+        pe_oi_chg = pe_oi - get_val(pe, 'previous_oi')
+        pe_vol = get_val(pe, 'volume')
+        pe_iv = get_val(pe, 'implied_volatility')
+        pe_tv = pe_ltp - max(strike - underlying_price, 0)
+
+        pcr_oi = (pe_oi / ce_oi) if ce_oi > 0 else 0
+        pcr_vol = (pe_vol / ce_vol) if ce_vol > 0 else 0
+        processed_chain.append({
+            'strike': strike,
+            'pcr_oi': round(pcr_oi, 2),
+            'pcr_vol': round(pcr_vol, 2),
+            'call_iv': round(ce_iv, 2),
+            'call_tv': round(ce_tv, 2),
+            'call_oi_chg': ce_oi_chg,
+            'call_oi': ce_oi,
+            'call_vol': ce_vol,
+            'call_chg_pct': round(ce_chg_pct, 2),
+            'call_ltp': round(ce_ltp, 2),
+            'put_ltp': round(pe_ltp, 2),
+            'put_chg_pct': round(pe_chg_pct, 2),
+            'put_vol': pe_vol,
+            'put_oi': pe_oi,
+            'put_oi_chg': pe_oi_chg,
+            'put_tv': round(pe_tv, 2),
+            'put_iv': round(pe_iv, 2),
+        })
+        total_call_oi += ce_oi
+        total_call_vol += ce_vol
+        total_put_oi += pe_oi
+        total_put_vol += pe_vol
+        total_call_oi_chg += ce_oi_chg
+        total_put_oi_chg += pe_oi_chg
+
+    return {
+        'underlying_price': underlying_price,
+        'atm_strike': min(strikes, key=lambda x: abs(x - underlying_price)),
+        'chain': processed_chain,
+        'totals': {
+            'total_pcr_oi': round((total_put_oi / total_call_oi) if total_call_oi > 0 else 0, 2),
+            'total_pcr_vol': round((total_put_vol / total_call_vol) if total_call_vol > 0 else 0, 2),
+            'total_call_oi': total_call_oi,
+            'total_call_vol': total_call_vol,
+            'total_put_oi': total_put_oi,
+            'total_put_vol': total_put_vol,
+            'total_call_oi_chg': total_call_oi_chg,
+            'total_put_oi_chg': total_put_oi_chg,
+        },
+    }
+
+
+def scalar_levels(nine_thirty_data, t):
+    # calculate_nine_thirty_strike_levels() before backend.levels; strikes are
+    # looked up numerically (the old str(K) lookup never matched Dhan's keys)
+    quotes = nine_thirty_data['strikes']
+
+    def reversal(K):
+        quote = next((q for key, q in quotes.items() if float(key) == K), None)
+        if not quote:
+            return 0
+        return K + (nine_thirty_data['s'] - K + quote['p'] - quote['c'] + K * (1 - math.exp(-0.067 * t)))
+
+    strikes = sorted(float(key) for key in quotes)
+    step = strikes[1] - strikes[0] if len(strikes) > 1 else 50
+    levels = {}
+    for i, K in enumerate(strikes):
+        support = reversal(K - step) if i == 0 else reversal(K)
+        resistance = reversal(strikes[i + 1]) if i < len(strikes) - 1 else reversal(K + step)
+        levels[K] = {'support': f"{support:.4f}", 'resistance': f"{resistance:.4f}"}
+    return levels
+
+
+@pytest.mark.parametrize('count, seed', [(1, 1), (2, 2), (75, 3), (400, 4)])
+def test_payload_matches_scalar_code(count, seed):
+    chain = make_chain(count, seed)
+    expected = scalar_process(chain)
+    payload = ChainColumns.from_chain(chain).to_payload()
+
+    assert len(payload['chain']) == len(expected['chain'])
+    for row, old in zip(payload['chain'], expected['chain']):
+        assert list(row) == list(old)
+        for field, value in old.items():
+            assert same(row[field], value), (row['strike'], field, row[field], value)
+    assert payload['atm_strike'] == expected['atm_strike']
+    assert payload['underlying_price'] == expected['underlying_price']
+    for key, value in expected['totals'].items():
+        assert same(payload['totals'][key], value), key
+
+
+@pytest.mark.parametrize('ltp, prev', [
+    (1.0, 0), (1.0, math.nan), (0, 2.5), (101.005, 100.0), (0.15, 0.1), (2.675, 1.0), (13.1, 11.2),
+    # (ltp / prev - 1) * 100 rounds these differently
+    (302.28, 14.08), (505.61, 248.0), (447.12, 176.64), (674.51, 40.0),
+])
+def test_change_percent_rounding(ltp, prev):
+    chain = {'last_price': 100.0, 'oc': {'100.000000': {
+        'ce': {'last_price': ltp, 'previous_close_price': prev},
+        'pe': {'last_price': ltp, 'previous_close_price': prev},
+    }}}
+    expected = scalar_process(chain)['chain'][0]
+    row = ChainColumns.from_chain(chain).to_payload()['chain'][0]
+    assert same(row['call_chg_pct'], expected['call_chg_pct'])
+    assert same(row['put_chg_pct'], expected['put_chg_pct'])
+
+
+def test_round2_matches_round_on_ties():
+    values = [0.125, 0.135, 2.675, 1.005, -0.125, -2.675, 1e6 + 0.005, 0.0, 99.995, 1.115]
+    assert round2(values).tolist() == [round(v, 2) for v in values]
+
+
+@pytest.mark.parametrize('count, seed', [(1, 5), (2, 6), (60, 7)])
+def test_levels_match_scalar_code(count, seed):
+    chain = make_chain(count, seed)
+    data = {'s': chain['last_price'],
+            'strikes': {key: {'p': row['pe']['last_price'], 'c': row['ce']['last_price']}
+                        for key, row in chain['oc'].items()}}
+    t = 5 / 365
+    levels = strike_levels(data, t)
+    assert levels == {strike_key(K): value for K, value in scalar_levels(data, t).items()}
+
+    # the chain ends have no neighbouring strike to take a level from
+    ordered = [levels[key] for key in sorted(levels, key=float)]
+    assert ordered[0]['support'] == '0.0000'
+    assert ordered[-1]['resistance'] == '0.0000'